@@ -0,0 +1,187 @@
+"""
+Times the filtering of clusters by status and by expiration date, evaluated in SQL
+with and without the indexes of the magiccastle table, compared to the former
+filtering of every cluster in Python, on a SQLite database file.
+
+Usage, from the root of the repository:
+
+    python -m benchmarks.cluster_filter_benchmark [--clusters 10000] [--busy 0.01] [--expiring 0.02]
+"""
+import argparse
+import datetime
+import random
+import tempfile
+import timeit
+
+from os import path
+
+import mchub.configuration
+
+CONFIG = {
+    "auth_type": ["NONE"],
+    "admins": [],
+    "cors_allowed_origins": [],
+    "domains": {"mc.ca": {}},
+    "dns_providers": {},
+}
+
+TODAY = datetime.date(2030, 1, 1)
+
+
+def populate(db, clusters, busy, expiring):
+    from mchub.models.cloud.project import Project
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.models.magic_castle.magic_castle import MagicCastleORM
+    from mchub.models.magic_castle.magic_castle_configuration import (
+        MagicCastleConfiguration,
+    )
+    from mchub.models.magic_castle.plan_type import PlanType
+
+    projects = [
+        Project(name=f"project-{index}", admin_id=1, provider="openstack", env={})
+        for index in range(10)
+    ]
+    db.session.add_all(projects)
+    db.session.commit()
+    random.seed(0)
+    for index in range(clusters):
+        config = MagicCastleConfiguration.from_dict(
+            {
+                "provider": "openstack",
+                "configuration": {
+                    "cluster_name": f"cluster{index}",
+                    "domain": "mc.ca",
+                    "image": "Rocky-8.7-x64-2023-02",
+                    "nb_users": 10,
+                    "instances": {
+                        "mgmt": {"type": "p4-6gb", "count": 1, "tags": ["mgmt"]},
+                        "node": {"type": "p2-3gb", "count": 10, "tags": ["node"]},
+                    },
+                    "volumes": {},
+                    "public_keys": ["ssh-rsa FAKE"],
+                    "guest_passwd": "password",
+                    "hieradata": "",
+                },
+            }
+        )
+        expiration = random.randrange(7, 365)
+        if random.random() < expiring:
+            expiration = random.randrange(-7, 7)
+        db.session.add(
+            MagicCastleORM(
+                hostname=f"cluster{index}.mc.ca",
+                status=ClusterStatusCode.BUILD_RUNNING
+                if random.random() < busy
+                else ClusterStatusCode.PROVISIONING_SUCCESS,
+                plan_type=PlanType.NONE,
+                expiration_date=TODAY + datetime.timedelta(days=expiration),
+                config=config,
+                applied_config=config,
+                project=projects[index % len(projects)],
+            )
+        )
+    db.session.commit()
+    return [project.id for project in projects]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clusters", type=int, default=10000)
+    parser.add_argument("--busy", type=float, default=0.01)
+    parser.add_argument("--expiring", type=float, default=0.02)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    mchub.configuration._config = CONFIG
+    from mchub import create_app
+    from mchub.database import db
+    from mchub.database.schema_manager import SchemaManager
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.models.magic_castle.magic_castle import MagicCastle, MagicCastleORM
+
+    statuses = [ClusterStatusCode.BUILD_RUNNING]
+    expires_before = TODAY + datetime.timedelta(days=1)
+    database_path = path.join(tempfile.mkdtemp(), "database.db")
+    app = create_app(db_path=f"sqlite:///{database_path}")
+    with app.app_context():
+        db.create_all()
+        project_ids = populate(db, args.clusters, args.busy, args.expiring)
+        # As done by mchub.schema_update when the application starts
+        SchemaManager.analyze()
+
+        def python_filter(statuses=None, expires_before=None):
+            return [
+                state
+                for state in MagicCastle.list_states(project_ids)
+                if (statuses is None or state["status"] in statuses)
+                and (
+                    expires_before is None
+                    or state["expiration_date"] is not None
+                    and state["expiration_date"] < expires_before.isoformat()
+                )
+            ]
+
+        def sql_filter(statuses=None, expires_before=None):
+            return MagicCastle.list_states(
+                project_ids, statuses=statuses, expires_before=expires_before
+            )
+
+        def python_status_rows():
+            # The former CleanupManager.clean_status loaded every cluster
+            return [
+                orm
+                for orm in db.session.scalars(db.select(MagicCastleORM)).all()
+                if orm.status in statuses
+            ]
+
+        def sql_status_rows():
+            return db.session.scalars(
+                db.select(MagicCastleORM).where(MagicCastleORM.status.in_(statuses))
+            ).all()
+
+        def time(function, **kwargs):
+            def run():
+                db.session.expire_all()
+                return function(**kwargs)
+
+            return min(timeit.repeat(run, number=1, repeat=args.repeat))
+
+        busy = len(sql_filter(statuses=statuses))
+        expiring = len(sql_filter(expires_before=expires_before))
+        assert busy == len(python_filter(statuses=statuses))
+        assert expiring == len(python_filter(expires_before=expires_before))
+        results = [
+            ("?status, filtered in Python", time(python_filter, statuses=statuses)),
+            ("?status, filtered in SQL", time(sql_filter, statuses=statuses)),
+            (
+                "?expires_before, filtered in Python",
+                time(python_filter, expires_before=expires_before),
+            ),
+            (
+                "?expires_before, filtered in SQL",
+                time(sql_filter, expires_before=expires_before),
+            ),
+            ("status rows, filtered in Python", time(python_status_rows)),
+            ("status rows, filtered in SQL", time(sql_status_rows)),
+        ]
+        for index in MagicCastleORM.__table__.indexes:
+            index.drop(db.engine)
+        results += [
+            ("?status, in SQL without index", time(sql_filter, statuses=statuses)),
+            (
+                "?expires_before, in SQL without index",
+                time(sql_filter, expires_before=expires_before),
+            ),
+            ("status rows, in SQL without index", time(sql_status_rows)),
+        ]
+
+    print(
+        f"{args.clusters} clusters, {busy} matching ?status={statuses[0].value}, "
+        f"{expiring} matching ?expires_before={expires_before}"
+    )
+    for name, duration in results:
+        print(f"{name:40} {duration * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
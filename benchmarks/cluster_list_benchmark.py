@@ -0,0 +1,134 @@
+"""
+Times the listing of clusters (GET /api/magic-castles) with the single-query list
+path, compared to the former path building the state of each cluster object, on an
+in-memory database.
+
+Usage, from the root of the repository:
+
+    python -m benchmarks.cluster_list_benchmark [--clusters 500] [--provisioning 0.1] [--probe-latency 0.05]
+"""
+import argparse
+import timeit
+
+from datetime import datetime
+from time import sleep
+
+import mchub.configuration
+
+CONFIG = {
+    "auth_type": ["NONE"],
+    "admins": [],
+    "cors_allowed_origins": [],
+    "domains": {"mc.ca": {}},
+    "dns_providers": {},
+}
+
+
+def populate(db, clusters, provisioning):
+    from mchub.models.cloud.project import Project
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.models.magic_castle.magic_castle import MagicCastleORM
+    from mchub.models.magic_castle.magic_castle_configuration import (
+        MagicCastleConfiguration,
+    )
+    from mchub.models.magic_castle.plan_type import PlanType
+    from mchub.models.terraform.terraform_state import TerraformState
+
+    projects = [
+        Project(name=f"project-{index}", admin_id=1, provider="openstack", env={})
+        for index in range(10)
+    ]
+    db.session.add_all(projects)
+    db.session.commit()
+    for index in range(clusters):
+        config = MagicCastleConfiguration.from_dict(
+            {
+                "provider": "openstack",
+                "configuration": {
+                    "cluster_name": f"cluster{index}",
+                    "domain": "mc.ca",
+                    "image": "Rocky-8.7-x64-2023-02",
+                    "nb_users": 10,
+                    "instances": {
+                        "mgmt": {"type": "p4-6gb", "count": 1, "tags": ["mgmt"]},
+                        "login": {"type": "p4-6gb", "count": 1, "tags": ["login"]},
+                        "node": {"type": "p2-3gb", "count": 10, "tags": ["node"]},
+                    },
+                    "volumes": {"nfs": {"home": {"size": 100}}},
+                    "public_keys": ["ssh-rsa FAKE"],
+                    "guest_passwd": "password",
+                    "hieradata": "",
+                },
+            }
+        )
+        db.session.add(
+            MagicCastleORM(
+                hostname=f"cluster{index}.mc.ca",
+                status=ClusterStatusCode.PROVISIONING_RUNNING
+                if index < clusters * provisioning
+                else ClusterStatusCode.PROVISIONING_SUCCESS,
+                plan_type=PlanType.NONE,
+                created=datetime.now(),
+                config=config,
+                applied_config=config,
+                tf_state=TerraformState.from_dict({"freeipa_passwd": "password"}),
+                plan={"resource_changes": [{"address": f"r{i}"} for i in range(500)]},
+                project=projects[index % len(projects)],
+            )
+        )
+    db.session.commit()
+    return [project.id for project in projects]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--provisioning", type=float, default=0.1)
+    parser.add_argument("--probe-latency", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    mchub.configuration._config = CONFIG
+    from mchub import create_app
+    from mchub.database import db
+    from mchub.models.cloud.project import Project
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.models.magic_castle.magic_castle import MagicCastle
+
+    def former_state(magic_castle):
+        # The status getter used to probe the clusters being provisioned
+        if magic_castle.orm.status == ClusterStatusCode.PROVISIONING_RUNNING:
+            sleep(args.probe_latency)
+        return magic_castle.state
+
+    app = create_app(db_path="sqlite:///:memory:")
+    with app.app_context():
+        db.create_all()
+        project_ids = populate(db, args.clusters, args.provisioning)
+
+        def former_list():
+            db.session.expire_all()
+            return [
+                former_state(MagicCastle(orm))
+                for project in db.session.scalars(db.select(Project))
+                for orm in project.magic_castles
+            ]
+
+        def single_query_list():
+            db.session.expire_all()
+            return MagicCastle.list_states(project_ids)
+
+        former_time = min(timeit.repeat(former_list, number=1, repeat=args.repeat))
+        single_query_time = min(
+            timeit.repeat(single_query_list, number=1, repeat=args.repeat)
+        )
+    print(
+        f"{args.clusters} clusters, {args.provisioning:.0%} being provisioned, "
+        f"{args.probe_latency * 1000:.0f} ms per probe"
+    )
+    print(f"former list path:       {former_time * 1000:8.1f} ms")
+    print(f"single query list path: {single_query_time * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Measures the requests per second of the API when the authentication type is NONE,
+with the public keys of the ssh agent cached, compared to the former listing of the
+keys with ssh-add on every request, on an in-memory database.
+
+Usage, from the root of the repository:
+
+    python -m benchmarks.local_user_benchmark [--requests 200]
+"""
+import argparse
+import timeit
+
+from types import SimpleNamespace
+
+import mchub.configuration
+
+CONFIG = {
+    "admins": [],
+    "cors_allowed_origins": [],
+    "domains": {"mc.ca": {}},
+    "dns_providers": {},
+}
+
+HOSTNAME = "cluster0.mc.ca"
+
+
+def populate(db):
+    from getpass import getuser
+
+    from mchub.models.cloud.project import Project
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.models.magic_castle.magic_castle import MagicCastleORM
+    from mchub.models.magic_castle.plan_type import PlanType
+    from mchub.models.user import UserORM
+
+    user = UserORM(scoped_id=f"{getuser()}@localhost")
+    db.session.add(user)
+    db.session.commit()
+    project = Project(name="project", admin_id=user.id, provider="openstack", env={})
+    user.projects.append(project)
+    db.session.add(
+        MagicCastleORM(
+            hostname=HOSTNAME,
+            status=ClusterStatusCode.PROVISIONING_SUCCESS,
+            plan_type=PlanType.NONE,
+            project=project,
+        )
+    )
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    from mchub.models.auth_type import AuthType
+
+    mchub.configuration._config = {**CONFIG, "auth_type": [AuthType.NONE]}
+    from mchub import create_app
+    from mchub.database import db
+    from mchub.models import user
+    from mchub.models.ssh_agent_keys import get_ssh_agent_keys, load_ssh_agent_keys
+
+    app = create_app(db_path="sqlite:///:memory:")
+    with app.app_context():
+        db.create_all()
+        populate(db)
+        client = app.test_client()
+
+        def requests_per_second(url):
+            def run():
+                for _ in range(args.requests):
+                    assert client.get(url).status_code == 200
+
+            duration = min(timeit.repeat(run, number=1, repeat=args.repeat))
+            return args.requests / duration
+
+        results = []
+        for url in ("/api/users/me", f"/api/magic-castles/{HOSTNAME}/status"):
+            # The former LocalUser listed the keys of the agent on every request
+            user.get_ssh_agent_keys = lambda: SimpleNamespace(get=load_ssh_agent_keys)
+            former = requests_per_second(url)
+            user.get_ssh_agent_keys = get_ssh_agent_keys
+            cached = requests_per_second(url)
+            results.append((url, former, cached))
+
+    print(f"{'GET':40} {'ssh-add':>12} {'cached':>12}")
+    for url, former, cached in results:
+        print(f"{url:40} {former:8.0f} rps {cached:8.0f} rps")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Compares the single-pass TerraformState extractor with the former jsonpath_ng
+implementation, on the mock clusters states and on large synthetic states.
+
+Usage, from the root of the repository:
+
+    python -m benchmarks.terraform_state_benchmark [--nodes 50 200 1000] [--repeat 5]
+"""
+import argparse
+import json
+import timeit
+
+from os import path, scandir
+
+from jsonpath_ng.ext import parse
+
+from mchub.models.terraform.terraform_state import TerraformState
+
+MOCK_CLUSTERS_PATH = path.join(
+    path.dirname(__file__), "..", "tests", "data", "mock-clusters"
+)
+
+JSONPATH_PARSERS = {
+    "instance_count": parse(
+        "resources[?type=openstack_compute_flavor_v2].instances[*].attributes.id"
+    ),
+    "cores": parse(
+        "resources[?type=openstack_compute_flavor_v2].instances[*].attributes.vcpus"
+    ),
+    "ram": parse(
+        "resources[?type=openstack_compute_flavor_v2].instances[*].attributes.ram"
+    ),
+    "volumes": parse(
+        "resources[?type=openstack_blockstorage_volume_v3].instances[*].attributes.size"
+    ),
+    "instance_volumes": parse(
+        "resources[?type=openstack_compute_instance_v2].instances[*]"
+        ".attributes.block_device[*].volume_size"
+    ),
+    "image": parse("resources[?name=image].instances[0].attributes.name"),
+    "freeipa_passwd": parse(
+        "resources[?name=freeipa_passwd].instances[0].attributes.result"
+    ),
+}
+
+
+def jsonpath_terraform_state(tf_state):
+    """
+    The former jsonpath_ng implementation of TerraformState, used as reference.
+    """
+    volumes = JSONPATH_PARSERS["volumes"].find(tf_state)
+    inst_volumes = JSONPATH_PARSERS["instance_volumes"].find(tf_state)
+    images = JSONPATH_PARSERS["image"].find(tf_state)
+    passwords = JSONPATH_PARSERS["freeipa_passwd"].find(tf_state)
+    return {
+        "instance_count": len(JSONPATH_PARSERS["instance_count"].find(tf_state)),
+        "cores": sum(cores.value for cores in JSONPATH_PARSERS["cores"].find(tf_state)),
+        "ram": sum(ram.value for ram in JSONPATH_PARSERS["ram"].find(tf_state)),
+        "volume_count": len(volumes) + len(inst_volumes),
+        "volume_size": sum(vol.value for vol in volumes)
+        + sum(vol.value for vol in inst_volumes),
+        "image": images[0].value if images else "",
+        "freeipa_passwd": passwords[0].value if passwords else None,
+    }
+
+
+def single_pass_terraform_state(tf_state):
+    state = TerraformState(tf_state)
+    return {slot: getattr(state, slot) for slot in TerraformState.__slots__}
+
+
+def synthetic_state(nodes):
+    """
+    Generates a terraform state shaped like the state of a Magic Castle cluster with
+    the given number of compute nodes.
+    """
+    resources = [
+        {
+            "mode": "data",
+            "type": "openstack_images_image_v2",
+            "name": "image",
+            "instances": [{"attributes": {"name": "Rocky-8.7-x64-2023-02"}}],
+        },
+        {
+            "mode": "managed",
+            "type": "random_string",
+            "name": "freeipa_passwd",
+            "instances": [{"attributes": {"result": "FAKE_PASSWORD"}}],
+        },
+    ]
+    for index in range(nodes):
+        resources += [
+            {
+                "mode": "data",
+                "type": "openstack_compute_flavor_v2",
+                "name": f"flavors_node{index}",
+                "instances": [
+                    {
+                        "attributes": {
+                            "id": f"flavor-{index}",
+                            "vcpus": 8,
+                            "ram": 30720,
+                            "disk": 20,
+                            "extra_specs": {f"key{key}": "value" for key in range(20)},
+                        }
+                    }
+                ],
+            },
+            {
+                "mode": "managed",
+                "type": "openstack_compute_instance_v2",
+                "name": f"instances_node{index}",
+                "instances": [
+                    {
+                        "attributes": {
+                            "name": f"node{index}",
+                            "block_device": [{"volume_size": 20, "uuid": "FAKE"}],
+                            "metadata": {f"key{key}": "value" for key in range(20)},
+                        }
+                    }
+                ],
+            },
+            {
+                "mode": "managed",
+                "type": "openstack_blockstorage_volume_v3",
+                "name": f"volumes_node{index}",
+                "instances": [{"attributes": {"size": 50, "name": f"node{index}"}}],
+            },
+            {
+                "mode": "managed",
+                "type": "openstack_networking_port_v2",
+                "name": f"nic_node{index}",
+                "instances": [
+                    {"attributes": {"fixed_ip": [{"ip_address": "10.0.0.1"}]}}
+                ],
+            },
+        ]
+    return {"version": 4, "resources": resources}
+
+
+def check_mock_clusters():
+    for entry in scandir(MOCK_CLUSTERS_PATH):
+        state_path = path.join(entry.path, "terraform.tfstate")
+        if not path.exists(state_path):
+            continue
+        with open(state_path) as state_file:
+            tf_state = json.load(state_file)
+        assert single_pass_terraform_state(tf_state) == jsonpath_terraform_state(
+            tf_state
+        ), entry.name
+        print(f"{entry.name}: identical results")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--nodes", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    check_mock_clusters()
+    print()
+    print(
+        f"{'nodes':>6} {'size (MB)':>10} {'jsonpath (ms)':>14} "
+        f"{'single pass (ms)':>17} {'speedup':>8}"
+    )
+    for nodes in args.nodes:
+        tf_state = synthetic_state(nodes)
+        assert single_pass_terraform_state(tf_state) == jsonpath_terraform_state(
+            tf_state
+        )
+        size = len(json.dumps(tf_state)) / 1e6
+        jsonpath_time = min(
+            timeit.repeat(
+                lambda: jsonpath_terraform_state(tf_state),
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        single_pass_time = min(
+            timeit.repeat(
+                lambda: TerraformState(tf_state), number=1, repeat=args.repeat
+            )
+        )
+        print(
+            f"{nodes:>6} {size:>10.2f} {jsonpath_time * 1000:>14.1f} "
+            f"{single_pass_time * 1000:>17.2f} "
+            f"{jsonpath_time / single_pass_time:>7.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,13 @@ export default Object.freeze({
   CREATED: "created",
   PLAN_RUNNING: "plan_running",
   PLAN_ERROR: "plan_error",
+  BUILD_QUEUED: "build_queued",
   BUILD_RUNNING: "build_running",
   PROVISIONING_RUNNING: "provisioning_running",
   PROVISIONING_SUCCESS: "provisioning_success",
   PROVISIONING_ERROR: "provisioning_error",
   BUILD_ERROR: "build_error",
+  DESTROY_QUEUED: "destroy_queued",
   DESTROY_RUNNING: "destroy_running",
   DESTROY_ERROR: "destroy_error",
   NOT_FOUND: "not_found",
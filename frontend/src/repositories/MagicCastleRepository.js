@@ -1,4 +1,4 @@
-import Repository from "./Repository";
+import Repository, { baseURL } from "./Repository";
 
 const resource = "/magic-castles";
 
@@ -12,6 +12,9 @@ export default {
   getStatus(hostname) {
     return Repository.get(`${resource}/${hostname}/status`);
   },
+  streamStatus(hostname) {
+    return new EventSource(`${baseURL}${resource}/${hostname}/status`, { withCredentials: true });
+  },
   create(payload) {
     return Repository.post(`${resource}`, payload);
   },
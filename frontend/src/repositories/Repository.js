@@ -1,6 +1,6 @@
 import axios from "axios";
 
-const baseURL = process.env.VUE_APP_API_URL || "/api";
+export const baseURL = process.env.VUE_APP_API_URL || "/api";
 const axiosInstance = axios.create({ baseURL });
 let sessionExpired = false;
 
@@ -6,8 +6,9 @@ from flask_cors import CORS
 
 def create_app(db_path=None):
     from .configuration import get_config, DATABASE_FILENAME
-    from .configuration.env import DIST_PATH, DATABASE_PATH
-    from .database import db
+    from .configuration.env import DIST_PATH, DATABASE_PATH, DATABASE_URI
+    from .database import db, get_engine_options, configure_engine
+    from .jobs.apply_scheduler import get_apply_scheduler
     from .resources.magic_castle_api import MagicCastleAPI
     from .resources.progress_api import ProgressAPI
     from .resources.available_resources_api import AvailableResourcesApi
@@ -16,11 +17,15 @@ def create_app(db_path=None):
     from .resources.template_api import TemplateAPI
 
     if db_path is None:
-        db_path = f"sqlite:///{DATABASE_PATH}/{DATABASE_FILENAME}"
+        db_path = DATABASE_URI or f"sqlite:///{DATABASE_PATH}/{DATABASE_FILENAME}"
     app = Flask(__name__)
     app.config["SQLALCHEMY_DATABASE_URI"] = db_path
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = get_engine_options(db_path)
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.init_app(app)
+    with app.app_context():
+        configure_engine(db.engine)
+    get_apply_scheduler().init_app(app)
 
     # Allows origins set in config file on all routes
     CORS(
@@ -30,4 +30,22 @@ else:
         },
     }
 
+# Resources of the cloud provider modules whose instances follow the instance counts,
+# the targets of the plan of a configuration change limited to instance counts. They
+# follow the module layout of MAGIC_CASTLE_VERSION, the whole configuration is planned
+# when one of them is not found in the installed modules.
+MAGIC_CASTLE_SCALING_RESOURCES = {
+    "openstack": [
+        "openstack_compute_instance_v2.instances",
+        "openstack_networking_port_v2.nic",
+        "openstack_networking_floatingip_v2.fip",
+        "openstack_networking_floatingip_associate_v2.fip",
+        "openstack_blockstorage_volume_v3.volumes",
+        "openstack_compute_volume_attach_v2.attachments",
+        # The hieradata lists the instances, and is uploaded to the puppet servers
+        "module.configuration",
+        "module.provision",
+    ],
+}
+
 MAGIC_CASTLE_ACME_KEY_PEM = environ.get("MAGIC_CASTLE_ACME_KEY_PEM", "")
@@ -1,3 +1,52 @@
+import sqlite3
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from ..configuration.env import (
+    DATABASE_POOL_SIZE,
+    DATABASE_MAX_OVERFLOW,
+    DATABASE_POOL_TIMEOUT,
+    DATABASE_POOL_RECYCLE,
+    SQLITE_BUSY_TIMEOUT,
+)
 
 db = SQLAlchemy()
+
+
+def get_engine_options(database_uri):
+    """
+    :param database_uri: The SQLAlchemy URI of the database.
+    :return: The engine options suited to the database backend.
+    """
+    if make_url(database_uri).get_backend_name() == "sqlite":
+        # A writer waits for the lock held by another writer instead of failing
+        # right away with "database is locked"
+        return {"connect_args": {"timeout": SQLITE_BUSY_TIMEOUT}}
+    return {
+        "pool_size": DATABASE_POOL_SIZE,
+        "max_overflow": DATABASE_MAX_OVERFLOW,
+        "pool_timeout": DATABASE_POOL_TIMEOUT,
+        "pool_recycle": DATABASE_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+def configure_engine(engine):
+    """
+    Switches the SQLite databases to write-ahead logging, so the readers do not block
+    the writer and the writer does not block the readers.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT * 1000)}")
+        cursor.close()
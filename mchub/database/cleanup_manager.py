@@ -1,6 +1,6 @@
-from re import M
-from ..models.magic_castle.magic_castle import MagicCastle, MagicCastleORM
+from ..models.magic_castle.magic_castle import MagicCastleORM
 from ..models.magic_castle.cluster_status_code import ClusterStatusCode
+from ..jobs.apply_scheduler import ApplyJobORM, ApplyJobStatus, get_apply_scheduler
 from . import db
 
 
@@ -8,14 +8,69 @@ class CleanupManager:
     @classmethod
     def clean_status(self):
         """Look for cluster status that are running and default
-        back to a stable state. Applicable when booting the app
-        when and there is definetely no state running.
+        back to a stable state. Applicable when booting the app.
+
+        Apply jobs that were interrupted are queued again to be resumed by the apply
+        scheduler, while queued jobs are left untouched. Apply jobs still run by
+        another process, e.g. the cleanup service, are left untouched as well.
         """
-        for orm in db.session.scalars(db.select(MagicCastleORM)).all():
-            if orm.status == ClusterStatusCode.BUILD_RUNNING:
-                orm.status = ClusterStatusCode.BUILD_ERROR
-            elif orm.status == ClusterStatusCode.PLAN_RUNNING:
+        get_apply_scheduler().requeue_stale_jobs()
+        jobs = {
+            job.cluster_id: job
+            for job in db.session.scalars(db.select(ApplyJobORM)).all()
+        }
+        # Only the clusters in a transient status are loaded, with the status index
+        clusters = db.session.scalars(
+            db.select(MagicCastleORM).where(
+                MagicCastleORM.status.in_(
+                    [
+                        ClusterStatusCode.PLAN_RUNNING,
+                        ClusterStatusCode.BUILD_QUEUED,
+                        ClusterStatusCode.BUILD_RUNNING,
+                        ClusterStatusCode.DESTROY_QUEUED,
+                        ClusterStatusCode.DESTROY_RUNNING,
+                    ]
+                )
+            )
+        ).all()
+        for orm in clusters:
+            job = jobs.pop(orm.id, None)
+            if job is not None and job.status == ApplyJobStatus.RUNNING:
+                # The process running the job is alive
+                continue
+            if orm.status in (
+                ClusterStatusCode.BUILD_RUNNING,
+                ClusterStatusCode.DESTROY_RUNNING,
+            ):
+                if job is not None:
+                    job.resume = True
+                    if orm.status == ClusterStatusCode.BUILD_RUNNING:
+                        orm.status = ClusterStatusCode.BUILD_QUEUED
+                    else:
+                        orm.status = ClusterStatusCode.DESTROY_QUEUED
+                elif orm.status == ClusterStatusCode.BUILD_RUNNING:
+                    orm.status = ClusterStatusCode.BUILD_ERROR
+                else:
+                    orm.status = ClusterStatusCode.DESTROY_ERROR
+            elif orm.status in (
+                ClusterStatusCode.BUILD_QUEUED,
+                ClusterStatusCode.DESTROY_QUEUED,
+            ):
+                if job is None:
+                    if orm.status == ClusterStatusCode.BUILD_QUEUED:
+                        orm.status = ClusterStatusCode.BUILD_ERROR
+                    else:
+                        orm.status = ClusterStatusCode.DESTROY_ERROR
+            else:
+                if job is not None:
+                    # The job was completed, but not removed from the queue
+                    db.session.delete(job)
+                # The plan was interrupted
                 orm.status = ClusterStatusCode.CREATED
-            elif orm.status == ClusterStatusCode.DESTROY_RUNNING:
-                orm.status = ClusterStatusCode.DESTROY_ERROR
+
+        # Remove the jobs of clusters that no longer exist, and the jobs that were
+        # completed but not removed from the queue
+        for job in jobs.values():
+            if job.status != ApplyJobStatus.RUNNING:
+                db.session.delete(job)
         db.session.commit()
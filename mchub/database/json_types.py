@@ -0,0 +1,46 @@
+import json
+
+from sqlalchemy.types import TypeDecorator, Text
+
+
+class CompactJSON(TypeDecorator):
+    """
+    Stores a JSON document as compact text, without the whitespace added by the
+    default separators.
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return json.dumps(value, separators=(",", ":"))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return json.loads(value)
+
+
+class JSONEncodedObject(CompactJSON):
+    """
+    Stores an object as compact JSON text, using the to_dict method of the object
+    and the from_dict class method of its class.
+    """
+
+    cache_ok = True
+
+    def __init__(self, object_class):
+        super().__init__()
+        self.object_class = object_class
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return super().process_bind_param(value.to_dict(), dialect)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self.object_class.from_dict(super().process_result_value(value, dialect))
@@ -0,0 +1,275 @@
+import datetime
+import logging
+import pickle
+
+from sqlalchemy import text
+
+from . import db
+
+schema_version = db.Table(
+    "schema_version",
+    db.Column("version", db.Integer, nullable=False),
+)
+
+
+def convert_pickled_documents():
+    """
+    Stores the configurations, the terraform state and the plan of the clusters as
+    JSON instead of pickled objects.
+    """
+    from ..models.magic_castle.magic_castle import MagicCastleORM
+
+    columns = ["config", "applied_config", "tf_state", "plan"]
+    rows = db.session.execute(
+        text(f"SELECT id, {', '.join(columns)} FROM magiccastle")
+    ).all()
+    for row in rows:
+        values = {}
+        for column in columns:
+            value = getattr(row, column)
+            if isinstance(value, bytes):
+                column_type = MagicCastleORM.__table__.c[column].type
+                values[column] = column_type.process_bind_param(
+                    pickle.loads(value), db.engine.dialect
+                )
+        if values:
+            assignments = ", ".join(f"{column} = :{column}" for column in values)
+            db.session.execute(
+                text(f"UPDATE magiccastle SET {assignments} WHERE id = :id"),
+                {**values, "id": row.id},
+            )
+
+
+def summarize_plans():
+    """
+    Replaces the full terraform plans of the clusters by their summary.
+    """
+    from ..models.magic_castle.magic_castle import MagicCastleORM
+    from ..models.terraform.terraform_plan_parser import TerraformPlanParser
+
+    rows = db.session.execute(
+        db.select(MagicCastleORM.id, MagicCastleORM.plan).where(
+            MagicCastleORM.plan.is_not(None)
+        )
+    ).all()
+    for row in rows:
+        if row.plan is not None and "summary_version" not in row.plan:
+            db.session.execute(
+                db.update(MagicCastleORM)
+                .where(MagicCastleORM.id == row.id)
+                .values(plan=TerraformPlanParser.summarize(row.plan))
+            )
+
+
+def convert_expiration_dates():
+    """
+    Stores the expiration dates of the clusters as dates instead of strings, and
+    indexes them. Expiration dates that are not valid ISO 8601 dates are removed.
+    """
+    from ..models.magic_castle.magic_castle import MagicCastleORM
+
+    rows = db.session.execute(
+        text(
+            "SELECT id, expiration_date FROM magiccastle "
+            "WHERE expiration_date IS NOT NULL"
+        )
+    ).all()
+    for row in rows:
+        try:
+            value = datetime.date.fromisoformat(str(row.expiration_date)[:10])
+            value = value.isoformat()
+        except ValueError:
+            value = None
+        if value != row.expiration_date:
+            db.session.execute(
+                text("UPDATE magiccastle SET expiration_date = :value WHERE id = :id"),
+                {"value": value, "id": row.id},
+            )
+    # SQLite stores the dates as ISO 8601 strings, whatever the column type
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(
+            text(
+                "ALTER TABLE magiccastle ALTER COLUMN expiration_date TYPE DATE "
+                "USING expiration_date::date"
+            )
+        )
+    for index in MagicCastleORM.__table__.indexes:
+        if "expiration_date" in index.columns:
+            index.create(db.session.connection(), checkfirst=True)
+
+
+def index_cluster_status():
+    """
+    Indexes the status of the clusters, alone and by project.
+    """
+    from ..models.magic_castle.magic_castle import MagicCastleORM
+
+    for index in MagicCastleORM.__table__.indexes:
+        if "status" in index.columns:
+            index.create(db.session.connection(), checkfirst=True)
+
+
+def add_cluster_revision():
+    """
+    Adds the revision of the clusters, from which their entity tags are computed.
+    """
+    columns = db.inspect(db.session.connection()).get_columns("magiccastle")
+    if "revision" not in [column["name"] for column in columns]:
+        db.session.execute(
+            text(
+                "ALTER TABLE magiccastle "
+                "ADD COLUMN revision INTEGER NOT NULL DEFAULT 0"
+            )
+        )
+
+
+def add_apply_job_owner():
+    """
+    Adds the process running each apply job and its heartbeat, so the jobs run by
+    another process that is alive are not resumed.
+    """
+    columns = db.inspect(db.session.connection()).get_columns("apply_job")
+    names = [column["name"] for column in columns]
+    if "owner" not in names:
+        db.session.execute(text("ALTER TABLE apply_job ADD COLUMN owner VARCHAR(256)"))
+    if "heartbeat" not in names:
+        db.session.execute(text("ALTER TABLE apply_job ADD COLUMN heartbeat TIMESTAMP"))
+
+
+def convert_project_members():
+    """
+    Stores the ids of the project members as integers, like the primary keys they
+    refer to. PostgreSQL rejects foreign keys between columns of different types.
+    """
+    from ..models.user import projects
+
+    columns = db.inspect(db.session.connection()).get_columns("projects")
+    if all(isinstance(column["type"], db.Integer) for column in columns):
+        return
+    if db.engine.dialect.name == "postgresql":
+        for name in ("user_id", "project_id"):
+            db.session.execute(
+                text(
+                    f"ALTER TABLE projects ALTER COLUMN {name} TYPE INTEGER "
+                    f"USING {name}::integer"
+                )
+            )
+    else:
+        # SQLite cannot change the type of a column, the table is copied
+        db.session.execute(text("ALTER TABLE projects RENAME TO projects_old"))
+        projects.create(db.session.connection())
+        db.session.execute(
+            text(
+                "INSERT INTO projects (user_id, project_id) "
+                "SELECT CAST(user_id AS INTEGER), CAST(project_id AS INTEGER) "
+                "FROM projects_old"
+            )
+        )
+        db.session.execute(text("DROP TABLE projects_old"))
+
+
+def add_user_membership_revision():
+    """
+    Adds the revision of the project membership of the users, with which the user
+    cache of each process finds out about the changes made by the other processes.
+    """
+    columns = db.inspect(db.session.connection()).get_columns("user")
+    if "membership_revision" not in [column["name"] for column in columns]:
+        db.session.execute(
+            text(
+                'ALTER TABLE "user" '
+                "ADD COLUMN membership_revision INTEGER NOT NULL DEFAULT 0"
+            )
+        )
+
+
+def add_cluster_plan_error():
+    """
+    Adds the error of the last failed plan of the clusters, reported by their status.
+    """
+    columns = db.inspect(db.session.connection()).get_columns("magiccastle")
+    if "plan_error" not in [column["name"] for column in columns]:
+        db.session.execute(text("ALTER TABLE magiccastle ADD COLUMN plan_error TEXT"))
+
+
+def add_project_revision():
+    """
+    Adds the revision of the projects, included in the entity tags of their clusters.
+    """
+    columns = db.inspect(db.session.connection()).get_columns("project")
+    if "revision" not in [column["name"] for column in columns]:
+        db.session.execute(
+            text("ALTER TABLE project ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+        )
+
+
+# Migrations of the existing databases, by schema version
+MIGRATIONS = [
+    (1, convert_pickled_documents),
+    (2, summarize_plans),
+    (3, convert_expiration_dates),
+    (4, index_cluster_status),
+    (5, add_cluster_revision),
+    (6, add_apply_job_owner),
+    (7, convert_project_members),
+    (8, add_user_membership_revision),
+    (9, add_cluster_plan_error),
+    (10, add_project_revision),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+class SchemaManager:
+    """
+    SchemaManager applies the migrations that db.create_all can not, i.e. the changes
+    to the columns or to the data of an existing database. The version of the schema
+    is kept in the schema_version table.
+    """
+
+    @staticmethod
+    def get_version():
+        schema_version.create(db.session.connection(), checkfirst=True)
+        version = db.session.scalar(db.select(schema_version.c.version))
+        return 0 if version is None else version
+
+    @staticmethod
+    def set_version(version):
+        schema_version.create(db.session.connection(), checkfirst=True)
+        db.session.execute(schema_version.delete())
+        db.session.execute(schema_version.insert().values(version=version))
+
+    @classmethod
+    def stamp(cls):
+        """
+        Marks a database created with the latest schema as up to date.
+        """
+        cls.set_version(LATEST_VERSION)
+        db.session.commit()
+
+    @classmethod
+    def update(cls):
+        """
+        Applies the migrations that are more recent than the version of the database.
+        Each migration is committed with its version.
+        """
+        version = cls.get_version()
+        for migration_version, migration in MIGRATIONS:
+            if migration_version > version:
+                logging.info(
+                    f"Applying schema migration {migration_version}: "
+                    f"{migration.__name__}"
+                )
+                migration()
+                cls.set_version(migration_version)
+                db.session.commit()
+
+    @staticmethod
+    def analyze():
+        """
+        Refreshes the statistics the query planner uses to choose between the indexes,
+        e.g. the expiration date index rather than the project index for the clusters
+        expiring soon.
+        """
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
@@ -1,41 +1,151 @@
 """Before starting MC-Hub, we have to verify that clusters with a
 main.tf.json have their plugin folder correctly initialized. To do
-this, we scan the clusters folder and call terraform init in each
-folder with a main.tf.json.
+this, we scan the clusters folder and initialize each folder with a
+main.tf.json, from the terraform skeleton matching its modules or
+with terraform init. Folders whose modules and dependency lock file
+are unchanged since their last successful initialization are skipped.
 """
 
 import argparse
+import json
 
+from concurrent.futures import ThreadPoolExecutor
 from os import scandir, path
-from subprocess import run
-from logging import getLogger
-from sys import exit
+from logging import getLogger, basicConfig, INFO
+from subprocess import TimeoutExpired
+from sys import exit, stdout
+from time import perf_counter
+
+from .configuration.env import CLUSTERS_PATH, INIT_MAX_WORKERS, INIT_TIMEOUT
+from .configuration.magic_castle import MAIN_TERRAFORM_FILENAME
+from .models.terraform.terraform_init import get_terraform_init_manager
+
+FAILED = "failed"
+TIMEOUT = "timeout"
+
+logger = getLogger()
+
+
+def init_cluster(cluster_path, upgrade, timeout):
+    """
+    Initializes a single cluster, any failure is reported instead of raised.
+
+    :return: The report of the cluster initialization.
+    """
+    start = perf_counter()
+    error = None
+    try:
+        result = (
+            get_terraform_init_manager()
+            .init(cluster_path, upgrade=upgrade, timeout=timeout)
+            .value
+        )
+    except TimeoutExpired as exception:
+        result, error = TIMEOUT, exception
+    except Exception as exception:
+        result, error = FAILED, exception
+
+    duration = perf_counter() - start
+    if error is not None:
+        logger.error(f"Could not initialize cluster folder {cluster_path}: {error}")
+        logger.debug(getattr(error, "stderr", None))
+        logger.debug(getattr(error, "stdout", None))
+    return {
+        "cluster": path.basename(cluster_path),
+        "result": result,
+        "duration": round(duration, 3),
+        "error": None if error is None else str(error),
+    }
+
+
+def init_clusters(
+    clusters_path, upgrade=False, max_workers=INIT_MAX_WORKERS, timeout=INIT_TIMEOUT
+):
+    """
+    Initializes the clusters in a bounded pool of workers and logs a timing summary.
+    A cluster failing or timing out does not prevent the others from being initialized.
+
+    :param clusters_path: The folder containing the cluster folders.
+    :param upgrade: True to run terraform init -upgrade in every cluster folder.
+    :param max_workers: The number of clusters initialized concurrently.
+    :param timeout: The number of seconds after which a terraform init is killed.
+    :return: The report of the initialization, see the clusters and summary keys.
+    """
+    start = perf_counter()
+    with scandir(clusters_path) as it:
+        cluster_paths = sorted(
+            entry.path
+            for entry in it
+            if entry.is_dir()
+            and not entry.name.startswith(".")
+            and path.isfile(path.join(entry.path, MAIN_TERRAFORM_FILENAME))
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        clusters = list(
+            executor.map(
+                lambda cluster_path: init_cluster(cluster_path, upgrade, timeout),
+                cluster_paths,
+            )
+        )
+
+    summary = {}
+    for cluster in clusters:
+        summary[cluster["result"]] = summary.get(cluster["result"], 0) + 1
+    report = {
+        "duration": round(perf_counter() - start, 3),
+        "workers": max_workers,
+        "summary": summary,
+        "clusters": clusters,
+    }
+
+    logger.info(
+        f"Initialized {len(clusters)} clusters in {report['duration']:.1f} s with "
+        f"{max_workers} workers: "
+        + ", ".join(f"{count} {result}" for result, count in sorted(summary.items()))
+    )
+    slowest = sorted(clusters, key=lambda cluster: cluster["duration"], reverse=True)
+    for cluster in slowest[:5]:
+        logger.info(
+            f"  {cluster['duration']:6.1f} s {cluster['cluster']} ({cluster['result']})"
+        )
+    return report
 
-from .configuration.env import CLUSTERS_PATH
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Scan CLUSTERS_PATH and initialized all clusters with terraform"
     )
     parser.add_argument("--upgrade", action="store_true")
+    parser.add_argument("--workers", type=int, default=INIT_MAX_WORKERS)
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=INIT_TIMEOUT,
+        help="seconds after which the initialization of a cluster is abandoned",
+    )
+    parser.add_argument(
+        "--report", help="write a JSON report to this file, - for the standard output"
+    )
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="exit with an error status when a cluster could not be initialized",
+    )
     arguments = parser.parse_args()
 
-    logger = getLogger()
-    for fd in scandir(CLUSTERS_PATH):
-        if fd.is_dir():
-            cmd_args = ["terraform", "init", "-no-color", "-input=false"]
-            if arguments.upgrade:
-                cmd_args += ["-upgrade"]
-            try:
-                cmd = run(
-                    cmd_args,
-                    cwd=path.join(CLUSTERS_PATH, fd),
-                    check=True,
-                    capture_output=True,
-                )
-            except Exception as error:
-                logger.error("Could not initialize cluster folder {}".format(fd))
-                logger.debug(error)
-                logger.debug(cmd.stderr)
-                logger.debug(cmd.stdout)
-                exit(1)
+    basicConfig(level=INFO)
+    report = init_clusters(
+        CLUSTERS_PATH,
+        upgrade=arguments.upgrade,
+        max_workers=arguments.workers,
+        timeout=arguments.timeout,
+    )
+    if arguments.report == "-":
+        json.dump(report, stdout, indent=2)
+    elif arguments.report:
+        with open(arguments.report, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+
+    if arguments.strict and report["summary"].keys() & {FAILED, TIMEOUT}:
+        exit(1)
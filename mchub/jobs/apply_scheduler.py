@@ -0,0 +1,364 @@
+import datetime
+import enum
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from os import getpid
+from socket import gethostname
+from threading import Lock, Thread
+from time import sleep
+
+from flask import current_app
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import func, or_
+
+from ..configuration.env import (
+    APPLY_MAX_JOBS,
+    APPLY_MAX_JOBS_PER_PROJECT,
+    APPLY_HEARTBEAT_INTERVAL,
+    APPLY_HEARTBEAT_TIMEOUT,
+)
+from ..database import db
+
+
+class ApplyJobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+
+
+class ApplyJobORM(db.Model):
+    __tablename__ = "apply_job"
+    id = db.Column(db.Integer, primary_key=True)
+    cluster_id = db.Column(
+        db.Integer,
+        db.ForeignKey("magiccastle.id", ondelete="CASCADE"),
+        unique=True,
+        nullable=False,
+    )
+    project_id = db.Column(db.Integer, db.ForeignKey("project.id"), nullable=False)
+    status = db.Column(db.Enum(ApplyJobStatus), default=ApplyJobStatus.QUEUED)
+    priority = db.Column(db.Integer, default=0)
+    resume = db.Column(db.Boolean, default=False)
+    created = db.Column(db.DateTime(), default=func.now())
+    # The process running the job, and the last time it reported to be alive
+    owner = db.Column(db.String(256))
+    heartbeat = db.Column(db.DateTime())
+
+
+def utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class ApplyScheduler:
+    """
+    ApplyScheduler runs terraform apply jobs while limiting how many of them run at
+    the same time, on the whole host and for each project.
+
+    Jobs are persisted in the apply_job table, which is shared by every gunicorn
+    worker. Queued jobs are started by order of priority, then in FIFO order, whenever
+    a job is queued or completed. Jobs are claimed with a conditional update so two
+    workers can never start the same job, nor start more jobs than the limits allow.
+
+    The jobs are also shared with the other processes using the database, e.g. the
+    cleanup service. A running job records the process that owns it, which updates
+    its heartbeat every heartbeat_interval seconds. A running job whose heartbeat is
+    older than heartbeat_timeout seconds was interrupted with its process, and is
+    queued again to be resumed by any of the processes.
+    """
+
+    def __init__(
+        self,
+        max_jobs,
+        max_jobs_per_project,
+        heartbeat_interval=APPLY_HEARTBEAT_INTERVAL,
+        heartbeat_timeout=APPLY_HEARTBEAT_TIMEOUT,
+    ):
+        self.max_jobs = max_jobs
+        self.max_jobs_per_project = max_jobs_per_project
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.owner = f"{gethostname()}:{getpid()}"
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_jobs, thread_name_prefix="terraform-apply"
+        )
+        self._resumed = False
+        self._lock = Lock()
+        self._running = set()
+        self._heartbeat_thread = None
+
+    def init_app(self, app):
+        app.before_request(self._resume)
+
+    def _resume(self):
+        # Start the jobs left in the queue by a previous run of the application
+        # on the first request received by this process.
+        if not self._resumed:
+            self._resumed = True
+            self.dispatch()
+
+    def enqueue(self, cluster_id, project_id, *, priority=0, resume=False):
+        """
+        Adds an apply job to the queue and starts it if the concurrency limits allow it.
+
+        :param priority: Jobs with a higher priority are started first.
+        :param resume: True if the job was interrupted and its plan is no longer valid.
+        :return: The id of the queued job.
+        """
+        job = ApplyJobORM(
+            cluster_id=cluster_id,
+            project_id=project_id,
+            priority=priority,
+            resume=resume,
+        )
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+        self.dispatch()
+        return job_id
+
+    def claim(self):
+        """
+        Marks as running the queued jobs that fit within the concurrency limits.
+
+        :return: The ids of the claimed jobs.
+        """
+        running = dict(
+            db.session.execute(
+                db.select(ApplyJobORM.project_id, func.count())
+                .filter_by(status=ApplyJobStatus.RUNNING)
+                .group_by(ApplyJobORM.project_id)
+            ).all()
+        )
+        total_running = sum(running.values())
+        queued = db.session.execute(
+            db.select(ApplyJobORM.id, ApplyJobORM.project_id)
+            .filter_by(status=ApplyJobStatus.QUEUED)
+            .order_by(ApplyJobORM.priority.desc(), ApplyJobORM.id)
+        ).all()
+
+        claimed = []
+        for job_id, project_id in queued:
+            if total_running >= self.max_jobs:
+                break
+            if running.get(project_id, 0) >= self.max_jobs_per_project:
+                continue
+            if self._claim_job(job_id, project_id):
+                claimed.append(job_id)
+                running[project_id] = running.get(project_id, 0) + 1
+                total_running += 1
+        db.session.commit()
+        return claimed
+
+    def _claim_job(self, job_id, project_id):
+        other = aliased(ApplyJobORM)
+        running_count = (
+            db.select(func.count())
+            .select_from(other)
+            .where(other.status == ApplyJobStatus.RUNNING)
+        )
+        project_running_count = running_count.where(other.project_id == project_id)
+        result = db.session.execute(
+            db.update(ApplyJobORM)
+            .where(
+                ApplyJobORM.id == job_id,
+                ApplyJobORM.status == ApplyJobStatus.QUEUED,
+                running_count.scalar_subquery() < self.max_jobs,
+                project_running_count.scalar_subquery() < self.max_jobs_per_project,
+            )
+            .values(
+                status=ApplyJobStatus.RUNNING, owner=self.owner, heartbeat=utcnow()
+            )
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    def beat(self):
+        """
+        Updates the heartbeat of the jobs run by this process.
+        """
+        with self._lock:
+            running = list(self._running)
+        if running:
+            db.session.execute(
+                db.update(ApplyJobORM)
+                .where(ApplyJobORM.id.in_(running), ApplyJobORM.owner == self.owner)
+                .values(heartbeat=utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+
+    def requeue_stale_jobs(self):
+        """
+        Queues again the running jobs whose process stopped updating their heartbeat.
+        The jobs whose terraform apply was started are resumed, see run_apply.
+
+        The changes are not committed.
+
+        :return: The number of jobs queued again.
+        """
+        from ..models.magic_castle.magic_castle import MagicCastleORM
+        from ..models.magic_castle.cluster_status_code import ClusterStatusCode
+
+        active_statuses = (
+            ClusterStatusCode.BUILD_QUEUED,
+            ClusterStatusCode.BUILD_RUNNING,
+            ClusterStatusCode.DESTROY_QUEUED,
+            ClusterStatusCode.DESTROY_RUNNING,
+        )
+        cutoff = utcnow() - datetime.timedelta(seconds=self.heartbeat_timeout)
+        jobs = db.session.scalars(
+            db.select(ApplyJobORM).where(
+                ApplyJobORM.status == ApplyJobStatus.RUNNING,
+                or_(ApplyJobORM.heartbeat.is_(None), ApplyJobORM.heartbeat < cutoff),
+            )
+        ).all()
+        count = 0
+        for job in jobs:
+            orm = db.session.get(MagicCastleORM, job.cluster_id)
+            if orm is None or orm.status not in active_statuses:
+                # The job was completed, but not removed from the queue
+                db.session.execute(
+                    db.delete(ApplyJobORM).where(
+                        ApplyJobORM.id == job.id, ApplyJobORM.owner == job.owner
+                    )
+                )
+                db.session.expire(job)
+                continue
+            resume = orm.status in (
+                ClusterStatusCode.BUILD_RUNNING,
+                ClusterStatusCode.DESTROY_RUNNING,
+            )
+            # Unless its process came back to life, or another process requeued it
+            result = db.session.execute(
+                db.update(ApplyJobORM)
+                .where(
+                    ApplyJobORM.id == job.id,
+                    ApplyJobORM.status == ApplyJobStatus.RUNNING,
+                    ApplyJobORM.heartbeat.is_(None)
+                    if job.heartbeat is None
+                    else ApplyJobORM.heartbeat == job.heartbeat,
+                )
+                .values(
+                    status=ApplyJobStatus.QUEUED,
+                    resume=job.resume or resume,
+                    owner=None,
+                    heartbeat=None,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            db.session.expire(job)
+            if result.rowcount != 1:
+                continue
+            logging.warning(f"Apply job {job.id} was interrupted, queued again")
+            if orm.status == ClusterStatusCode.BUILD_RUNNING:
+                orm.status = ClusterStatusCode.BUILD_QUEUED
+            elif orm.status == ClusterStatusCode.DESTROY_RUNNING:
+                orm.status = ClusterStatusCode.DESTROY_QUEUED
+            count += 1
+        return count
+
+    def _start_heartbeat(self, app):
+        with self._lock:
+            if self._heartbeat_thread is not None:
+                return
+            self._heartbeat_thread = Thread(
+                target=self._heartbeat, args=(app,), daemon=True
+            )
+        self._heartbeat_thread.start()
+
+    def _heartbeat(self, app):
+        while True:
+            sleep(self.heartbeat_interval)
+            with app.app_context():
+                try:
+                    self.beat()
+                    if self.requeue_stale_jobs():
+                        db.session.commit()
+                        self.dispatch()
+                    else:
+                        db.session.rollback()
+                except Exception as error:
+                    logging.error(f"Apply jobs heartbeat failed: {error}")
+                    db.session.rollback()
+
+    def dispatch(self):
+        """
+        Starts the queued jobs that fit within the concurrency limits.
+        """
+        app = current_app._get_current_object()
+        self._start_heartbeat(app)
+        for job_id in self.claim():
+            with self._lock:
+                self._running.add(job_id)
+            self._executor.submit(self._run, app, job_id)
+
+    def _run(self, app, job_id):
+        with app.app_context():
+            self.run(job_id)
+
+    def _set_error_status(self, job_id):
+        """
+        Sets the cluster of a job that failed before terraform apply saved its results
+        in error, so it is not left queued or running once the job is removed.
+        """
+        from ..models.magic_castle.cluster_status_code import ClusterStatusCode
+        from ..models.magic_castle.magic_castle import MagicCastleORM
+
+        try:
+            job = db.session.get(ApplyJobORM, job_id)
+            orm = job and db.session.get(MagicCastleORM, job.cluster_id)
+            if orm is None:
+                return
+            if orm.status in (
+                ClusterStatusCode.BUILD_QUEUED,
+                ClusterStatusCode.BUILD_RUNNING,
+            ):
+                orm.status = ClusterStatusCode.BUILD_ERROR
+            elif orm.status in (
+                ClusterStatusCode.DESTROY_QUEUED,
+                ClusterStatusCode.DESTROY_RUNNING,
+            ):
+                orm.status = ClusterStatusCode.DESTROY_ERROR
+            db.session.commit()
+        except Exception as error:
+            logging.error(f"Could not set the status of apply job {job_id}: {error}")
+            db.session.rollback()
+
+    def run(self, job_id):
+        """
+        Runs a claimed job, removes it from the queue, then starts the next jobs.
+        """
+        from ..models.magic_castle.magic_castle import MagicCastle, MagicCastleORM
+
+        try:
+            job = db.session.get(ApplyJobORM, job_id)
+            orm = db.session.get(MagicCastleORM, job.cluster_id)
+            MagicCastle(orm).run_apply(resume=job.resume)
+        except Exception as error:
+            logging.error(f"Apply job {job_id} failed: {error}")
+            db.session.rollback()
+            self._set_error_status(job_id)
+        finally:
+            db.session.rollback()
+            with self._lock:
+                self._running.discard(job_id)
+            # Unless the job was considered interrupted and queued again
+            db.session.execute(
+                db.delete(ApplyJobORM).filter_by(id=job_id, owner=self.owner)
+            )
+            db.session.commit()
+            self.dispatch()
+
+
+_apply_scheduler = None
+_apply_scheduler_lock = Lock()
+
+
+def get_apply_scheduler():
+    global _apply_scheduler
+    with _apply_scheduler_lock:
+        if _apply_scheduler is None:
+            _apply_scheduler = ApplyScheduler(
+                APPLY_MAX_JOBS, APPLY_MAX_JOBS_PER_PROJECT
+            )
+    return _apply_scheduler
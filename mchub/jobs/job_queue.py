@@ -0,0 +1,97 @@
+import logging
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from uuid import uuid4
+
+from flask import current_app
+
+from ..configuration.env import PLAN_MAX_WORKERS
+from ..exceptions.server_exception import ServerException
+
+# Number of finished jobs kept around so their outcome can still be retrieved
+MAX_FINISHED_JOBS = 256
+
+
+class JobQueue:
+    """
+    JobQueue runs long-lived jobs, like terraform plan, in a bounded pool of background
+    workers. Submitting a job returns immediately with a job id, which can be used to
+    wait for the job outcome.
+
+    Jobs are executed in an application context of the app that submitted them, which
+    gives them access to the database. Under the gevent worker class of gunicorn, the
+    workers are greenlets.
+    """
+
+    def __init__(self, max_workers, name):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name
+        )
+        self._futures = OrderedDict()
+        self._lock = Lock()
+
+    def submit(self, job, *args, **kwargs):
+        """
+        Queues a job for execution.
+
+        :param job: The function to run in the background.
+        :return: The id of the queued job.
+        """
+        app = current_app._get_current_object()
+        job_id = uuid4().hex
+        future = self._executor.submit(self._run, app, job, *args, **kwargs)
+        with self._lock:
+            self._futures[job_id] = future
+            self._prune()
+        return job_id
+
+    def wait(self, job_id, timeout=None):
+        """
+        Blocks until a job is completed and returns its result. If the job raised an
+        exception, the exception is raised again.
+
+        :param job_id: The id returned by submit.
+        :param timeout: The maximum number of seconds to wait.
+        :return: The value returned by the job, or None if the job is unknown.
+        """
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is None:
+            return None
+        return future.result(timeout=timeout)
+
+    def is_running(self, job_id):
+        with self._lock:
+            future = self._futures.get(job_id)
+        return future is not None and not future.done()
+
+    def _prune(self):
+        finished = [job_id for job_id, future in self._futures.items() if future.done()]
+        for job_id in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._futures[job_id]
+
+    @staticmethod
+    def _run(app, job, *args, **kwargs):
+        with app.app_context():
+            try:
+                return job(*args, **kwargs)
+            except ServerException:
+                # Server exceptions are logged when they are instantiated
+                raise
+            except Exception as error:
+                logging.error(f"Job {job.__name__} failed: {error}")
+                raise
+
+
+_plan_queue = None
+_plan_queue_lock = Lock()
+
+
+def get_plan_queue():
+    global _plan_queue
+    with _plan_queue_lock:
+        if _plan_queue is None:
+            _plan_queue = JobQueue(PLAN_MAX_WORKERS, "terraform-plan")
+    return _plan_queue
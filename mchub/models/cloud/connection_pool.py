@@ -0,0 +1,116 @@
+import hashlib
+import logging
+import openstack
+
+from threading import Lock
+from time import monotonic
+
+from ...configuration.env import OPENSTACK_CONNECTION_IDLE_TTL
+
+
+def hash_credentials(env):
+    return hashlib.sha256(
+        repr(sorted(env.items())).encode(), usedforsecurity=False
+    ).hexdigest()
+
+
+class OpenStackConnectionPool:
+    """
+    Process-wide pool of authenticated OpenStack connections, keyed by the hash of a
+    project's credentials.
+
+    A connection is shared by every manager of the projects with the same
+    credentials: its keystone session is thread-safe and re-authenticates by itself
+    when its token nears expiry, so the token and the TCP/TLS connections are reused
+    across requests. A connection is closed once it has not been used for
+    OPENSTACK_CONNECTION_IDLE_TTL seconds.
+
+    When the credentials of a project change or when it is deleted, its connection is
+    removed from the pool unless another project still uses it, but it is not closed:
+    a request or a fetch_resources thread may still hold it. It is then released with
+    the last manager referring to it.
+    """
+
+    def __init__(self, idle_ttl=OPENSTACK_CONNECTION_IDLE_TTL):
+        self._idle_ttl = idle_ttl
+        self._lock = Lock()
+        # credentials hash -> [connection, creation lock, last use]
+        self._connections = {}
+        # project id -> credentials hash
+        self._projects = {}
+
+    def get(self, project):
+        """
+        Returns the connection of a project, connecting only if it is not in the pool.
+
+        :param project: The project, with its OS_* environment variables.
+        :return: The openstack.connection.Connection of the project.
+        """
+        key = hash_credentials(project.env)
+        evicted = []
+        with self._lock:
+            now = monotonic()
+            previous_key = self._projects.get(project.id)
+            self._projects[project.id] = key
+            if previous_key != key:
+                # The credentials of the project have been updated
+                self._release(previous_key)
+            for other_key, entry in list(self._connections.items()):
+                if now - entry[2] > self._idle_ttl:
+                    evicted.append(self._connections.pop(other_key))
+            entry = self._connections.get(key)
+            if entry is None:
+                entry = self._connections[key] = [None, Lock(), now]
+            entry[2] = now
+        self._close(evicted)
+
+        # Concurrent requests of the same project wait for a single authentication
+        with entry[1]:
+            if entry[0] is None:
+                # Convert OS_* environment variable in keyword arguments
+                kargs = {key[3:].lower(): value for key, value in project.env.items()}
+                kargs["auth_type"] = "v3applicationcredential"
+                entry[0] = openstack.connect(**kargs)
+            return entry[0]
+
+    def evict(self, project_id):
+        """
+        Removes the connection of a project from the pool, for instance when it is
+        deleted, unless another project uses the same credentials.
+        """
+        with self._lock:
+            self._release(self._projects.pop(project_id, None))
+
+    def _release(self, key):
+        # Called with the lock held. The connection is not closed, it may be in use.
+        if key is not None and key not in self._projects.values():
+            self._connections.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._connections.values())
+            self._connections.clear()
+            self._projects.clear()
+        self._close(entries)
+
+    @staticmethod
+    def _close(entries):
+        for entry in entries:
+            if entry is None or entry[0] is None:
+                continue
+            try:
+                entry[0].close()
+            except Exception as error:
+                logging.warning(f"Could not close OpenStack connection: {error}")
+
+
+_pool = None
+_pool_lock = Lock()
+
+
+def get_connection_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OpenStackConnectionPool()
+        return _pool
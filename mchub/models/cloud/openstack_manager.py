@@ -1,7 +1,13 @@
-import openstack
+import logging
 
+from concurrent.futures import ThreadPoolExecutor, wait
 from os import environ, path
 from re import match, IGNORECASE, compile
+from threading import Lock
+
+from .connection_pool import get_connection_pool
+from .resource_cache import CloudResource, QUOTAS, get_cloud_resource_cache
+from ...configuration.env import OPENSTACK_API_TIMEOUT
 
 VALID_IMAGES_REGEX_ARRAY = [
     compile(r"rocky-8", IGNORECASE),
@@ -20,6 +26,16 @@ TAG_MINIMUM_REQUIREMENTS = {
     "node": {"ram": 2048, "vcpus": 1},
 }
 
+# Cloud resource required by each quota
+QUOTA_RESOURCES = {
+    "instance_count": CloudResource.COMPUTE_QUOTAS,
+    "ram": CloudResource.COMPUTE_QUOTAS,
+    "vcpus": CloudResource.COMPUTE_QUOTAS,
+    "volume_count": CloudResource.VOLUME_QUOTAS,
+    "volume_size": CloudResource.VOLUME_QUOTAS,
+    "ips": CloudResource.NETWORK_QUOTAS,
+}
+
 
 def validate_flavor(tag, flavor):
     return (
@@ -47,6 +63,9 @@ class OpenStackManager:
         "_compute_quotas",
         "_network_quotas",
         "_available_flavors",
+        "_images",
+        "_failed_resources",
+        "_lock",
     ]
 
     def __init__(
@@ -73,22 +92,25 @@ class OpenStackManager:
         self._network_quotas = None
 
         self._available_flavors = None
+        self._images = None
+
+        self._failed_resources = set()
+        self._lock = Lock()
 
     @property
     def connection(self):
-        if self._con is None:
-            # Convert OS_* environment variable in keyword arguments
-            kargs = {key[3:].lower(): value for key,
-                     value in self.project.env.items()}
-            kargs["auth_type"] = "v3applicationcredential"
-            self._con = openstack.connect(**kargs)
+        # The resources can be fetched concurrently, see available_resources
+        with self._lock:
+            if self._con is None:
+                self._con = get_connection_pool().get(self.project)
+                self._project_id = self._con.current_project_id
 
         return self._con
 
     @property
     def project_id(self):
         if self._project_id is None:
-            self._project_id = self.connection.current_project_id
+            self.connection
         return self._project_id
 
     @property
@@ -97,21 +119,76 @@ class OpenStackManager:
 
     @property
     def available_resources(self):
+        self.fetch_resources()
+        degraded = []
+        if self._failed_resources & set(QUOTAS):
+            degraded.append("quotas")
+        if CloudResource.FLAVORS in self._failed_resources:
+            degraded.append("resource_details")
+        if self._failed_resources & {CloudResource.FLAVORS, CloudResource.IMAGES}:
+            degraded.append("possible_resources")
         return {
             "quotas": self.quotas,
             "resource_details": self.resource_details,
             "possible_resources": self.possible_resources,
+            "degraded": degraded,
+        }
+
+    def fetch_resources(self):
+        """
+        Fetches the quotas, the flavors and the images concurrently, as they come from
+        independent OpenStack services (nova, cinder, neutron and glance).
+
+        A resource that could not be fetched within OPENSTACK_API_TIMEOUT seconds, or
+        whose service returned an error, is marked as failed: the quotas depending on it
+        are left out and its flavors or images are considered empty.
+        """
+        loaders = {
+            CloudResource.COMPUTE_QUOTAS: lambda: self.compute_quotas,
+            CloudResource.VOLUME_QUOTAS: lambda: self.volume_quotas,
+            CloudResource.NETWORK_QUOTAS: lambda: self.network_quotas,
+            CloudResource.FLAVORS: lambda: self.available_flavors,
+            CloudResource.IMAGES: lambda: self.images,
+        }
+        executor = ThreadPoolExecutor(max_workers=len(loaders))
+        futures = {
+            resource: executor.submit(loader) for resource, loader in loaders.items()
         }
+        wait(futures.values(), timeout=OPENSTACK_API_TIMEOUT)
+        # Do not wait for the calls that timed out
+        executor.shutdown(wait=False)
+
+        for resource, future in futures.items():
+            if not future.done():
+                logging.warning(
+                    f"Fetching {resource.value} of project {self.project.id} timed out"
+                )
+            elif future.exception() is not None:
+                logging.warning(
+                    f"Fetching {resource.value} of project {self.project.id} failed: {future.exception()}"
+                )
+            else:
+                continue
+            self._failed_resources.add(resource)
+            if resource == CloudResource.FLAVORS:
+                self._available_flavors = []
+            elif resource == CloudResource.IMAGES:
+                self._images = []
 
     @property
     def quotas(self):
+        quotas = {
+            "instance_count": lambda: self.available_instance_count,
+            "ram": lambda: self.available_ram,
+            "vcpus": lambda: self.available_vcpus,
+            "volume_count": lambda: self.available_volume_count,
+            "volume_size": lambda: self.available_volume_size,
+            "ips": lambda: self.available_floating_ip_count,
+        }
         return {
-            "instance_count": {"max": self.available_instance_count},
-            "ram": {"max": self.available_ram},
-            "vcpus": {"max": self.available_vcpus},
-            "volume_count": {"max": self.available_volume_count},
-            "volume_size": {"max": self.available_volume_size},
-            "ips": {"max": self.available_floating_ip_count},
+            name: {"max": available()}
+            for name, available in quotas.items()
+            if QUOTA_RESOURCES[name] not in self._failed_resources
         }
 
     @property
@@ -151,6 +228,13 @@ class OpenStackManager:
 
     @property
     def images(self):
+        if self._images is None:
+            self._images = get_cloud_resource_cache().get(
+                self.project.id, CloudResource.IMAGES, self._fetch_images
+            )
+        return self._images
+
+    def _fetch_images(self):
         images = []
         for image in self.connection.image.images():
             for idx, pattern in enumerate(VALID_IMAGES_REGEX_ARRAY):
@@ -163,11 +247,16 @@ class OpenStackManager:
     @property
     def available_flavors(self):
         if self._available_flavors is None:
-            self._available_flavors = list(self.connection.compute.flavors())
-            self._available_flavors.sort(
-                key=lambda flavor: (flavor.ram, flavor.vcpus))
+            self._available_flavors = get_cloud_resource_cache().get(
+                self.project.id, CloudResource.FLAVORS, self._fetch_flavors
+            )
         return self._available_flavors
 
+    def _fetch_flavors(self):
+        flavors = list(self.connection.compute.flavors())
+        flavors.sort(key=lambda flavor: (flavor.ram, flavor.vcpus))
+        return flavors
+
     @property
     def available_tags(self):
         tags = {
@@ -227,44 +316,63 @@ class OpenStackManager:
     @property
     def volume_quotas(self):
         if self._volume_quotas is None:
-            # Normally, we should use self.__connection.get_volume_quotas(...) from openstack sdk.
-            # However, this method executes the action
-            # identity:list_projects from the identity api which is forbidden
-            # to some users.
-            #
-            # API documentation:
-            # https://docs.openstack.org/api-ref/block-storage/v3/index.html?expanded=show-quotas-for-a-project-detail#show-quotas-for-a-project
-            self._volume_quotas = self.connection.block_storage.get(
-                f"/os-quota-sets/{self.project_id}?usage=true"
-            ).json()["quota_set"]
+            self._volume_quotas = get_cloud_resource_cache().get(
+                self.project.id, CloudResource.VOLUME_QUOTAS, self._fetch_volume_quotas
+            )
         return self._volume_quotas
 
+    def _fetch_volume_quotas(self):
+        # Normally, we should use self.__connection.get_volume_quotas(...) from openstack sdk.
+        # However, this method executes the action
+        # identity:list_projects from the identity api which is forbidden
+        # to some users.
+        #
+        # API documentation:
+        # https://docs.openstack.org/api-ref/block-storage/v3/index.html?expanded=show-quotas-for-a-project-detail#show-quotas-for-a-project
+        return self.connection.block_storage.get(
+            f"/os-quota-sets/{self.project_id}?usage=true"
+        ).json()["quota_set"]
+
     @property
     def compute_quotas(self):
         if self._compute_quotas is None:
-            # Normally, we should use self.__connection.get_compute_quotas(...) from openstack sdk.
-            # However, this method executes the action
-            # identity:list_projects from the identity api which is forbidden
-            # to some users.
-            #
-            # API documentation:
-            # https://docs.openstack.org/api-ref/compute/?expanded=show-a-quota-detail#show-a-quota
-            self._compute_quotas = self.connection.compute.get(
-                f"/os-quota-sets/{self.project_id}/detail"
-            ).json()["quota_set"]
+            self._compute_quotas = get_cloud_resource_cache().get(
+                self.project.id,
+                CloudResource.COMPUTE_QUOTAS,
+                self._fetch_compute_quotas,
+            )
         return self._compute_quotas
 
+    def _fetch_compute_quotas(self):
+        # Normally, we should use self.__connection.get_compute_quotas(...) from openstack sdk.
+        # However, this method executes the action
+        # identity:list_projects from the identity api which is forbidden
+        # to some users.
+        #
+        # API documentation:
+        # https://docs.openstack.org/api-ref/compute/?expanded=show-a-quota-detail#show-a-quota
+        return self.connection.compute.get(
+            f"/os-quota-sets/{self.project_id}/detail"
+        ).json()["quota_set"]
+
     @property
     def network_quotas(self):
         if self._network_quotas is None:
-            # Normally, we should use self.__connection.get_network_quotas(...) from openstack sdk.
-            # However, this method executes the action
-            # identity:list_projects from the identity api which is forbidden
-            # to some users.
-            #
-            # API documentation:
-            # https://docs.openstack.org/api-ref/network/v2/?expanded=show-quota-details-for-a-tenant-detail#show-quota-details-for-a-tenant
-            self._network_quotas = self.connection.network.get(
-                f"/quotas/{self.project_id}/details.json"
-            ).json()["quota"]
+            self._network_quotas = get_cloud_resource_cache().get(
+                self.project.id,
+                CloudResource.NETWORK_QUOTAS,
+                self._fetch_network_quotas,
+            )
         return self._network_quotas
+
+    def _fetch_network_quotas(self):
+        # Normally, we should use self.__connection.get_network_quotas(...) from openstack sdk.
+        # However, this method executes the action
+        # identity:list_projects from the identity api which is forbidden
+        # to some users.
+        #
+        # API documentation:
+        # https://docs.openstack.org/api-ref/network/v2/?expanded=show-quota-details-for-a-tenant-detail#show-quota-details-for-a-tenant
+        return self.connection.network.get(
+            f"/quotas/{self.project_id}/details.json"
+        ).json()["quota"]
@@ -5,6 +5,8 @@ from functools import partial
 import marshmallow
 from marshmallow import fields, EXCLUDE
 from marshmallow.validate import URL, Length
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
 
 from ...database import db
 
@@ -24,6 +26,8 @@ class Project(db.Model):
     admin_id = db.Column(db.Integer, nullable=False)
     provider = db.Column(db.Enum(Provider), nullable=False)
     env = db.Column(db.PickleType())
+    # Incremented by every write of the project, see increment_project_revision
+    revision = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     magic_castles = db.relationship(
         "MagicCastleORM",
         back_populates="project",
@@ -31,6 +35,13 @@ class Project(db.Model):
     )
 
 
+@event.listens_for(Project, "before_update")
+def increment_project_revision(mapper, connection, target):
+    # The entity tags of the clusters include the revision of their project
+    if object_session(target).is_modified(target, include_collections=False):
+        target.revision = Project.revision + 1
+
+
 class OpenStackEnv(marshmallow.Schema):
     OS_AUTH_URL = fields.String(required=True, validate=[URL()])
     OS_APPLICATION_CREDENTIAL_ID = fields.String(
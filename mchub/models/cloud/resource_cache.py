@@ -0,0 +1,133 @@
+from collections import defaultdict
+from enum import Enum
+from secrets import token_hex
+from threading import Lock
+from time import monotonic
+
+from ...configuration.env import QUOTAS_CACHE_TTL, FLAVORS_CACHE_TTL, IMAGES_CACHE_TTL
+
+
+class CloudResource(str, Enum):
+    COMPUTE_QUOTAS = "compute_quotas"
+    VOLUME_QUOTAS = "volume_quotas"
+    NETWORK_QUOTAS = "network_quotas"
+    FLAVORS = "flavors"
+    IMAGES = "images"
+
+
+QUOTAS = (
+    CloudResource.COMPUTE_QUOTAS,
+    CloudResource.VOLUME_QUOTAS,
+    CloudResource.NETWORK_QUOTAS,
+)
+
+CACHE_TTLS = {
+    CloudResource.COMPUTE_QUOTAS: QUOTAS_CACHE_TTL,
+    CloudResource.VOLUME_QUOTAS: QUOTAS_CACHE_TTL,
+    CloudResource.NETWORK_QUOTAS: QUOTAS_CACHE_TTL,
+    CloudResource.FLAVORS: FLAVORS_CACHE_TTL,
+    CloudResource.IMAGES: IMAGES_CACHE_TTL,
+}
+
+
+class CloudResourceCache:
+    """
+    Process-wide cache of the data fetched from the cloud providers (quotas, flavors
+    and images), keyed by project id, with a time to live per type of resource.
+
+    Each project has a generation number, incremented every time its entries are
+    invalidated. A value loaded while the project was invalidated is not cached.
+
+    Each project also has a version, see version, that changes every time one of its
+    entries is replaced.
+    """
+
+    def __init__(self, ttls=CACHE_TTLS):
+        self._ttls = ttls
+        self._lock = Lock()
+        self._entries = {}
+        self._generations = defaultdict(int)
+        self._versions = defaultdict(int)
+        # Tells apart the versions of the caches of different processes
+        self._token = token_hex(8)
+
+    def get(self, project_id, resource: CloudResource, loader):
+        """
+        Returns the cached value of a resource, or calls the loader and caches its
+        result when the value is missing or expired.
+
+        :param project_id: The id of the project.
+        :param resource: The type of resource.
+        :param loader: The function fetching the value from the cloud provider.
+        :return: The value of the resource.
+        """
+        with self._lock:
+            entry = self._entries.get((project_id, resource))
+            if entry is not None and entry[0] > monotonic():
+                return entry[1]
+            generation = self._generations[project_id]
+
+        value = loader()
+
+        with self._lock:
+            if self._generations[project_id] == generation:
+                self._entries[(project_id, resource)] = (
+                    monotonic() + self._ttls[resource],
+                    value,
+                )
+                self._versions[project_id] += 1
+        return value
+
+    def generation(self, project_id):
+        with self._lock:
+            return self._generations[project_id]
+
+    def version(self, project_id, resources=tuple(CloudResource)):
+        """
+        :param project_id: The id of the project.
+        :param resources: The types of resources, all of them by default.
+        :return: A tuple that changes whenever one of the resources of the project is
+            replaced, or None when one of them is missing or expired.
+        """
+        with self._lock:
+            now = monotonic()
+            for resource in resources:
+                entry = self._entries.get((project_id, resource))
+                if entry is None or entry[0] <= now:
+                    return None
+            return (self._token, project_id, self._versions[project_id])
+
+    def invalidate(self, project_id, resources=tuple(CloudResource)):
+        """
+        Removes the cached resources of a project.
+
+        :param project_id: The id of the project.
+        :param resources: The types of resources to remove, all of them by default.
+        """
+        with self._lock:
+            self._generations[project_id] += 1
+            self._versions[project_id] += 1
+            for resource in resources:
+                self._entries.pop((project_id, resource), None)
+
+    def invalidate_quotas(self, project_id):
+        self.invalidate(project_id, QUOTAS)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._versions.clear()
+            self._token = token_hex(8)
+
+
+_cache = None
+_cache_lock = Lock()
+
+
+def get_cloud_resource_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CloudResourceCache()
+        return _cache
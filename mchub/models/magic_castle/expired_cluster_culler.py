@@ -0,0 +1,158 @@
+import datetime
+import logging
+
+from time import monotonic
+
+from sqlalchemy.sql import func
+
+from .cluster_status_code import ClusterStatusCode
+from .plan_result import PlanResult
+from ...configuration.env import (
+    CULLER_MAX_CLUSTERS,
+    CULLER_MIN_BACKOFF,
+    CULLER_MAX_BACKOFF,
+)
+from ...database import db
+from ...jobs.job_queue import get_plan_queue
+
+# The destruction of expired clusters waits for the jobs requested by the users
+CULLER_APPLY_PRIORITY = -1
+
+BUSY_STATUSES = (
+    ClusterStatusCode.PLAN_RUNNING,
+    ClusterStatusCode.BUILD_QUEUED,
+    ClusterStatusCode.BUILD_RUNNING,
+    ClusterStatusCode.DESTROY_QUEUED,
+    ClusterStatusCode.DESTROY_RUNNING,
+)
+
+
+class ExpiredClusterCuller:
+    """
+    ExpiredClusterCuller destroys the clusters whose expiration date has passed.
+
+    The expired clusters are found with the index of the expiration_date column. Their
+    destruction is planned in the plan queue, then applied by the apply scheduler with
+    a lower priority than the other jobs, so culling many clusters at once stays
+    within the concurrency limits of both. At most max_clusters destructions are
+    started at a time. A cluster still expired after a destruction attempt is tried
+    again after a delay that doubles after each attempt, from min_backoff up to
+    max_backoff seconds.
+    """
+
+    def __init__(
+        self,
+        max_clusters=CULLER_MAX_CLUSTERS,
+        min_backoff=CULLER_MIN_BACKOFF,
+        max_backoff=CULLER_MAX_BACKOFF,
+    ):
+        self.max_clusters = max_clusters
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        # hostname -> (number of attempts, time of the next attempt)
+        self.backoffs = {}
+        # True when expired clusters were left for the next call of cull
+        self.remaining = False
+
+    def cull(self, today=None):
+        """
+        Starts the destruction of the expired clusters that are not busy.
+
+        :param today: The current date, clusters expire at the start of their
+            expiration date.
+        :return: The hostnames of the clusters whose destruction was started.
+        """
+        from .magic_castle import MagicCastle, MagicCastleORM
+
+        if today is None:
+            today = datetime.date.today()
+        rows = db.session.execute(
+            db.select(MagicCastleORM.id, MagicCastleORM.hostname, MagicCastleORM.status)
+            .where(MagicCastleORM.expiration_date <= today)
+            .order_by(MagicCastleORM.expiration_date, MagicCastleORM.id)
+        ).all()
+
+        self.backoffs = {
+            row.hostname: self.backoffs[row.hostname]
+            for row in rows
+            if row.hostname in self.backoffs
+        }
+        now = monotonic()
+        due = [
+            row
+            for row in rows
+            if row.status not in BUSY_STATUSES
+            and self.backoffs.get(row.hostname, (0, now))[1] <= now
+        ]
+        self.remaining = len(due) > self.max_clusters
+        due = due[: self.max_clusters]
+
+        culled, plans = [], []
+        for row in due:
+            logging.info(f"Cluster {row.hostname} is expired - deleting")
+            self.delay(row.hostname)
+            cluster = MagicCastle(db.session.get(MagicCastleORM, row.id))
+            try:
+                result, job_id = cluster.plan_destruction()
+            except Exception as error:
+                logging.error(f"Could not plan {row.hostname} deletion - {error}")
+                db.session.rollback()
+                continue
+            if result == PlanResult.DELETED:
+                # A cluster without resources is deleted right away
+                if db.session.get(MagicCastleORM, row.id) is None:
+                    self.backoffs.pop(row.hostname, None)
+                    culled.append(row.hostname)
+                else:
+                    logging.error(f"Could not delete {row.hostname}")
+            else:
+                # A destruction planned earlier and never applied is applied as is
+                plans.append((row, cluster, job_id))
+
+        for row, cluster, job_id in plans:
+            try:
+                if job_id is not None:
+                    get_plan_queue().wait(job_id)
+                    db.session.refresh(cluster.orm)
+                cluster.apply(priority=CULLER_APPLY_PRIORITY)
+            except Exception as error:
+                logging.error(f"Could not apply {row.hostname} deletion - {error}")
+                db.session.rollback()
+                continue
+            culled.append(row.hostname)
+        return culled
+
+    def delay(self, hostname):
+        now = monotonic()
+        attempts = self.backoffs.get(hostname, (0, now))[0] + 1
+        delay = min(self.min_backoff * 2 ** (attempts - 1), self.max_backoff)
+        self.backoffs[hostname] = (attempts, now + delay)
+
+    def get_delay(self, max_interval, now=None):
+        """
+        :param max_interval: The maximum number of seconds to return.
+        :param now: The current date and time.
+        :return: The number of seconds until the next cluster expires, or until an
+            expired cluster can be tried again.
+        """
+        from .magic_castle import MagicCastleORM
+
+        if now is None:
+            now = datetime.datetime.now()
+        delays = [max_interval]
+        if self.remaining:
+            delays.append(self.min_backoff)
+        next_expiration = db.session.scalar(
+            db.select(func.min(MagicCastleORM.expiration_date)).where(
+                MagicCastleORM.expiration_date > now.date()
+            )
+        )
+        if next_expiration is not None:
+            expiration = datetime.datetime.combine(next_expiration, datetime.time())
+            delays.append((expiration - now).total_seconds())
+        # The busy clusters whose delay is over are tried again once they are not
+        now = monotonic()
+        delays += [
+            attempt - now for _, attempt in self.backoffs.values() if attempt > now
+        ]
+        return max(min(delays), 0)
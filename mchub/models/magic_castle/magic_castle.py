@@ -1,15 +1,18 @@
 import datetime
+import hashlib
 import json
 import logging
 
 import humanize
 
-from os import path, environ, mkdir, remove, scandir, rename, symlink
+from os import path, environ, mkdir, remove, scandir, rename, stat, symlink
 from subprocess import run, CalledProcessError
 from shutil import rmtree
-from threading import Thread
+from time import perf_counter
 
 from marshmallow import ValidationError
+from sqlalchemy import event
+from sqlalchemy.orm import deferred, object_session, undefer_group
 from sqlalchemy.sql import func
 from sqlalchemy.exc import IntegrityError
 
@@ -18,19 +21,31 @@ from mchub.models.cloud.cloud_manager import CloudManager
 from .magic_castle_configuration import MagicCastleConfiguration
 from .cluster_status_code import ClusterStatusCode
 from .plan_type import PlanType
+from .plan_result import PlanResult
 
 from ..terraform.terraform_state import TerraformState
 from ..terraform.terraform_plan_parser import TerraformPlanParser
+from ..terraform.terraform_apply_log_parser import TerraformApplyLogParser
+from ..terraform.terraform_init import get_terraform_init_manager
+from ..terraform.terraform_modules import read_module_addresses
 from ..cloud.dns_manager import DnsManager
 from ..cloud.project import Project
-from ..puppet.provisioning_manager import ProvisioningManager, MAX_PROVISIONING_TIME
+from ..cloud.resource_cache import get_cloud_resource_cache
 
 from ...configuration.magic_castle import (
     MAIN_TERRAFORM_FILENAME,
     TERRAFORM_STATE_FILENAME,
     MAGIC_CASTLE_PATH,
+    MAGIC_CASTLE_SCALING_RESOURCES,
 )
-from ...configuration.env import CLUSTERS_PATH
+from ...configuration.env import (
+    CLUSTERS_PATH,
+    SAVE_PLAN_JSON,
+    TARGETED_PLANS,
+    TERRAFORM_APPLY_JSON,
+)
+from ...jobs.job_queue import get_plan_queue
+from ...jobs.apply_scheduler import get_apply_scheduler
 
 from ...exceptions.invalid_usage_exception import (
     ClusterNotFoundException,
@@ -44,33 +59,52 @@ from ...exceptions.server_exception import (
 )
 
 from ...database import db
+from ...database.json_types import CompactJSON, JSONEncodedObject
 
 
 TERRAFORM_PLAN_BINARY_FILENAME = "terraform_plan"
 TERRAFORM_APPLY_LOG_FILENAME = "terraform_apply.log"
 TERRAFORM_PLAN_LOG_FILENAME = "terraform_plan.log"
+TERRAFORM_PLAN_JSON_FILENAME = "terraform_plan.json"
+# Hash of the inputs of the terraform_plan binary, see MagicCastle.get_plan_hash
+TERRAFORM_PLAN_HASH_FILENAME = "terraform_plan.sha256"
+# Number of lines of the terraform plan log kept with a plan error
+PLAN_ERROR_LOG_LINES = 40
+
+# Loading options of the queries listing clusters with their state, without their plan
+MAGIC_CASTLE_STATE_OPTIONS = (undefer_group("state"),)
+
 
+def terraform_plan(cluster_id, env, destroy, targets=()):
+    orm = db.session.get(MagicCastleORM, cluster_id)
+    if orm is None:
+        # The cluster was deleted before its plan could start
+        return
+    MagicCastle(orm).run_plan(env, destroy, targets)
 
-def terraform_apply(cluster_id, env, main_path, destroy):
+
+def terraform_apply(cluster_id, env, main_path, destroy, resume=False):
     log_path = path.join(main_path, TERRAFORM_APPLY_LOG_FILENAME)
     plan_path = path.join(main_path, TERRAFORM_PLAN_BINARY_FILENAME)
+    cmd_args = [
+        "terraform",
+        "apply",
+        "-input=false",
+        "-no-color",
+        "-auto-approve",
+    ]
+    if TERRAFORM_APPLY_JSON:
+        # Machine readable progress, see TerraformApplyLogParser
+        cmd_args += ["-json"]
+    if resume:
+        # The saved plan is stale once an apply has been interrupted,
+        # terraform has to plan the changes again.
+        cmd_args += ["-destroy"] if destroy else []
+    else:
+        cmd_args += [plan_path]
     try:
-        with open(log_path, "w") as output_file:
-            run(
-                [
-                    "terraform",
-                    "apply",
-                    "-input=false",
-                    "-no-color",
-                    "-auto-approve",
-                    plan_path,
-                ],
-                cwd=main_path,
-                stdout=output_file,
-                stderr=output_file,
-                check=True,
-                env=env,
-            )
+        # The output is indexed as it is streamed to the log, see get_progress
+        TerraformApplyLogParser.run(cmd_args, log_path, cwd=main_path, env=env)
     except CalledProcessError as err:
         logging.error(f"An error occurred while running terraform apply: {err}")
         if destroy:
@@ -87,7 +121,14 @@ def terraform_apply(cluster_id, env, main_path, destroy):
         if destroy:
             rmtree(main_path, ignore_errors=True)
         else:
-            remove(path.join(main_path, TERRAFORM_PLAN_BINARY_FILENAME))
+            for plan_file_path in (
+                plan_path,
+                path.join(main_path, TERRAFORM_PLAN_HASH_FILENAME),
+            ):
+                try:
+                    remove(plan_file_path)
+                except FileNotFoundError:
+                    pass
 
         # Retrieve terraform state
         try:
@@ -98,34 +139,96 @@ def terraform_apply(cluster_id, env, main_path, destroy):
         except (FileNotFoundError, json.decoder.JSONDecodeError):
             tf_state = None
 
-        # Save results in database
-        from ... import create_app
+        # Save results in database, with the session of the application context in
+        # which the apply scheduler runs the job
+        orm = db.session.get(MagicCastleORM, cluster_id)
+        # Resources were allocated or released, even if terraform apply failed
+        get_cloud_resource_cache().invalidate_quotas(orm.project_id)
+        if destroy:
+            db.session.delete(orm)
+        else:
+            orm.plan_type = PlanType.NONE
+            orm.plan = None
+            orm.status = status
+            orm.tf_state = tf_state
+            orm.applied_config = orm.config
+        db.session.commit()
 
-        with create_app().app_context():
-            orm = db.session.get(MagicCastleORM, cluster_id)
-            if destroy:
-                db.session.delete(orm)
-            else:
-                orm.plan_type = PlanType.NONE
-                orm.plan = None
-                orm.status = status
-                orm.tf_state = tf_state
-                orm.applied_config = orm.config
-            db.session.commit()
+
+def get_age(created):
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return humanize.naturaldelta(now - created)
+
+
+def parse_expiration_date(value):
+    """
+    :param value: An expiration date in the ISO 8601 format, e.g. 2029-01-31.
+    :return: The date, or None for a cluster without expiration date.
+    """
+    if not value:
+        return None
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        return datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise InvalidUsageException(f"Invalid expiration date: {value}")
+
+
+def get_state(
+    *,
+    config,
+    hostname,
+    status,
+    tf_state,
+    created,
+    expiration_date,
+    project_id,
+    project_name,
+):
+    """
+    Builds the state of a cluster returned by the API, from its configuration and the
+    columns of its row.
+    """
+    return {
+        **config,
+        "hostname": hostname,
+        "status": status,
+        "freeipa_passwd": tf_state.freeipa_passwd if tf_state is not None else None,
+        "age": get_age(created),
+        "expiration_date": (
+            expiration_date.isoformat() if expiration_date is not None else None
+        ),
+        "cloud": {"name": project_name, "id": project_id},
+    }
 
 
 class MagicCastleORM(db.Model):
     __tablename__ = "magiccastle"
+    __table_args__ = (
+        db.Index("ix_magiccastle_project_id_status", "project_id", "status"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     hostname = db.Column(db.String(256), unique=True, nullable=False)
-    status = db.Column(db.Enum(ClusterStatusCode), default=ClusterStatusCode.NOT_FOUND)
+    status = db.Column(
+        db.Enum(ClusterStatusCode), default=ClusterStatusCode.NOT_FOUND, index=True
+    )
     plan_type = db.Column(db.Enum(PlanType), default=PlanType.NONE)
     created = db.Column(db.DateTime(), default=func.now())
-    expiration_date = db.Column(db.String(32))
-    config = db.Column(db.PickleType())
-    applied_config = db.Column(db.PickleType())
-    tf_state = db.Column(db.PickleType())
-    plan = db.Column(db.PickleType())
+    expiration_date = db.Column(db.Date(), index=True)
+    # Incremented by every write of the cluster, see increment_revision
+    revision = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # The documents are only loaded when accessed, see MAGIC_CASTLE_STATE_OPTIONS
+    config = deferred(
+        db.Column(JSONEncodedObject(MagicCastleConfiguration)), group="state"
+    )
+    applied_config = deferred(
+        db.Column(JSONEncodedObject(MagicCastleConfiguration)), group="state"
+    )
+    tf_state = deferred(db.Column(JSONEncodedObject(TerraformState)), group="state")
+    plan = deferred(db.Column(CompactJSON()))
+    # The message and the end of the log of the last failed plan, see set_plan_error
+    plan_error = deferred(db.Column(CompactJSON()))
     project_id = db.Column(db.Integer, db.ForeignKey("project.id"))
     project = db.relationship(
         "Project",
@@ -135,14 +238,21 @@ class MagicCastleORM(db.Model):
     )
 
 
+@event.listens_for(MagicCastleORM, "before_update")
+def increment_revision(mapper, connection, target):
+    # Incremented in SQL, so concurrent writers from other processes are counted
+    if object_session(target).is_modified(target, include_collections=False):
+        target.revision = MagicCastleORM.revision + 1
+
+
 class MagicCastle:
     """
     Magic Castle is the class that manages everything related to the state of a Magic Castle cluster.
     It is responsible for building, modifying and destroying the cluster using Terraform.
     It is also used to get the state of the cluster and the cloud resources available.
 
-    Note: In this class, the database connection is recreated everytime the database must be accessed
-    to avoid using the same connection in multiple threads (which doesn't work with sqlite).
+    Note: The database session is scoped to the current thread and application context, its
+    connections are taken from the pool of the engine (see mchub.database).
     """
 
     __slots__ = ["orm"]
@@ -187,9 +297,36 @@ class MagicCastle:
 
     @property
     def age(self):
-        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
-        delta = now - self.orm.created
-        return humanize.naturaldelta(delta)
+        return get_age(self.orm.created)
+
+    @property
+    def state_version(self):
+        """
+        :return: A tuple that changes whenever the state of the cluster changes,
+            computed without loading its configuration, state or plan. The state
+            includes the name of the project, hence the revision of the project.
+        """
+        return (
+            "state",
+            self.orm.id,
+            self.orm.revision,
+            self.project.id,
+            self.project.revision,
+            self.age,
+        )
+
+    @property
+    def progress_version(self):
+        """
+        :return: A tuple that changes whenever the progress report of the cluster
+            changes, i.e. with its revision and with its terraform apply log.
+        """
+        try:
+            log = stat(path.join(self.path, TERRAFORM_APPLY_LOG_FILENAME))
+            log_version = (log.st_ino, log.st_size, log.st_mtime_ns)
+        except OSError:
+            log_version = None
+        return ("progress", self.orm.id, self.orm.revision, log_version)
 
     @property
     def config(self):
@@ -205,7 +342,9 @@ class MagicCastle:
 
     def set_configuration(self, configuration: dict):
         expect_tf_changes = False
-        self.orm.expiration_date = configuration.pop("expiration_date", None)
+        self.orm.expiration_date = parse_expiration_date(
+            configuration.pop("expiration_date", None)
+        )
         cloud_id = configuration.pop("cloud")["id"]
 
         if self.orm.project is None or self.orm.project.id != cloud_id:
@@ -225,13 +364,7 @@ class MagicCastle:
 
     @property
     def status(self) -> ClusterStatusCode:
-        if self.orm.status == ClusterStatusCode.PROVISIONING_RUNNING:
-            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
-            if ProvisioningManager.check_online(self.hostname):
-                self.status = ClusterStatusCode.PROVISIONING_SUCCESS
-            elif MAX_PROVISIONING_TIME < (now - self.orm.created).total_seconds():
-                self.status = ClusterStatusCode.PROVISIONING_ERROR
-
+        # The provisioning transitions are saved by the provisioning prober service
         return self.orm.status
 
     @status.setter
@@ -307,25 +440,70 @@ class MagicCastle:
         if self.plan is None:
             return None
 
-        try:
-            with open(path.join(self.path, TERRAFORM_APPLY_LOG_FILENAME), "r") as file:
-                terraform_output = file.read()
-        except FileNotFoundError:
-            # terraform apply was not launched yet, therefore the log file does not exist
-            terraform_output = ""
-        return TerraformPlanParser.get_done_changes(self.plan, terraform_output)
+        log_path = path.join(self.path, TERRAFORM_APPLY_LOG_FILENAME)
+        apply_events = TerraformApplyLogParser.parse_file(log_path)
+        return TerraformPlanParser.get_progress(
+            self.plan, apply_events, TerraformApplyLogParser.get_elapsed(log_path)
+        )
 
     @property
     def state(self):
-        return {
-            **(self.applied_config if self.applied_config else self.config),
-            "hostname": self.hostname,
-            "status": self.status,
-            "freeipa_passwd": self.freeipa_passwd,
-            "age": self.age,
-            "expiration_date": self.expiration_date,
-            "cloud": {"name": self.project.name, "id": self.project.id},
-        }
+        return get_state(
+            config=self.applied_config if self.applied_config else self.config,
+            hostname=self.hostname,
+            status=self.status,
+            tf_state=self.tf_state,
+            created=self.orm.created,
+            expiration_date=self.expiration_date,
+            project_id=self.project.id,
+            project_name=self.project.name,
+        )
+
+    @staticmethod
+    def list_states(project_ids, statuses=None, expires_before=None):
+        """
+        Returns the states of the clusters of several projects, as returned by the state
+        property, using a single query.
+
+        :param project_ids: The ids of the projects.
+        :param statuses: The ClusterStatusCode of the clusters to return, all if None.
+        :param expires_before: Only return the clusters expiring before this date.
+        :return: The states of the clusters, ordered by project id.
+        """
+        query = (
+            db.select(
+                MagicCastleORM.hostname,
+                MagicCastleORM.status,
+                MagicCastleORM.created,
+                MagicCastleORM.expiration_date,
+                MagicCastleORM.config,
+                MagicCastleORM.applied_config,
+                MagicCastleORM.tf_state,
+                Project.id,
+                Project.name,
+            )
+            .join(Project, MagicCastleORM.project_id == Project.id)
+            .where(MagicCastleORM.project_id.in_(project_ids))
+            .order_by(MagicCastleORM.project_id, MagicCastleORM.id)
+        )
+        if statuses is not None:
+            query = query.where(MagicCastleORM.status.in_(statuses))
+        if expires_before is not None:
+            query = query.where(MagicCastleORM.expiration_date < expires_before)
+        rows = db.session.execute(query).all()
+        return [
+            get_state(
+                config=row.applied_config if row.applied_config else row.config,
+                hostname=row.hostname,
+                status=row.status,
+                tf_state=row.tf_state,
+                created=row.created,
+                expiration_date=row.expiration_date,
+                project_id=row.id,
+                project_name=row.name,
+            )
+            for row in rows
+        ]
 
     @property
     def tf_state(self):
@@ -364,7 +542,9 @@ class MagicCastle:
     def is_busy(self):
         return self.status in [
             ClusterStatusCode.PLAN_RUNNING,
+            ClusterStatusCode.BUILD_QUEUED,
             ClusterStatusCode.BUILD_RUNNING,
+            ClusterStatusCode.DESTROY_QUEUED,
             ClusterStatusCode.DESTROY_RUNNING,
         ]
 
@@ -413,12 +593,7 @@ class MagicCastle:
 
         # Initialize terraform modules
         try:
-            run(
-                ["terraform", "init", "-no-color", "-input=false"],
-                cwd=self.path,
-                capture_output=True,
-                check=True,
-            )
+            get_terraform_init_manager().init(self.path)
         except Exception as error:
             self.delete()
             raise PlanException(
@@ -427,9 +602,16 @@ class MagicCastle:
             )
 
         self.status = ClusterStatusCode.CREATED
-        self.create_plan()
+        return self.create_plan()
 
     def plan_modification(self, data):
+        """
+        Stores the new configuration of the cluster and queues its plan when needed.
+
+        :param data: The configuration of the cluster, as sent to the API.
+        :return: A tuple (PlanResult, job id), the job id is None unless a plan job
+            was queued.
+        """
         if not self.found:
             raise ClusterNotFoundException
         if self.is_busy:
@@ -456,64 +638,232 @@ class MagicCastle:
             )
             or prev_plan_type != PlanType.BUILD
         ):
+            targets = self.get_plan_targets()
+            if self.is_plan_reusable(destroy=False, targets=targets):
+                # The rendered configuration is identical to the one last planned
+                return PlanResult.REUSED, None
             self.remove_existing_plan()
             self.rotate_terraform_logs(apply=False)
-            self.create_plan()
+            return PlanResult.QUEUED, self.create_plan(targets)
+        return PlanResult.UNCHANGED, None
 
     def plan_destruction(self):
+        """
+        Queues the plan of the destruction of the cluster, or deletes it right away
+        when it has no resources.
+
+        :return: A tuple (PlanResult, job id), the job id is None unless a plan job
+            was queued.
+        """
         if self.is_busy:
             raise BusyClusterException
 
         self.plan_type = PlanType.DESTROY
         if self.tf_state is not None:
+            if self.is_plan_reusable(destroy=True):
+                return PlanResult.REUSED, None
             self.remove_existing_plan()
             self.rotate_terraform_logs(apply=False)
-            self.create_plan()
+            return PlanResult.QUEUED, self.create_plan()
         else:
             self.delete()
+            return PlanResult.DELETED, None
+
+    def get_plan_targets(self):
+        """
+        Limits the plan of a configuration change to the resources following the
+        instance counts, when the counts are the only differences with the applied
+        configuration. Any other change, a cluster without state or a cluster whose
+        last apply failed requires a plan of the whole configuration, as do the
+        targets that match none of the modules and resources installed by terraform
+        init, e.g. after a change of the Magic Castle module layout.
+
+        :return: The addresses of the resources to pass as plan targets, or an empty
+            list to plan the whole configuration.
+        """
+        resources = MAGIC_CASTLE_SCALING_RESOURCES.get(self.config.provider)
+        if (
+            not TARGETED_PLANS
+            or not resources
+            or self.tf_state is None
+            or self.status
+            in (
+                ClusterStatusCode.PLAN_ERROR,
+                ClusterStatusCode.BUILD_ERROR,
+            )
+            or self.config.get_instance_count_changes(self.applied_config) is None
+        ):
+            return []
+        targets = [f"module.{self.config.provider}.{resource}" for resource in resources]
+        # The DNS records of the public instances
+        targets += [
+            f"module.{name}"
+            for name in DnsManager(self.domain).get_magic_castle_configuration()
+        ]
+        # A target matching nothing does not make terraform plan fail, the resources
+        # it was meant for would silently be left out of the plan
+        addresses = read_module_addresses(self.path)
+        unknown_targets = [
+            target for target in targets if addresses is None or target not in addresses
+        ]
+        if unknown_targets:
+            logging.warning(
+                f"The plan targets {unknown_targets} match no module or resource in "
+                f"the configuration of {self.hostname}, "
+                "planning the whole configuration"
+            )
+            return []
+        return targets
+
+    def get_plan_hash(self, destroy, targets=()):
+        """
+        Hashes what a terraform plan of the cluster depends on: the main terraform
+        file, which includes the DNS module configuration, the Magic Castle version
+        and module sources, the dependency lock file and the terraform state.
 
-    def create_plan(self):
+        :param destroy: True for the hash of a destruction plan.
+        :param targets: The addresses of the resources the plan is limited to.
+        :return: The hexadecimal digest of the hash.
+        """
+        init_manager = get_terraform_init_manager()
+        plan_hash = hashlib.sha256(b"destroy" if destroy else b"build")
+        plan_hash.update(json.dumps(list(targets)).encode())
+        plan_hash.update(
+            init_manager.get_stamp(
+                self.path, init_manager.get_modules_hash(self.path)
+            ).encode()
+        )
+        for filename in (MAIN_TERRAFORM_FILENAME, TERRAFORM_STATE_FILENAME):
+            try:
+                with open(path.join(self.path, filename), "rb") as input_file:
+                    content = input_file.read()
+            except FileNotFoundError:
+                content = b""
+            plan_hash.update(hashlib.sha256(content).digest())
+        return plan_hash.hexdigest()
+
+    def is_plan_reusable(self, destroy, targets=()):
+        """
+        :param destroy: True if a destruction plan is requested.
+        :param targets: The addresses of the resources the requested plan is limited to.
+        :return: True if the existing terraform_plan binary was created from the
+            current configuration and state, and can be applied instead of a new plan.
+        """
+        if self.plan is None or not path.isfile(
+            path.join(self.path, TERRAFORM_PLAN_BINARY_FILENAME)
+        ):
+            return False
+        try:
+            with open(path.join(self.path, TERRAFORM_PLAN_HASH_FILENAME)) as hash_file:
+                return hash_file.read() == self.get_plan_hash(destroy, targets)
+        except (OSError, ValueError):
+            return False
+
+    def create_plan(self, targets=()):
+        """
+        Queues the creation of a terraform plan and returns immediately. The cluster
+        keeps the PLAN_RUNNING status until the plan job is completed.
+
+        :param targets: The addresses of the resources the plan is limited to, see
+            get_plan_targets.
+        :return: The id of the plan job.
+        """
         destroy = self.plan_type == PlanType.DESTROY
-        self.status = ClusterStatusCode.PLAN_RUNNING
 
         environment_variables = environ.copy()
         dns_manager = DnsManager(self.domain)
         environment_variables.update(dns_manager.get_environment_variables())
         environment_variables.update(self.project.env)
+
+        self.plan = None
+        self.orm.plan_error = None
+        self.status = ClusterStatusCode.PLAN_RUNNING
+        return get_plan_queue().submit(
+            terraform_plan, self.orm.id, environment_variables, destroy, targets
+        )
+
+    def run_terraform_plan(self, plan_log, environment_variables, destroy, targets):
+        with open(plan_log, "w") as output_file:
+            run(
+                [
+                    "terraform",
+                    "plan",
+                    "-input=false",
+                    "-no-color",
+                    "-refresh=" + ("true" if destroy else "false"),
+                    "-destroy=" + ("true" if destroy else "false"),
+                    "-out=" + path.join(self.path, TERRAFORM_PLAN_BINARY_FILENAME),
+                ]
+                + [f"-target={target}" for target in targets],
+                cwd=self.path,
+                env=environment_variables,
+                stdout=output_file,
+                stderr=output_file,
+                check=True,
+            )
+
+    def set_plan_error(self, message, log=None):
+        """
+        Saves the failure of the plan of the cluster with the PLAN_ERROR status, so
+        the API workers of every process can report it.
+
+        :param message: The error message shown to the user.
+        :param log: The output of terraform, of which the last lines are kept.
+        """
+        plan_error = {"message": message}
+        if log:
+            if isinstance(log, bytes):
+                log = log.decode(errors="replace")
+            plan_error["log"] = "\n".join(log.splitlines()[-PLAN_ERROR_LOG_LINES:])
+        self.orm.plan_error = plan_error
+        self.status = ClusterStatusCode.PLAN_ERROR
+
+    def run_plan(self, environment_variables, destroy, targets=()):
+        """
+        Runs terraform plan and exports the planned changes. This is executed by the
+        plan job queued in create_plan.
+
+        :param targets: The addresses of the resources the plan is limited to. The
+            whole configuration is planned when the targeted plan fails.
+        """
         plan_log = path.join(self.path, TERRAFORM_PLAN_LOG_FILENAME)
+        start = perf_counter()
         try:
-            with open(plan_log, "w") as output_file:
-                run(
-                    [
-                        "terraform",
-                        "plan",
-                        "-input=false",
-                        "-no-color",
-                        "-refresh=" + ("true" if destroy else "false"),
-                        "-destroy=" + ("true" if destroy else "false"),
-                        "-out=" + path.join(self.path, TERRAFORM_PLAN_BINARY_FILENAME),
-                    ],
-                    cwd=self.path,
-                    env=environment_variables,
-                    stdout=output_file,
-                    stderr=output_file,
-                    check=True,
+            try:
+                self.run_terraform_plan(
+                    plan_log, environment_variables, destroy, targets
+                )
+            except CalledProcessError:
+                if not targets:
+                    raise
+                logging.warning(
+                    f"The targeted plan of {self.hostname} failed, "
+                    "planning the whole configuration"
+                )
+                targets = ()
+                self.run_terraform_plan(
+                    plan_log, environment_variables, destroy, targets
                 )
         except CalledProcessError:
-            self.status = ClusterStatusCode.PLAN_ERROR
             with open(plan_log, "r") as input_file:
                 log = input_file.read()
+            self.set_plan_error("An error occurred while planning changes.", log)
             raise PlanException(
                 "An error occurred while planning changes.",
                 additional_details=f"hostname: {self.hostname}\nlog: {log}",
             )
         except BaseException as err:
-            self.status = ClusterStatusCode.PLAN_ERROR
+            self.set_plan_error("An error occurred while planning changes.")
             raise PlanException(
                 "An error occurred while planning changes.",
                 additional_details=f"hostname: {self.hostname}\nerror: {err}",
             )
 
+        logging.info(
+            f"Planned {'the targeted resources' if targets else 'the whole configuration'}"
+            f" of {self.hostname} in {perf_counter() - start:.1f} s"
+        )
+
         try:
             proc = run(
                 [
@@ -527,21 +877,32 @@ class MagicCastle:
                 capture_output=True,
                 check=True,
             )
-        except CalledProcessError:
-            self.status = ClusterStatusCode.PLAN_ERROR
+        except CalledProcessError as err:
+            self.set_plan_error(
+                "An error occurred while exporting planned changes.", err.stderr
+            )
             raise PlanException(
                 "An error occurred while exporting planned changes.",
                 additional_details=f"hostname: {self.hostname}",
             )
         except BaseException as err:
-            self.status = ClusterStatusCode.PLAN_ERROR
+            self.set_plan_error("An error occurred while exporting planned changes.")
             raise PlanException(
                 "An error occurred while exporting planned changes.",
                 additional_details=f"hostname: {self.hostname}\nerror: {err}",
             )
 
+        if SAVE_PLAN_JSON:
+            plan_json = proc.stdout
+            if isinstance(plan_json, str):
+                plan_json = plan_json.encode()
+            json_path = path.join(self.path, TERRAFORM_PLAN_JSON_FILENAME)
+            with open(json_path, "wb") as json_file:
+                json_file.write(plan_json)
+
         try:
-            self.plan = json.loads(proc.stdout)
+            # Only the resource changes are kept in the database
+            self.plan = TerraformPlanParser.summarize(json.loads(proc.stdout))
         except json.JSONDecodeError:
             self.status = ClusterStatusCode.PLAN_ERROR
             raise PlanException(
@@ -555,13 +916,29 @@ class MagicCastle:
                 additional_details=f"hostname: {self.hostname}\nerror: {err}",
             )
 
+        try:
+            with open(
+                path.join(self.path, TERRAFORM_PLAN_HASH_FILENAME), "w"
+            ) as hash_file:
+                hash_file.write(self.get_plan_hash(destroy, targets))
+        except (OSError, ValueError) as err:
+            # The plan is valid, it will only not be reused
+            logging.warning(f"Could not hash the plan of {self.hostname}: {err}")
+
         if self.tf_state:
             self.status = ClusterStatusCode.PROVISIONING_RUNNING
         else:
             self.status = ClusterStatusCode.CREATED
         db.session.commit()
 
-    def apply(self):
+    def apply(self, priority=0):
+        """
+        Queues the application of the current plan. The apply scheduler starts the
+        job as soon as the concurrency limits allow it.
+
+        :param priority: Jobs with a higher priority are started first.
+        :return: The id of the apply job.
+        """
         if self.plan is None or not path.exists(
             path.join(self.path, TERRAFORM_PLAN_BINARY_FILENAME)
         ):
@@ -570,24 +947,42 @@ class MagicCastle:
             raise BusyClusterException
 
         if self.plan_type == PlanType.BUILD:
-            self.status = ClusterStatusCode.BUILD_RUNNING
-            destroy = False
+            self.status = ClusterStatusCode.BUILD_QUEUED
         elif self.plan_type == PlanType.DESTROY:
-            self.status = ClusterStatusCode.DESTROY_RUNNING
-            destroy = True
+            self.status = ClusterStatusCode.DESTROY_QUEUED
         else:
             raise PlanNotCreatedException
 
+        self.rotate_terraform_logs(apply=True)
+        return get_apply_scheduler().enqueue(
+            self.orm.id, self.project.id, priority=priority
+        )
+
+    def run_apply(self, resume=False):
+        """
+        Runs terraform apply. This is executed by the apply scheduler once the job
+        queued in apply is started.
+
+        :param resume: True if a previous run of this job was interrupted.
+        """
+        destroy = self.plan_type == PlanType.DESTROY
+        if destroy:
+            self.status = ClusterStatusCode.DESTROY_RUNNING
+        else:
+            self.status = ClusterStatusCode.BUILD_RUNNING
+
         env = environ.copy()
         if destroy:
             env["TF_WARN_OUTPUT_ERRORS"] = "1"
         env.update(self.project.env)
         env.update(DnsManager(self.domain).get_environment_variables())
 
-        self.rotate_terraform_logs(apply=True)
-        Thread(
-            target=terraform_apply, args=[self.orm.id, env, self.path, destroy]
-        ).start()
+        if resume:
+            self.rotate_terraform_logs(apply=True)
+        cluster_id, main_path = self.orm.id, self.path
+        # Release the database connection while terraform runs
+        db.session.commit()
+        terraform_apply(cluster_id, env, main_path, destroy, resume)
 
     def delete(self):
         # Removes the content of the cluster's folder, even if not empty
@@ -596,9 +991,10 @@ class MagicCastle:
         db.session.commit()
 
     def remove_existing_plan(self):
-        try:
-            # Remove existing plan, if it exists
-            remove(path.join(self.path, TERRAFORM_PLAN_BINARY_FILENAME))
-        except FileNotFoundError:
-            # Must be a new cluster, without existing plans
-            pass
+        for filename in (TERRAFORM_PLAN_BINARY_FILENAME, TERRAFORM_PLAN_HASH_FILENAME):
+            try:
+                # Remove existing plan, if it exists
+                remove(path.join(self.path, filename))
+            except FileNotFoundError:
+                # Must be a new cluster, without existing plans
+                pass
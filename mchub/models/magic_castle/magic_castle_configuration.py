@@ -85,6 +85,20 @@ class MagicCastleConfiguration(Mapping):
     def __iter__(self):
         return iter(self._config)
 
+    def to_dict(self):
+        return {"provider": self.provider, "configuration": self._config}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Returns a MagicCastleConfiguration from the output of to_dict. The configuration
+        is not validated again, as it was validated when it was created.
+        """
+        config = cls.__new__(cls)
+        config.provider = data["provider"]
+        config._config = data["configuration"]
+        return config
+
     def __getitem__(self, key):
         return self._config[key]
 
@@ -99,6 +113,37 @@ class MagicCastleConfiguration(Mapping):
     def domain(self):
         return self["domain"]
 
+    def get_instance_count_changes(self, previous):
+        """
+        Classifies the differences with a previous configuration.
+
+        :param previous: The previous MagicCastleConfiguration, e.g. the applied one.
+        :return: A dictionary of the instance prefixes whose count changed, with their
+            previous and new counts, when the counts are the only differences between
+            the configurations. None otherwise, or when there is no difference.
+        """
+        if previous is None or self.provider != previous.provider:
+            return None
+        if {key: value for key, value in self.items() if key != "instances"} != {
+            key: value for key, value in previous.items() if key != "instances"
+        }:
+            return None
+        instances, previous_instances = self["instances"], previous["instances"]
+        if instances.keys() != previous_instances.keys():
+            return None
+
+        changes = {}
+        for prefix, instance in instances.items():
+            previous_instance = previous_instances[prefix]
+            if {key: value for key, value in instance.items() if key != "count"} != {
+                key: value for key, value in previous_instance.items() if key != "count"
+            }:
+                return None
+            count, previous_count = instance.get("count"), previous_instance.get("count")
+            if count != previous_count:
+                changes[prefix] = (previous_count, count)
+        return changes or None
+
     @classmethod
     def get_from_main_file(cls, filename):
         """
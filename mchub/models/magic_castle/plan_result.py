@@ -0,0 +1,18 @@
+from enum import Enum
+
+
+class PlanResult(str, Enum):
+    """
+    The outcome of a request to plan a change of a cluster, returned along with the
+    id of the plan job, if any, by MagicCastle.plan_modification and
+    MagicCastle.plan_destruction.
+    """
+
+    # A plan job was queued
+    QUEUED = "queued"
+    # The existing plan matches the request and can be applied as is
+    REUSED = "reused"
+    # The change is only stored in the database, there is nothing to plan
+    UNCHANGED = "unchanged"
+    # The cluster had no resources and was deleted right away
+    DELETED = "deleted"
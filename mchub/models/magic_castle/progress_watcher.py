@@ -0,0 +1,195 @@
+import json
+import logging
+
+from os import stat, path
+from queue import Queue, Empty
+from threading import Event, Lock, Thread
+
+from .cluster_status_code import ClusterStatusCode
+from ..terraform.terraform_apply_log_parser import TerraformApplyLogParser
+from ...configuration.env import PROGRESS_STREAM_INTERVAL
+from ...database import db
+
+# Seconds between two comments sent to keep idle streams open
+KEEPALIVE_INTERVAL = 15
+
+
+def get_progress_report(magic_castle):
+    """
+    Returns the status of a cluster and the progress of its planned changes, as
+    returned by GET /api/magic-castles/<hostname>/status.
+    """
+    status = magic_castle.status
+    progress = magic_castle.get_progress()
+    stateful = magic_castle.tf_state is not None
+    report = {"status": status, "stateful": stateful}
+    if progress is not None:
+        report["progress"] = progress
+    if status == ClusterStatusCode.PLAN_ERROR and magic_castle.orm.plan_error:
+        # The plan ran in the background, possibly in another process
+        report["error"] = magic_castle.orm.plan_error
+    return report
+
+
+def get_progress_delta(previous, current):
+    """
+    Computes the event to send to the subscribers of a progress stream when the
+    progress report of a cluster goes from previous to current.
+
+    :return: A tuple (event, data), where event is either "snapshot", when the whole
+    report has to be sent, "delta", when only the changed fields and the changed
+    resources are sent, or None when nothing changed.
+    """
+    if previous is None:
+        return "snapshot", current
+    delta = {
+        key: current.get(key)
+        for key in ("status", "stateful", "progress", "error")
+        if previous.get(key) != current.get(key)
+    }
+    if not delta:
+        return None, None
+    if "progress" in delta:
+        previous_progress = previous.get("progress")
+        progress = current.get("progress")
+        if (
+            previous_progress is None
+            or progress is None
+            or [change["address"] for change in previous_progress]
+            != [change["address"] for change in progress]
+        ):
+            # The plan changed, the resources can not be matched
+            return "snapshot", current
+        delta["progress"] = [
+            change
+            for previous_change, change in zip(previous_progress, progress)
+            if previous_change != change
+        ]
+    return "delta", delta
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class ProgressWatcher:
+    """
+    ProgressWatcher follows the status and the progress of a single cluster and pushes
+    the changes to every subscribed progress stream.
+
+    There is at most one watcher per cluster in each process, shared by all the
+    subscribers. The progress, which requires parsing terraform apply log, is only
+    computed again when the status of the cluster or the log have changed. The
+    watcher checks the cluster every PROGRESS_STREAM_INTERVAL seconds, and right away
+    when a terraform apply running in this process indexes new resource events. The
+    watcher stops when its last subscriber leaves.
+    """
+
+    _watchers = {}
+    _watchers_lock = Lock()
+
+    def __init__(self, app, hostname):
+        self.app = app
+        self.hostname = hostname
+        self._subscribers = set()
+        self._report = None
+        self._fingerprint = None
+        self._log_path = None
+        self._wake = Event()
+        self._thread = Thread(
+            target=self._watch, name=f"progress-{hostname}", daemon=True
+        )
+
+    @classmethod
+    def subscribe(cls, app, hostname):
+        """
+        Subscribes to the progress stream of a cluster.
+
+        :return: The watcher of the cluster and the queue in which the events are pushed.
+        """
+        with cls._watchers_lock:
+            watcher = cls._watchers.get(hostname)
+            if watcher is None:
+                watcher = cls._watchers[hostname] = cls(app, hostname)
+                watcher._thread.start()
+            queue = Queue()
+            if watcher._report is not None:
+                queue.put(("snapshot", watcher._report))
+            watcher._subscribers.add(queue)
+        return watcher, queue
+
+    def unsubscribe(self, queue):
+        with self._watchers_lock:
+            self._subscribers.discard(queue)
+
+    def stream(self, queue):
+        """
+        Generates the server-sent events of a subscriber until the client disconnects.
+        """
+        try:
+            while True:
+                try:
+                    event, data = queue.get(timeout=KEEPALIVE_INTERVAL)
+                except Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_event(event, data)
+        finally:
+            self.unsubscribe(queue)
+
+    def _watch(self):
+        while True:
+            with self._watchers_lock:
+                if not self._subscribers:
+                    del self._watchers[self.hostname]
+                    if self._log_path is not None:
+                        TerraformApplyLogParser.unsubscribe(
+                            self._log_path, self._wake.set
+                        )
+                    return
+            try:
+                with self.app.app_context():
+                    self._update()
+            except Exception as error:
+                logging.error(f"Could not watch the progress of {self.hostname}: {error}")
+            self._wake.wait(PROGRESS_STREAM_INTERVAL)
+            self._wake.clear()
+
+    def _update(self):
+        from .magic_castle import (
+            MagicCastle,
+            MagicCastleORM,
+            TERRAFORM_APPLY_LOG_FILENAME,
+        )
+
+        orm = db.session.execute(
+            db.select(MagicCastleORM).filter_by(hostname=self.hostname)
+        ).scalar_one_or_none()
+        if orm is None:
+            self._fingerprint = None
+            self._publish({"status": ClusterStatusCode.NOT_FOUND})
+            return
+
+        magic_castle = MagicCastle(orm)
+        log_path = path.join(magic_castle.path, TERRAFORM_APPLY_LOG_FILENAME)
+        if self._log_path is None:
+            self._log_path = log_path
+            TerraformApplyLogParser.subscribe(log_path, self._wake.set)
+        try:
+            log_stat = stat(log_path)
+            log_fingerprint = (log_stat.st_ino, log_stat.st_size, log_stat.st_mtime_ns)
+        except FileNotFoundError:
+            log_fingerprint = None
+        fingerprint = (orm.status, orm.plan_type, log_fingerprint)
+        if fingerprint == self._fingerprint:
+            return
+        self._fingerprint = fingerprint
+        self._publish(get_progress_report(magic_castle))
+
+    def _publish(self, report):
+        with self._watchers_lock:
+            event, data = get_progress_delta(self._report, report)
+            self._report = report
+            if event is not None:
+                for queue in self._subscribers:
+                    queue.put((event, data))
@@ -1,36 +1,42 @@
 import requests
 
-from requests.exceptions import ConnectionError, ReadTimeout
+from requests.exceptions import RequestException
 
 MAX_PROVISIONING_TIME = 3600
 
+# Services created by Magic Castle, with the status code they answer once online
+ONLINE_STATUS_CODES = {
+    "jupyter": 405,
+    "ipa": 301,
+    "mokey": 405,
+}
+
 
 class ProvisioningManager:
     """
     ProvisioningManager is responsible checking the provisioning status of a cluster.
 
-    ProvisioningManager sends GET requests to HTTP services created by Magic Castle via
+    ProvisioningManager sends HEAD requests to HTTP services created by Magic Castle via
     its check_online() method. If the method returns False, the provisioning is yet
     completed, if it returns True, the services are online and the cluster is most
     likely online.
     """
 
     @classmethod
-    def check_online(self, hostname):
+    def check_online(cls, hostname, session=requests, timeout=0.1):
+        """
+        :param hostname: The hostname of the cluster.
+        :param session: The requests session reusing connections, if any.
+        :param timeout: The timeout of each request, in seconds.
+        :return: True if all the services of the cluster are online.
+        """
         try:
-            return (
-                requests.head(
-                    f"https://jupyter.{hostname}", timeout=0.1, verify=False
-                ).status_code
-                == 405
-                and requests.head(
-                    f"https://ipa.{hostname}", timeout=0.1, verify=False
-                ).status_code
-                == 301
-                and requests.head(
-                    f"https://mokey.{hostname}", timeout=0.1, verify=False
+            return all(
+                session.head(
+                    f"https://{service}.{hostname}", timeout=timeout, verify=False
                 ).status_code
-                == 405
+                == status_code
+                for service, status_code in ONLINE_STATUS_CODES.items()
             )
-        except (ConnectionError, ReadTimeout):
+        except RequestException:
             return False
@@ -0,0 +1,116 @@
+import datetime
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+from .provisioning_manager import (
+    ProvisioningManager,
+    MAX_PROVISIONING_TIME,
+    ONLINE_STATUS_CODES,
+)
+from ..magic_castle.cluster_status_code import ClusterStatusCode
+from ...configuration.env import (
+    PROBER_INTERVAL,
+    PROBER_MAX_WORKERS,
+    PROBER_MAX_BACKOFF,
+    PROBER_REQUEST_TIMEOUT,
+)
+from ...database import db
+
+
+class ProvisioningProber:
+    """
+    ProvisioningProber checks whether the clusters being provisioned are online and
+    saves their status transitions in the database.
+
+    The clusters are checked concurrently, through a single requests session that
+    pools the connections. A cluster that is not online yet is checked again after a
+    delay that doubles after each check, from PROBER_INTERVAL up to PROBER_MAX_BACKOFF
+    seconds.
+    """
+
+    def __init__(
+        self,
+        max_workers=PROBER_MAX_WORKERS,
+        min_backoff=PROBER_INTERVAL,
+        max_backoff=PROBER_MAX_BACKOFF,
+        timeout=PROBER_REQUEST_TIMEOUT,
+    ):
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max_workers * len(ONLINE_STATUS_CODES),
+            pool_maxsize=max_workers,
+        )
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # hostname -> (number of checks, time of the next check)
+        self.backoffs = {}
+
+    def probe(self):
+        """
+        Checks the clusters being provisioned that are due, and saves the transitions
+        to provisioning_success, or to provisioning_error when the provisioning lasts
+        more than MAX_PROVISIONING_TIME.
+
+        :return: The hostnames of the clusters that have been checked.
+        """
+        from ..magic_castle.magic_castle import MagicCastleORM
+
+        rows = db.session.execute(
+            db.select(MagicCastleORM.hostname, MagicCastleORM.created).filter_by(
+                status=ClusterStatusCode.PROVISIONING_RUNNING
+            )
+        ).all()
+        # Leave the session, the checks may take a while
+        db.session.rollback()
+
+        self.backoffs = {
+            row.hostname: self.backoffs[row.hostname]
+            for row in rows
+            if row.hostname in self.backoffs
+        }
+        now = monotonic()
+        due = [
+            row
+            for row in rows
+            if self.backoffs.get(row.hostname, (0, now))[1] <= now
+        ]
+        online = self.executor.map(
+            lambda row: ProvisioningManager.check_online(
+                row.hostname, session=self.session, timeout=self.timeout
+            ),
+            due,
+        )
+
+        utcnow = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        for row, is_online in zip(due, online):
+            if is_online:
+                self.save_status(row.hostname, ClusterStatusCode.PROVISIONING_SUCCESS)
+            elif MAX_PROVISIONING_TIME < (utcnow - row.created).total_seconds():
+                self.save_status(row.hostname, ClusterStatusCode.PROVISIONING_ERROR)
+            else:
+                checks = self.backoffs.get(row.hostname, (0, now))[0] + 1
+                delay = min(self.min_backoff * 2 ** (checks - 1), self.max_backoff)
+                self.backoffs[row.hostname] = (checks, monotonic() + delay)
+        return [row.hostname for row in due]
+
+    def save_status(self, hostname, status):
+        from ..magic_castle.magic_castle import MagicCastle, MagicCastleORM
+
+        self.backoffs.pop(hostname, None)
+        orm = db.session.execute(
+            db.select(MagicCastleORM).filter_by(hostname=hostname)
+        ).scalar_one_or_none()
+        # The cluster may have been modified during the checks
+        if orm is None or orm.status != ClusterStatusCode.PROVISIONING_RUNNING:
+            return
+        logging.info(f"{hostname} is now {status.value}")
+        MagicCastle(orm).status = status
@@ -0,0 +1,80 @@
+from os import environ
+from subprocess import getoutput
+from threading import Lock, Thread
+from time import monotonic
+
+from ..configuration.env import SSH_AGENT_KEYS_TTL
+
+
+def load_ssh_agent_keys():
+    """
+    :return: The public keys listed by the ssh agent of the local user.
+    """
+    try:
+        return getoutput("ssh-add -L").split("\n")
+    except:
+        return []
+
+
+class SSHAgentKeys:
+    """
+    Process-wide cache of the public keys of the local user's ssh agent, shown to the
+    LocalUser when the authentication type is NONE.
+
+    The keys are listed with ssh-add when they are first requested and whenever
+    SSH_AUTH_SOCK points to another agent. Once their time to live has passed, the
+    cached keys are still returned while a background thread lists them again, so
+    requests do not wait for ssh-add.
+    """
+
+    def __init__(self, ttl=SSH_AGENT_KEYS_TTL, loader=load_ssh_agent_keys):
+        self._ttl = ttl
+        self._loader = loader
+        self._lock = Lock()
+        self._keys = None
+        self._socket = None
+        self._expiry = 0
+        self._refreshing = False
+
+    def get(self):
+        """
+        :return: The list of the public keys of the ssh agent.
+        """
+        socket = environ.get("SSH_AUTH_SOCK")
+        with self._lock:
+            if self._keys is None or socket != self._socket:
+                self._set(socket, self._loader())
+            elif self._expiry <= monotonic() and not self._refreshing:
+                self._refreshing = True
+                Thread(target=self._refresh, args=(socket,), daemon=True).start()
+            return list(self._keys)
+
+    def _set(self, socket, keys):
+        self._socket = socket
+        self._keys = keys
+        self._expiry = monotonic() + self._ttl
+
+    def _refresh(self, socket):
+        keys = self._loader()
+        with self._lock:
+            self._refreshing = False
+            # The agent may have changed while its keys were listed
+            if socket == self._socket:
+                self._set(socket, keys)
+
+    def clear(self):
+        with self._lock:
+            self._keys = None
+            self._socket = None
+
+
+_keys = None
+_keys_lock = Lock()
+
+
+def get_ssh_agent_keys():
+    global _keys
+    with _keys_lock:
+        if _keys is None:
+            _keys = SSHAgentKeys()
+        return _keys
@@ -0,0 +1,265 @@
+import json
+import logging
+import re
+
+from collections import defaultdict
+from os import stat
+from subprocess import CalledProcessError, Popen, PIPE, STDOUT
+from threading import Lock
+
+RESOURCE_EVENTS = {
+    "Creating...": "creation_running",
+    "Destroying...": "destruction_running",
+    "Modifying...": "modification_running",
+    "Creation complete": "creation_complete",
+    "Destruction complete": "destruction_complete",
+    "Modifications complete": "modification_complete",
+}
+
+RESOURCE_EVENT_PATTERN = re.compile(
+    r"(?P<address>.+?): (?P<message>"
+    + "|".join(re.escape(message) for message in RESOURCE_EVENTS)
+    + ")"
+)
+
+# Machine readable messages of terraform apply -json, by message type and action
+JSON_RESOURCE_EVENTS = {
+    "apply_start": {
+        "create": "creation_running",
+        "delete": "destruction_running",
+        "update": "modification_running",
+    },
+    "apply_complete": {
+        "create": "creation_complete",
+        "delete": "destruction_complete",
+        "update": "modification_complete",
+    },
+}
+JSON_ELAPSED_TYPES = {"apply_progress", "apply_complete", "apply_errored"}
+JSON_RESOURCE_TYPES = JSON_ELAPSED_TYPES | {"apply_start"}
+
+
+class TerraformApplyLogParser:
+    """
+    Stateful parser of the output of terraform apply.
+
+    The parser remembers the byte offset up to which the log has been consumed, so
+    following a running terraform apply only costs the parsing of the new lines. The
+    resource events ("Creating...", "Creation complete", "Destroying...", etc.) are
+    indexed by resource address with the order of their first occurrence in the log.
+
+    When terraform apply is launched with run, its output is indexed line by line as
+    it is written to the log, and parse_file answers from memory until it exits.
+
+    Both the human readable output and the machine readable output of terraform
+    apply -json are understood. The latter also gives the elapsed time of each
+    resource change, see get_elapsed.
+    """
+
+    _parsers = {}
+    _subscribers = defaultdict(set)
+    _parsers_lock = Lock()
+
+    def __init__(self):
+        self._lock = Lock()
+        self._live = False
+        self._reset(None)
+
+    def _reset(self, inode):
+        self._inode = inode
+        self._offset = 0
+        self._sequence = 0
+        self._events = {}
+        self._elapsed = {}
+
+    @classmethod
+    def parse(cls, terraform_apply_output: str):
+        """
+        Parses the complete output of terraform apply.
+
+        :param terraform_apply_output: The output of terraform apply or terraform destroy.
+        :return: The resource events, see get_events.
+        """
+        parser = cls()
+        for line in terraform_apply_output.splitlines():
+            parser._parse_line(line)
+        return parser.get_events()
+
+    @classmethod
+    def parse_file(cls, log_path):
+        """
+        Parses the lines appended to a terraform apply log since the last call.
+
+        A single parser is kept per log path in the process. It starts over when the
+        log is replaced (log rotation) or truncated, and it is discarded when the log
+        does not exist anymore.
+
+        :param log_path: The path of the terraform apply log.
+        :return: The resource events, see get_events.
+        """
+        parser = cls._get_parser(log_path)
+        with parser._lock:
+            if parser._live:
+                return dict(parser._events)
+        try:
+            return parser._update(log_path)
+        except FileNotFoundError:
+            # terraform apply was not launched yet, or the cluster has been destroyed
+            with cls._parsers_lock:
+                cls._parsers.pop(log_path, None)
+            return {}
+
+    @classmethod
+    def run(cls, cmd_args, log_path, **kwargs):
+        """
+        Runs terraform apply, writes its output to the log and indexes the resource
+        events of each line as soon as terraform prints it. The subscribers of the log
+        are notified of every new event.
+
+        :param cmd_args: The terraform apply command.
+        :param log_path: The path of the terraform apply log, overwritten.
+        :param kwargs: The keyword arguments of Popen, e.g. cwd and env.
+        :raise CalledProcessError: When terraform apply fails.
+        """
+        parser = cls._get_parser(log_path)
+        with parser._lock:
+            parser._reset(None)
+            parser._live = True
+        try:
+            with open(log_path, "wb") as log_file, Popen(
+                cmd_args, stdout=PIPE, stderr=STDOUT, **kwargs
+            ) as process:
+                for line in process.stdout:
+                    log_file.write(line)
+                    log_file.flush()
+                    with parser._lock:
+                        parser._offset += len(line)
+                        new_event = parser._parse_line(
+                            line.decode(errors="replace").rstrip("\n")
+                        )
+                    if new_event:
+                        cls._notify(log_path)
+                returncode = process.wait()
+        finally:
+            with parser._lock:
+                parser._live = False
+                try:
+                    parser._inode = stat(log_path).st_ino
+                except FileNotFoundError:
+                    pass
+            cls._notify(log_path)
+        if returncode != 0:
+            raise CalledProcessError(returncode, cmd_args)
+
+    @classmethod
+    def subscribe(cls, log_path, callback):
+        """
+        Calls callback, without arguments, whenever new resource events of a running
+        terraform apply are indexed.
+        """
+        with cls._parsers_lock:
+            cls._subscribers[log_path].add(callback)
+
+    @classmethod
+    def unsubscribe(cls, log_path, callback):
+        with cls._parsers_lock:
+            subscribers = cls._subscribers.get(log_path)
+            if subscribers is not None:
+                subscribers.discard(callback)
+                if not subscribers:
+                    del cls._subscribers[log_path]
+
+    @classmethod
+    def _notify(cls, log_path):
+        with cls._parsers_lock:
+            subscribers = list(cls._subscribers.get(log_path, ()))
+        for callback in subscribers:
+            try:
+                callback()
+            except Exception as error:
+                logging.error(f"Could not notify a subscriber of {log_path}: {error}")
+
+    @classmethod
+    def _get_parser(cls, log_path):
+        with cls._parsers_lock:
+            parser = cls._parsers.get(log_path)
+            if parser is None:
+                parser = cls._parsers[log_path] = cls()
+            return parser
+
+    @classmethod
+    def get_elapsed(cls, log_path):
+        """
+        :param log_path: The path of a terraform apply log, parsed with parse_file.
+        :return: The seconds elapsed since the start of the change of each resource,
+        by resource address, as reported by terraform apply -json.
+        """
+        with cls._parsers_lock:
+            parser = cls._parsers.get(log_path)
+        if parser is None:
+            return {}
+        with parser._lock:
+            return dict(parser._elapsed)
+
+    def get_events(self):
+        """
+        :return: A copy of the resource events, for instance:
+        {
+            ("module.openstack.openstack_networking_floatingip_v2.fip[0]", "creation_running"): 0,
+            ("module.openstack.openstack_networking_floatingip_v2.fip[0]", "creation_complete"): 3,
+            ...
+        }
+        where the value is the order of the first occurrence of the event in the log.
+        """
+        with self._lock:
+            return dict(self._events)
+
+    def _update(self, log_path):
+        with self._lock:
+            with open(log_path, "rb") as log_file:
+                log_stat = stat(log_file.fileno())
+                if log_stat.st_ino != self._inode or log_stat.st_size < self._offset:
+                    self._reset(log_stat.st_ino)
+                log_file.seek(self._offset)
+                new_bytes = log_file.read()
+            # A line is only parsed once terraform has written all of it
+            end = new_bytes.rfind(b"\n") + 1
+            for line in new_bytes[:end].decode(errors="replace").splitlines():
+                self._parse_line(line)
+            self._offset += end
+            return dict(self._events)
+
+    def _parse_line(self, line):
+        """
+        :return: True if the line holds a new resource event.
+        """
+        if line.startswith("{"):
+            key = self._parse_json_line(line)
+        else:
+            match = RESOURCE_EVENT_PATTERN.match(line)
+            key = None
+            if match is not None:
+                key = (match["address"], RESOURCE_EVENTS[match["message"]])
+        if key is None or key in self._events:
+            return False
+        self._events[key] = self._sequence
+        self._sequence += 1
+        return True
+
+    def _parse_json_line(self, line):
+        """
+        :return: The resource event key of a machine readable message, if any.
+        """
+        try:
+            message = json.loads(line)
+            message_type = message.get("type")
+            if message_type not in JSON_RESOURCE_TYPES:
+                return None
+            hook = message["hook"]
+            address = hook["resource"]["addr"]
+        except (ValueError, AttributeError, KeyError, TypeError):
+            return None
+        if message_type in JSON_ELAPSED_TYPES and "elapsed_seconds" in hook:
+            self._elapsed[address] = hook["elapsed_seconds"]
+        event = JSON_RESOURCE_EVENTS.get(message_type, {}).get(hook.get("action"))
+        return None if event is None else (address, event)
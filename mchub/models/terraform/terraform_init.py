@@ -0,0 +1,256 @@
+import hashlib
+import json
+import logging
+
+from collections import defaultdict
+from enum import Enum
+from os import path, environ, link, makedirs, rename
+from shutil import copy2, copytree, ignore_patterns, rmtree
+from subprocess import run
+from tempfile import mkdtemp
+from threading import Lock
+
+from ...configuration.env import (
+    TERRAFORM_PLUGIN_CACHE_PATH,
+    TERRAFORM_SKELETONS_PATH,
+)
+from ...configuration.magic_castle import (
+    MAGIC_CASTLE_VERSION,
+    MAIN_TERRAFORM_FILENAME,
+)
+
+TERRAFORM_DATA_DIRNAME = ".terraform"
+TERRAFORM_LOCK_FILENAME = ".terraform.lock.hcl"
+TERRAFORM_PROVIDERS_DIRNAME = "providers"
+# Written in the .terraform directory after each successful initialization
+INIT_STAMP_FILENAME = "mchub-init.sha256"
+
+
+class InitResult(Enum):
+    SKIPPED = "skipped"
+    CLONED = "cloned"
+    INITIALIZED = "initialized"
+
+
+def link_or_copy(source, destination):
+    """
+    Hard links a file, or copies it when the destination is on another filesystem.
+    """
+    try:
+        link(source, destination)
+    except OSError:
+        copy2(source, destination)
+
+
+def copy_data_directory(source, destination):
+    """
+    Copies a .terraform directory. The provider binaries are hard linked, since
+    terraform never modifies them, while the other files are copied because terraform
+    init rewrites some of them in place (e.g. modules/modules.json).
+    """
+    providers_path = path.join(source, TERRAFORM_PROVIDERS_DIRNAME)
+
+    def copy_function(source_file, destination_file):
+        if path.commonpath([providers_path, source_file]) == providers_path:
+            link_or_copy(source_file, destination_file)
+        else:
+            copy2(source_file, destination_file)
+
+    copytree(
+        source,
+        destination,
+        symlinks=True,
+        copy_function=copy_function,
+        ignore=ignore_patterns(INIT_STAMP_FILENAME),
+    )
+
+
+def get_stamp_path(cluster_path):
+    return path.join(cluster_path, TERRAFORM_DATA_DIRNAME, INIT_STAMP_FILENAME)
+
+
+def read_lock_file(directory):
+    try:
+        with open(path.join(directory, TERRAFORM_LOCK_FILENAME), "rb") as lock_file:
+            return lock_file.read()
+    except FileNotFoundError:
+        return None
+
+
+class TerraformInitManager:
+    """
+    TerraformInitManager initializes the terraform working directory of the clusters.
+
+    Every cluster of a given Magic Castle version and cloud provider uses the same
+    modules and providers, so terraform init only runs for the first one. Its
+    .terraform directory and dependency lock file are then kept as a skeleton that the
+    following clusters clone, hard linking the provider binaries, instead of running
+    terraform init again. Providers are installed in a plugin cache shared by all the
+    clusters.
+    """
+
+    def __init__(
+        self,
+        skeletons_path=TERRAFORM_SKELETONS_PATH,
+        plugin_cache_path=TERRAFORM_PLUGIN_CACHE_PATH,
+    ):
+        self.skeletons_path = skeletons_path
+        self.plugin_cache_path = plugin_cache_path
+        self._locks = defaultdict(Lock)
+        self._locks_lock = Lock()
+
+    def get_environment_variables(self):
+        return {"TF_PLUGIN_CACHE_DIR": self.plugin_cache_path}
+
+    @staticmethod
+    def get_modules_hash(cluster_path):
+        """
+        :param cluster_path: The path of a cluster with a main.tf.json file.
+        :return: The hash of the Magic Castle version and of the module sources.
+        """
+        with open(path.join(cluster_path, MAIN_TERRAFORM_FILENAME)) as main_file:
+            modules = json.load(main_file).get("module", {})
+        sources = {name: module.get("source") for name, module in modules.items()}
+        key = json.dumps([MAGIC_CASTLE_VERSION, sources], sort_keys=True)
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get_skeleton_path(self, modules_hash):
+        return path.join(self.skeletons_path, modules_hash[:16])
+
+    @staticmethod
+    def get_stamp(cluster_path, modules_hash):
+        """
+        :return: The hash of the modules and of the dependency lock file of a cluster.
+        """
+        stamp = hashlib.sha256(modules_hash.encode())
+        stamp.update(read_lock_file(cluster_path) or b"")
+        return stamp.hexdigest()
+
+    @staticmethod
+    def read_stamp(cluster_path):
+        try:
+            with open(get_stamp_path(cluster_path)) as stamp_file:
+                return stamp_file.read()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def write_stamp(cluster_path, stamp):
+        with open(get_stamp_path(cluster_path), "w") as stamp_file:
+            stamp_file.write(stamp)
+
+    def init(self, cluster_path, upgrade=False, timeout=None):
+        """
+        Initializes the terraform working directory of a cluster, from the skeleton
+        matching its modules when there is one.
+
+        A cluster whose modules and dependency lock file are unchanged since its last
+        successful initialization is skipped. A cluster whose dependency lock file
+        differs from the one of the skeleton is initialized with terraform init, to
+        keep the provider versions it selected.
+
+        :param cluster_path: The path of a cluster with a main.tf.json file.
+        :param upgrade: True to run terraform init -upgrade and replace the skeleton.
+        :param timeout: The number of seconds after which terraform init is killed.
+        :return: The InitResult.
+        """
+        modules_hash = self.get_modules_hash(cluster_path)
+        if not upgrade and self.read_stamp(cluster_path) == self.get_stamp(
+            cluster_path, modules_hash
+        ):
+            return InitResult.SKIPPED
+
+        skeleton_path = self.get_skeleton_path(modules_hash)
+        with self._locks_lock:
+            lock = self._locks[skeleton_path]
+        # The lock is only held while the skeleton is created or cloned, so the
+        # clusters that do not use the skeleton are initialized concurrently
+        if upgrade:
+            self.run_init(cluster_path, upgrade, timeout)
+            with lock:
+                self.save_skeleton(cluster_path, skeleton_path)
+            result = InitResult.INITIALIZED
+        else:
+            with lock:
+                if not path.isdir(skeleton_path):
+                    # The other clusters with these modules wait for the skeleton
+                    self.run_init(cluster_path, upgrade, timeout)
+                    self.save_skeleton(cluster_path, skeleton_path)
+                    result = InitResult.INITIALIZED
+                elif read_lock_file(cluster_path) in (
+                    None,
+                    read_lock_file(skeleton_path),
+                ):
+                    self.clone_skeleton(skeleton_path, cluster_path)
+                    result = InitResult.CLONED
+                else:
+                    result = None
+            if result is None:
+                # Keeps the provider versions selected by the cluster's lock file
+                self.run_init(cluster_path, upgrade, timeout)
+                result = InitResult.INITIALIZED
+
+        if path.isdir(path.join(cluster_path, TERRAFORM_DATA_DIRNAME)):
+            self.write_stamp(cluster_path, self.get_stamp(cluster_path, modules_hash))
+        return result
+
+    def run_init(self, cluster_path, upgrade=False, timeout=None):
+        makedirs(self.plugin_cache_path, exist_ok=True)
+        env = environ.copy()
+        env.update(self.get_environment_variables())
+        cmd_args = ["terraform", "init", "-no-color", "-input=false"]
+        if upgrade:
+            cmd_args += ["-upgrade"]
+        run(
+            cmd_args,
+            cwd=cluster_path,
+            env=env,
+            capture_output=True,
+            check=True,
+            timeout=timeout,
+        )
+
+    def clone_skeleton(self, skeleton_path, cluster_path):
+        data_path = path.join(cluster_path, TERRAFORM_DATA_DIRNAME)
+        rmtree(data_path, ignore_errors=True)
+        copy_data_directory(
+            path.join(skeleton_path, TERRAFORM_DATA_DIRNAME), data_path
+        )
+        # terraform rewrites the lock file in place, it cannot be shared
+        copy2(
+            path.join(skeleton_path, TERRAFORM_LOCK_FILENAME),
+            path.join(cluster_path, TERRAFORM_LOCK_FILENAME),
+        )
+
+    def save_skeleton(self, cluster_path, skeleton_path):
+        data_path = path.join(cluster_path, TERRAFORM_DATA_DIRNAME)
+        lock_file_path = path.join(cluster_path, TERRAFORM_LOCK_FILENAME)
+        if not path.isdir(data_path) or not path.isfile(lock_file_path):
+            return
+        makedirs(self.skeletons_path, exist_ok=True)
+        # The skeleton is assembled aside, then moved in place in a single step
+        temporary_path = mkdtemp(dir=self.skeletons_path, prefix=".")
+        try:
+            copy_data_directory(
+                data_path, path.join(temporary_path, TERRAFORM_DATA_DIRNAME)
+            )
+            copy2(lock_file_path, path.join(temporary_path, TERRAFORM_LOCK_FILENAME))
+            rmtree(skeleton_path, ignore_errors=True)
+            rename(temporary_path, skeleton_path)
+        except OSError as error:
+            logging.warning(
+                f"Could not save the terraform skeleton {skeleton_path}: {error}"
+            )
+            rmtree(temporary_path, ignore_errors=True)
+
+
+_manager = None
+_manager_lock = Lock()
+
+
+def get_terraform_init_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = TerraformInitManager()
+        return _manager
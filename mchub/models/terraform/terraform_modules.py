@@ -0,0 +1,46 @@
+import json
+import re
+
+from glob import glob
+from os import path
+
+from .terraform_init import TERRAFORM_DATA_DIRNAME
+
+# Manifest of the modules installed by terraform init, with their directory
+TERRAFORM_MODULES_MANIFEST = path.join(
+    TERRAFORM_DATA_DIRNAME, "modules", "modules.json"
+)
+
+RESOURCE_PATTERN = re.compile(
+    r'^\s*resource\s+"([^"]+)"\s+"([^"]+)"', flags=re.MULTILINE
+)
+
+
+def read_module_addresses(cluster_path):
+    """
+    Lists the addresses of the modules installed in the working directory of a
+    cluster and of the resources they declare, e.g. module.openstack,
+    module.openstack.module.provision and
+    module.openstack.openstack_compute_instance_v2.instances.
+
+    :param cluster_path: The working directory of the cluster.
+    :return: The set of addresses, or None when the modules are not installed.
+    """
+    try:
+        with open(path.join(cluster_path, TERRAFORM_MODULES_MANIFEST)) as manifest:
+            modules = json.load(manifest)["Modules"]
+    except (FileNotFoundError, KeyError, json.decoder.JSONDecodeError):
+        return None
+
+    addresses = set()
+    for module in modules:
+        # The root module has an empty key, the nested modules a dotted key
+        if not module.get("Key"):
+            continue
+        address = ".".join(f"module.{name}" for name in module["Key"].split("."))
+        addresses.add(address)
+        for filename in glob(path.join(cluster_path, module["Dir"], "*.tf")):
+            with open(filename) as module_file:
+                for resource_type, name in RESOURCE_PATTERN.findall(module_file.read()):
+                    addresses.add(f"{address}.{resource_type}.{name}")
+    return addresses
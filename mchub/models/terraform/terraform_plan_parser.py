@@ -1,3 +1,8 @@
+from .terraform_apply_log_parser import TerraformApplyLogParser, RESOURCE_EVENTS
+
+PLAN_SUMMARY_VERSION = 1
+
+
 class TerraformPlanParser:
     """
     Class in charge of parsing the json representation outputted by terraform plan
@@ -7,11 +12,45 @@ class TerraformPlanParser:
     https://www.terraform.io/docs/internals/json-format.html#change-representation
     """
 
+    @staticmethod
+    def summarize(plan):
+        """
+        Reduces the output of terraform show -json to the fields of the resource
+        changes used by get_resources_changes. The types and the actions, shared by
+        many resources, are stored once and referenced by index.
+
+        :param plan: The Terraform plan, as outputted by terraform show -json.
+        :return: The plan summary, for instance:
+        {
+            "summary_version": 1,
+            "types": ["openstack_networking_floatingip_v2", ...],
+            "actions": [["create"], ...],
+            "resources": [
+                ["module.openstack.openstack_networking_floatingip_v2.fip[0]", 0, 0],
+                ...
+            ],
+        }
+        """
+        types, actions, resources = {}, {}, []
+        for resource in plan.get("resource_changes") or []:
+            type_index = types.setdefault(resource["type"], len(types))
+            resource_actions = tuple(resource["change"]["actions"])
+            actions_index = actions.setdefault(resource_actions, len(actions))
+            resources.append([resource["address"], type_index, actions_index])
+        return {
+            "summary_version": PLAN_SUMMARY_VERSION,
+            "types": list(types),
+            "actions": [list(resource_actions) for resource_actions in actions],
+            "resources": resources,
+        }
+
     @staticmethod
     def get_resources_changes(plan):
         """
         Outputs the relevant fields in the Terraform plan's resource changes.
 
+        :param plan: The plan summary, or the Terraform plan saved before the
+        summaries were introduced.
         :return: The resource changes. For example:
 
         [
@@ -23,6 +62,17 @@ class TerraformPlanParser:
             ...
         ]
         """
+        if "summary_version" in plan:
+            types, actions = plan["types"], plan["actions"]
+            return [
+                {
+                    "address": address,
+                    "type": types[type_index],
+                    "change": {"actions": list(actions[actions_index])},
+                }
+                for address, type_index, actions_index in plan["resources"]
+            ]
+
         raw_resource_changes = plan.get("resource_changes")
         if raw_resource_changes:
             return [
@@ -58,21 +108,35 @@ class TerraformPlanParser:
             ...
         ]
         """
+        return TerraformPlanParser.get_progress(
+            initial_plan, TerraformApplyLogParser.parse(terraform_apply_output)
+        )
+
+    @staticmethod
+    def get_progress(initial_plan, apply_events, elapsed=None):
+        """
+        Same as get_done_changes, from the resource events of terraform apply already
+        indexed by TerraformApplyLogParser. The cost is linear in the number of
+        resources, independently of the size of the log.
+
+        :param initial_plan: The initial Terraform plan.
+        :param apply_events: The resource events returned by TerraformApplyLogParser.
+        :param elapsed: The elapsed seconds by resource address, when known.
+        :return: The resource changes, with a "progress" attribute, and an
+        "elapsed_seconds" attribute for the resources whose elapsed time is known.
+        """
+        elapsed = elapsed or {}
         done_resources_changes = TerraformPlanParser.get_resources_changes(initial_plan)
         for done_resource_change in done_resources_changes:
             resource_address = done_resource_change["address"]
+            if resource_address in elapsed:
+                done_resource_change["change"]["elapsed_seconds"] = elapsed[
+                    resource_address
+                ]
 
-            search_queries = {
-                "creation_running": f"{resource_address}: Creating...",
-                "destruction_running": f"{resource_address}: Destroying...",
-                "modification_running": f"{resource_address}: Modifying...",
-                "creation_complete": f"{resource_address}: Creation complete",
-                "destruction_complete": f"{resource_address}: Destruction complete",
-                "modification_complete": f"{resource_address}: Modifications complete",
-            }
             search_results = {
-                query_name: terraform_apply_output.find(query_text)
-                for (query_name, query_text) in search_queries.items()
+                event: apply_events.get((resource_address, event), -1)
+                for event in RESOURCE_EVENTS.values()
             }
 
             progress = "queued"
@@ -1,34 +1,39 @@
-from jsonpath_ng.ext import parse
+from collections import namedtuple
 
-CLOUD_PARSER = {
-    "openstack": {
-        "instance_count": parse(
-            "resources[?type=openstack_compute_flavor_v2].instances[*].attributes.id"
-        ),
-        "cores": parse(
-            "resources[?type=openstack_compute_flavor_v2].instances[*].attributes.vcpus"
-        ),
-        "ram": parse(
-            "resources[?type=openstack_compute_flavor_v2].instances[*].attributes.ram"
-        ),
-        "volumes": parse(
-            "resources[?type=openstack_blockstorage_volume_v3].instances[*].attributes.size"
-        ),
-        "instance_volumes": parse(
-            "resources[?type=openstack_compute_instance_v2].instances[*].attributes.block_device[*].volume_size"
-        ),
-    }
+# Resource types whose instances are accounted for in the cloud resource usage
+CloudResourceTypes = namedtuple(
+    "CloudResourceTypes", ["flavor", "volume", "instance"]
+)
+
+CLOUD_RESOURCE_TYPES = {
+    "openstack": CloudResourceTypes(
+        flavor="openstack_compute_flavor_v2",
+        volume="openstack_blockstorage_volume_v3",
+        instance="openstack_compute_instance_v2",
+    )
 }
 
-IMAGE_PARSER = parse("resources[?name=image].instances[0].attributes.name")
-FREEIPA_PASSWD_PARSER = parse(
-    "resources[?name=freeipa_passwd].instances[0].attributes.result"
-)
+IMAGE_RESOURCE_NAME = "image"
+FREEIPA_PASSWD_RESOURCE_NAME = "freeipa_passwd"
+
+
+def first_instance_attribute(resource, attribute):
+    """
+    :return: A tuple (found, value) with the attribute of the first instance of the resource.
+    """
+    instances = resource.get("instances")
+    if instances:
+        attributes = instances[0].get("attributes")
+        if attributes and attribute in attributes:
+            return True, attributes[attribute]
+    return False, None
 
 
 class TerraformState:
     """
     TerraformState holds the state file of a cluster, i.e. the terraform.tfstate file.
+
+    All the values are extracted in a single pass over the resources of the state.
     """
 
     __slots__ = [
@@ -42,23 +47,53 @@ class TerraformState:
     ]
 
     def __init__(self, tf_state: object, cloud="openstack"):
-        parser = CLOUD_PARSER[cloud]
-        self.instance_count = len(parser["instance_count"].find(tf_state))
-        self.cores = sum([cores.value for cores in parser["cores"].find(tf_state)])
-        self.ram = sum([ram.value for ram in parser["ram"].find(tf_state)])
+        resource_types = CLOUD_RESOURCE_TYPES[cloud]
+        self.instance_count = 0
+        self.cores = 0
+        self.ram = 0
+        self.volume_count = 0
+        self.volume_size = 0
+        image_found, image = False, None
+        passwd_found, passwd = False, None
+
+        for resource in tf_state.get("resources", ()):
+            resource_type = resource.get("type")
+            if resource_type == resource_types.flavor:
+                for instance in resource.get("instances", ()):
+                    attributes = instance.get("attributes") or {}
+                    if "id" in attributes:
+                        self.instance_count += 1
+                    self.cores += attributes.get("vcpus", 0)
+                    self.ram += attributes.get("ram", 0)
+            elif resource_type == resource_types.volume:
+                for instance in resource.get("instances", ()):
+                    attributes = instance.get("attributes") or {}
+                    if "size" in attributes:
+                        self.volume_count += 1
+                        self.volume_size += attributes["size"]
+            elif resource_type == resource_types.instance:
+                for instance in resource.get("instances", ()):
+                    attributes = instance.get("attributes") or {}
+                    for block_device in attributes.get("block_device") or ():
+                        if "volume_size" in block_device:
+                            self.volume_count += 1
+                            self.volume_size += block_device["volume_size"]
+
+            resource_name = resource.get("name")
+            if resource_name == IMAGE_RESOURCE_NAME and not image_found:
+                image_found, image = first_instance_attribute(resource, "name")
+            elif resource_name == FREEIPA_PASSWD_RESOURCE_NAME and not passwd_found:
+                passwd_found, passwd = first_instance_attribute(resource, "result")
+
+        self.image = image if image_found else ""
+        self.freeipa_passwd = passwd if passwd_found else None
 
-        volumes = parser["volumes"].find(tf_state)
-        inst_volumes = parser["instance_volumes"].find(tf_state)
-        self.volume_count = len(volumes) + len(inst_volumes)
-        self.volume_size = sum(vol.value for vol in volumes) + sum(
-            vol.value for vol in inst_volumes
-        )
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
 
-        try:
-            self.image = IMAGE_PARSER.find(tf_state)[0].value
-        except:
-            self.image = ""
-        try:
-            self.freeipa_passwd = FREEIPA_PASSWD_PARSER.find(tf_state)[0].value
-        except:
-            self.freeipa_passwd = None
+    @classmethod
+    def from_dict(cls, data):
+        state = cls.__new__(cls)
+        for slot in cls.__slots__:
+            setattr(state, slot, data.get(slot))
+        return state
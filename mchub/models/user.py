@@ -1,16 +1,21 @@
-from subprocess import getoutput
 from typing import List
 from getpass import getuser
 
-from .magic_castle.magic_castle import MagicCastle, MagicCastleORM
+from .magic_castle.magic_castle import (
+    MagicCastle,
+    MagicCastleORM,
+    MAGIC_CASTLE_STATE_OPTIONS,
+)
 from ..database import db
 from .cloud.project import Project
+from .ssh_agent_keys import get_ssh_agent_keys
+from .user_cache import UserIdentity
 
 
 projects = db.Table(
     "projects",
-    db.Column("user_id", db.String(), db.ForeignKey("user.id"), primary_key=True),
-    db.Column("project_id", db.String(), db.ForeignKey("project.id"), primary_key=True),
+    db.Column("user_id", db.Integer, db.ForeignKey("user.id"), primary_key=True),
+    db.Column("project_id", db.Integer, db.ForeignKey("project.id"), primary_key=True),
 )
 
 
@@ -18,6 +23,10 @@ class UserORM(db.Model):
     __tablename__ = "user"
     id = db.Column(db.Integer, primary_key=True)
     scoped_id = db.Column(db.String(), unique=True)
+    # Incremented on every change of the user's projects, see UserCache
+    membership_revision = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
     projects = db.relationship(
         "Project",
         secondary=projects,
@@ -33,34 +42,152 @@ class TokenSuperUser:
     def projects(self):
         return db.session.scalars(db.select(Project)).all()
 
+    @property
+    def project_ids(self):
+        return frozenset(db.session.scalars(db.select(Project.id)).all())
+
     @property
     def magic_castles(self):
         return [
             MagicCastle(orm)
-            for orm in db.session.scalars(db.select(MagicCastleORM)).all()
+            for orm in db.session.scalars(
+                db.select(MagicCastleORM).options(*MAGIC_CASTLE_STATE_OPTIONS)
+            ).all()
         ]
 
 
+def load_user_identity(scoped_id):
+    """
+    Fetches the id of a user and the ids of their projects in a single query.
+
+    :param scoped_id: The scoped id of the user.
+    :return: The UserIdentity of the user, or None when the user is not in the
+        database.
+    """
+    rows = db.session.execute(
+        db.select(UserORM.id, UserORM.membership_revision, Project.id)
+        .outerjoin(UserORM.projects)
+        .where(UserORM.scoped_id == scoped_id)
+    ).all()
+    if not rows:
+        return None
+    return UserIdentity(
+        id=rows[0][0],
+        project_ids=frozenset(project_id for _, _, project_id in rows if project_id),
+        membership_revision=rows[0][1],
+    )
+
+
+def is_user_identity_current(identity):
+    """
+    Compares the revision of the project membership of a cached user with the
+    database, with a primary key lookup, since the projects may have been changed by
+    another process.
+
+    :param identity: The cached UserIdentity of the user.
+    :return: True if the projects of the user did not change since it was loaded.
+    """
+    revision = db.session.scalar(
+        db.select(UserORM.membership_revision).where(UserORM.id == identity.id)
+    )
+    return revision == identity.membership_revision
+
+
+def increment_membership_revision(*scoped_ids):
+    """
+    Marks a change of the projects of users, so the other processes reload their
+    cached identity. The change is saved with the next commit.
+
+    :param scoped_ids: The scoped ids of the users.
+    """
+    db.session.execute(
+        db.update(UserORM)
+        .where(UserORM.scoped_id.in_(scoped_ids))
+        .values(membership_revision=UserORM.membership_revision + 1)
+    )
+
+
 class User:
-    __slots__ = ["orm", "username", "domain", "usertype", "public_keys"]
+    """
+    A user is built either from its UserORM, or from its UserIdentity cached by
+    compute_current_user. In the latter case, the UserORM is only loaded when it is
+    used, e.g. to change the projects of the user.
+    """
+
+    __slots__ = [
+        "_orm",
+        "_identity",
+        "scoped_id",
+        "username",
+        "domain",
+        "usertype",
+        "public_keys",
+    ]
 
-    def __init__(self, orm, username, domain, usertype, public_keys=[]):
-        self.orm = orm
+    def __init__(
+        self,
+        orm,
+        scoped_id,
+        username,
+        domain,
+        usertype,
+        public_keys=[],
+        identity=None,
+    ):
+        self._orm = orm
+        self._identity = identity
+        self.scoped_id = scoped_id
         self.username = username
         self.domain = domain
         self.usertype = usertype
         self.public_keys = public_keys
 
+    @property
+    def orm(self):
+        if self._orm is None:
+            if self._identity is not None:
+                self._orm = db.session.get(UserORM, self._identity.id)
+            if self._orm is None:
+                self._orm = UserORM(scoped_id=self.scoped_id)
+        return self._orm
+
+    @property
+    def id(self):
+        if self._orm is None and self._identity is not None:
+            return self._identity.id
+        return self.orm.id
+
+    @property
+    def project_ids(self):
+        """
+        :return: The frozenset of the ids of the user's projects, for constant time
+            membership tests.
+        """
+        if self._identity is not None:
+            return self._identity.project_ids
+        return frozenset(project.id for project in self.orm.projects)
+
     @property
     def projects(self):
+        if self._orm is None and self._identity is not None:
+            return db.session.scalars(
+                db.select(Project)
+                .where(Project.id.in_(self._identity.project_ids))
+                .order_by(Project.id)
+            ).all()
         return self.orm.projects
 
     @property
     def magic_castles(self):
+        # The user's projects are ordered by id
         return [
             MagicCastle(orm=mc_orm)
-            for project in self.projects
-            for mc_orm in project.magic_castles
+            for mc_orm in db.session.scalars(
+                db.select(MagicCastleORM)
+                .where(MagicCastleORM.project_id.in_(self.project_ids))
+                .order_by(MagicCastleORM.project_id, MagicCastleORM.id)
+                .options(*MAGIC_CASTLE_STATE_OPTIONS)
+            ).all()
         ]
 
 
@@ -69,18 +196,16 @@ class LocalUser(User):
     User class for users created when the authentication type is set to NONE.
     """
 
-    def __init__(self, orm):
-        try:
-            public_keys = getoutput("ssh-add -L").split("\n")
-        except:
-            public_keys = []
+    def __init__(self, orm=None, identity=None):
         username = getuser()
         super().__init__(
             orm=orm,
+            scoped_id=f"{username}@localhost",
             username=username,
             domain="localhost",
             usertype="local",
-            public_keys=public_keys,
+            public_keys=get_ssh_agent_keys().get(),
+            identity=identity,
         )
 
 
@@ -93,12 +218,13 @@ class SAMLUser(User):
     edit his own clusters.
     """
 
-    __slots__ = ["scoped_id", "given_name", "surname", "mail"]
+    __slots__ = ["given_name", "surname", "mail"]
 
     def __init__(
         self,
         *,
-        orm,
+        orm=None,
+        identity=None,
         edu_person_principal_name,
         given_name,
         surname,
@@ -108,12 +234,13 @@ class SAMLUser(User):
         username, scope = edu_person_principal_name.split("@")
         super().__init__(
             orm=orm,
+            scoped_id=edu_person_principal_name,
             username=username,
             domain=scope,
             usertype="saml",
             public_keys=ssh_public_key.split(";"),
+            identity=identity,
         )
-        self.scoped_id = edu_person_principal_name
         self.given_name = given_name
         self.surname = surname
         self.mail = mail
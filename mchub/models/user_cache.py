@@ -0,0 +1,106 @@
+import hmac
+
+from collections import defaultdict
+from hashlib import sha256
+from secrets import token_bytes
+from threading import Lock
+from time import monotonic
+from typing import NamedTuple
+
+from ..configuration.env import USER_CACHE_TTL
+
+
+class UserIdentity(NamedTuple):
+    """
+    The database id of an authenticated user, the ids of the projects they are a
+    member of and the revision of their project membership when it was loaded.
+    """
+
+    id: int
+    project_ids: frozenset
+    membership_revision: int = 0
+
+
+class UserCache:
+    """
+    Process-wide cache of the users resolved from their scoped id, with a short time
+    to live. The users who are not yet in the database are not cached.
+
+    The entries are keyed by an HMAC of the scoped id, signed with a key drawn when
+    the cache is created, so the identities received in the request headers are
+    neither kept in memory nor used as keys that could be guessed.
+
+    Each key has a generation number, incremented every time its entry is
+    invalidated. A value loaded while the user was invalidated is not cached.
+
+    The invalidations only reach the cache of the process that changed the projects.
+    The other processes find out with the validator given to get, which compares the
+    cached identity with the database before it is returned.
+    """
+
+    def __init__(self, ttl=USER_CACHE_TTL, secret=None):
+        self._ttl = ttl
+        self._secret = token_bytes(32) if secret is None else secret
+        self._lock = Lock()
+        self._entries = {}
+        self._generations = defaultdict(int)
+
+    def _key(self, scoped_id):
+        return hmac.new(self._secret, scoped_id.encode(), sha256).digest()
+
+    def get(self, scoped_id, loader, validator=None):
+        """
+        Returns the cached identity of a user, or calls the loader and caches its
+        result when the identity is missing, expired or no longer valid.
+
+        :param scoped_id: The scoped id of the user, e.g. alice@computecanada.ca.
+        :param loader: The function fetching the UserIdentity from the database, or
+            None when the user does not exist.
+        :param validator: The function telling whether a cached UserIdentity is
+            still current, or None to trust the cache until the entry expires.
+        :return: The UserIdentity of the user, or None.
+        """
+        key = self._key(scoped_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            generation = self._generations[key]
+        if entry is not None and entry[0] > monotonic():
+            if validator is None or validator(entry[1]):
+                return entry[1]
+
+        identity = loader()
+
+        if identity is not None and self._ttl > 0:
+            with self._lock:
+                if self._generations[key] == generation:
+                    self._entries[key] = (monotonic() + self._ttl, identity)
+        return identity
+
+    def invalidate(self, *scoped_ids):
+        """
+        Removes the cached identity of users, after a change of their projects.
+
+        :param scoped_ids: The scoped ids of the users.
+        """
+        with self._lock:
+            for scoped_id in scoped_ids:
+                key = self._key(scoped_id)
+                self._generations[key] += 1
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+
+_cache = None
+_cache_lock = Lock()
+
+
+def get_user_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = UserCache()
+        return _cache
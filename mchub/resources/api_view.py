@@ -1,16 +1,25 @@
 import json
 import re
 
+from hashlib import sha256
+
 from getpass import getuser
 
 from flask import request
 from flask.views import MethodView
-from flask import make_response
+from flask import make_response, Response
+from werkzeug.http import quote_etag
 
 from ..configuration import get_config
-from ..database import db
 from ..models.auth_type import AuthType
-from ..models.user import LocalUser, SAMLUser, UserORM, TokenSuperUser
+from ..models.user import (
+    LocalUser,
+    SAMLUser,
+    TokenSuperUser,
+    is_user_identity_current,
+    load_user_identity,
+)
+from ..models.user_cache import get_user_cache
 from ..exceptions.invalid_usage_exception import (
     UnauthenticatedException,
     InvalidUsageException,
@@ -34,16 +43,51 @@ def output_json(route_handler):
 
     def decorator(**kwargs):
         response = route_handler(**kwargs)
-        if type(response) == tuple:
+        if isinstance(response, Response):
+            # Already serialized, e.g. a stream of server-sent events
+            return response
+        headers = {"Content-Type": "application/json"}
+        if type(response) == tuple and len(response) == 3:
+            data, response_code, extra_headers = response
+            headers.update(extra_headers)
+        elif type(response) == tuple:
             data, response_code = response
         else:
             data, response_code = response, DEFAULT_RESPONSE_CODE
-        headers = {"Content-Type": "application/json"}
         return make_response(json.dumps(data), response_code, headers)
 
     return decorator
 
 
+def make_etag(version):
+    """
+    :param version: A tuple of values that changes whenever the data of a response
+        changes, e.g. MagicCastle.state_version.
+    :return: The entity tag of the response.
+    """
+    return sha256(repr(version).encode()).hexdigest()[:32]
+
+
+def etag_headers(etag):
+    # The clients revalidate the response with If-None-Match before reusing it
+    return {"ETag": quote_etag(etag), "Cache-Control": "private, no-cache"}
+
+
+def conditional_response(etag, get_data):
+    """
+    Returns 304 Not Modified when the If-None-Match header of the request matches the
+    entity tag, without calling get_data. Otherwise, returns the data with its
+    entity tag.
+
+    :param etag: The entity tag of the data, see make_etag.
+    :param get_data: The function computing the data of the response.
+    :return: The response of the route handler.
+    """
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=etag_headers(etag))
+    return get_data(), DEFAULT_RESPONSE_CODE, etag_headers(etag)
+
+
 def handle_exceptions(route_handler):
     """
     Creates a decorator that catches server and user exceptions and injects the error
@@ -62,6 +106,17 @@ def handle_exceptions(route_handler):
     return decorator
 
 
+def get_user_identity(scoped_id):
+    """
+    :param scoped_id: The scoped id of the authenticated user.
+    :return: The UserIdentity of the user, from the user cache or from the database,
+        or None when the user is not in the database yet.
+    """
+    return get_user_cache().get(
+        scoped_id, lambda: load_user_identity(scoped_id), is_user_identity_current
+    )
+
+
 def compute_current_user(route_handler):
     """
     Creates a decorator used to pass the current User object as a parameter
@@ -95,13 +150,8 @@ def compute_current_user(route_handler):
                 # Therefore, special characters and accents in givenName and surname
                 # are not correctly decoded.
                 scoped_id = headers["eduPersonPrincipalName"]
-                orm = db.session.execute(
-                    db.select(UserORM).filter_by(scoped_id=scoped_id)
-                ).scalar_one_or_none()
-                if orm is None:
-                    orm = UserORM(scoped_id=scoped_id)
                 user = SAMLUser(
-                    orm=orm,
+                    identity=get_user_identity(scoped_id),
                     edu_person_principal_name=scoped_id,
                     given_name=headers["givenName"],
                     surname=headers["surname"],
@@ -113,12 +163,7 @@ def compute_current_user(route_handler):
                 raise UnauthenticatedException
         elif AuthType.NONE in auth_type:
             scoped_id = getuser() + "@localhost"
-            orm = db.session.execute(
-                db.select(UserORM).filter_by(scoped_id=scoped_id)
-            ).scalar_one_or_none()
-            if orm is None:
-                orm = UserORM(scoped_id=scoped_id)
-            user = LocalUser(orm=orm)
+            user = LocalUser(identity=get_user_identity(scoped_id))
         else:
             raise UnauthenticatedException
         return route_handler(user=user, **kwargs)
@@ -1,5 +1,6 @@
-from ..resources.api_view import ApiView
+from ..resources.api_view import ApiView, conditional_response, make_etag
 from ..models.cloud.cloud_manager import CloudManager
+from ..models.cloud.resource_cache import get_cloud_resource_cache
 from ..models.user import User
 from ..models.cloud.project import Project
 from ..models.magic_castle.magic_castle import MagicCastleORM, MagicCastle
@@ -15,26 +16,46 @@ class AvailableResourcesApi(ApiView):
             orm = db.session.execute(
                 db.select(MagicCastleORM).filter_by(hostname=hostname)
             ).scalar_one_or_none()
-            if orm and orm.project in user.projects:
+            if orm and orm.project_id in user.project_ids:
                 mc = MagicCastle(orm)
             else:
                 raise ClusterNotFoundException
             project = mc.project
-            allocated_resources = mc.allocated_resources
+            cluster_version = (orm.id, orm.revision)
         elif cloud_id:
             project = db.session.get(Project, cloud_id)
-            if project is None or project not in user.projects:
+            if project is None or project.id not in user.project_ids:
                 return {
                     "quotas": {},
                     "possible_resources": {},
                     "resource_details": {},
+                    "degraded": [],
                 }
-            allocated_resources = {}
+            mc = None
+            cluster_version = None
         else:
             return {
                 "quotas": {},
                 "possible_resources": {},
                 "resource_details": {},
+                "degraded": [],
             }
-        cloud = CloudManager(project=project, **allocated_resources)
-        return cloud.available_resources
+
+        def get_available_resources():
+            allocated_resources = mc.allocated_resources if mc else {}
+            cloud = CloudManager(project=project, **allocated_resources)
+            return cloud.available_resources
+
+        cache = get_cloud_resource_cache()
+        version = cache.version(project.id)
+        if version is None:
+            # The resources are being fetched, they get an entity tag once cached
+            return get_available_resources()
+        response = conditional_response(
+            make_etag(("resources", version, cluster_version)),
+            get_available_resources,
+        )
+        if isinstance(response, tuple) and cache.version(project.id) != version:
+            # The resources were replaced while the response was computed
+            return response[0]
+        return response
@@ -1,6 +1,8 @@
+import datetime
+
 from operator import imod
 from flask import request
-from .api_view import ApiView
+from .api_view import ApiView, conditional_response, make_etag
 from ..exceptions.invalid_usage_exception import (
     ClusterNotFoundException,
     InvalidUsageException,
@@ -8,6 +10,7 @@ from ..exceptions.invalid_usage_exception import (
 from ..models.cloud.project import Project
 from ..models.user import User
 from ..models.magic_castle.magic_castle import MagicCastleORM, MagicCastle
+from ..models.magic_castle.cluster_status_code import ClusterStatusCode
 from ..database import db
 
 
@@ -17,24 +20,60 @@ class MagicCastleAPI(ApiView):
             orm = db.session.execute(
                 db.select(MagicCastleORM).filter_by(hostname=hostname)
             ).scalar_one_or_none()
-            if orm and orm.project in user.projects:
-                return MagicCastle(orm).state
+            if orm and orm.project_id in user.project_ids:
+                magic_castle = MagicCastle(orm)
+                return conditional_response(
+                    make_etag(magic_castle.state_version), lambda: magic_castle.state
+                )
             else:
                 raise ClusterNotFoundException
         else:
-            return [mc.state for mc in user.magic_castles]
+            return MagicCastle.list_states(
+                user.project_ids,
+                statuses=self.get_statuses_filter(),
+                expires_before=self.get_expires_before_filter(),
+            )
+
+    @staticmethod
+    def get_statuses_filter():
+        """
+        :return: The statuses of the ?status= parameters, repeated or separated by
+            commas, or None when the clusters are not filtered by status.
+        """
+        values = [
+            value
+            for parameter in request.args.getlist("status")
+            for value in parameter.split(",")
+            if value
+        ]
+        if not values:
+            return None
+        try:
+            return [ClusterStatusCode(value) for value in values]
+        except ValueError as error:
+            raise InvalidUsageException(f"Invalid status filter: {error}")
+
+    @staticmethod
+    def get_expires_before_filter():
+        value = request.args.get("expires_before")
+        if not value:
+            return None
+        try:
+            return datetime.date.fromisoformat(value)
+        except ValueError:
+            raise InvalidUsageException(f"Invalid expires_before filter: {value}")
 
     def post(self, user: User, hostname, apply=False):
         if apply:
             orm = db.session.execute(
                 db.select(MagicCastleORM).filter_by(hostname=hostname)
             ).scalar_one_or_none()
-            if orm and orm.project in user.projects:
+            if orm and orm.project_id in user.project_ids:
                 magic_castle = MagicCastle(orm)
             else:
                 raise ClusterNotFoundException
-            magic_castle.apply()
-            return {}
+            job_id = magic_castle.apply()
+            return {"job_id": job_id}
         else:
             json_data = request.get_json()
             if not json_data:
@@ -42,34 +81,34 @@ class MagicCastleAPI(ApiView):
 
             cloud = json_data.get("cloud", {"id": None})
             project = db.session.get(Project, cloud["id"])
-            if project and project not in user.projects:
+            if project and project.id not in user.project_ids:
                 raise InvalidUsageException("Invalid project id")
 
             magic_castle = MagicCastle()
-            magic_castle.plan_creation(json_data)
-            return {}
+            job_id = magic_castle.plan_creation(json_data)
+            return {"job_id": job_id}
 
     def put(self, user: User, hostname):
         orm = db.session.execute(
             db.select(MagicCastleORM).filter_by(hostname=hostname)
         ).scalar_one_or_none()
-        if orm and orm.project in user.projects:
+        if orm and orm.project_id in user.project_ids:
             magic_castle = MagicCastle(orm)
         else:
             raise ClusterNotFoundException
         json_data = request.get_json()
         if not json_data:
             raise InvalidUsageException("No json data was provided")
-        magic_castle.plan_modification(json_data)
-        return {}
+        result, job_id = magic_castle.plan_modification(json_data)
+        return {"job_id": job_id, "plan": result}
 
     def delete(self, user: User, hostname):
         orm = db.session.execute(
             db.select(MagicCastleORM).filter_by(hostname=hostname)
         ).scalar_one_or_none()
-        if orm and orm.project in user.projects:
+        if orm and orm.project_id in user.project_ids:
             magic_castle = MagicCastle(orm)
         else:
             raise ClusterNotFoundException
-        magic_castle.plan_destruction()
-        return {}
+        result, job_id = magic_castle.plan_destruction()
+        return {"job_id": job_id, "plan": result}
@@ -1,27 +1,50 @@
-from .api_view import ApiView
+from flask import current_app, request, Response
+
+from .api_view import ApiView, conditional_response, make_etag
 from ..models.magic_castle.cluster_status_code import ClusterStatusCode
+from ..models.magic_castle.progress_watcher import (
+    ProgressWatcher,
+    format_event,
+    get_progress_report,
+)
 from ..models.user import User
 from ..models.magic_castle.magic_castle import MagicCastleORM, MagicCastle
 from ..database import db
 
+EVENT_STREAM_MIMETYPE = "text/event-stream"
+
 
 class ProgressAPI(ApiView):
     def get(self, user: User, hostname):
         orm = db.session.execute(
             db.select(MagicCastleORM).filter_by(hostname=hostname)
         ).scalar_one_or_none()
-        if orm and orm.project in user.projects:
-            magic_castle = MagicCastle(orm)
-        else:
-            return {"status": ClusterStatusCode.NOT_FOUND}
-        status = magic_castle.status
-        progress = magic_castle.get_progress()
-        stateful = magic_castle.tf_state is not None
-        if progress is None:
-            return {"status": status, "stateful": stateful}
-        else:
-            return {
-                "status": status,
-                "stateful": stateful,
-                "progress": progress,
-            }
+        stream = (
+            request.accept_mimetypes.best_match(
+                ["application/json", EVENT_STREAM_MIMETYPE]
+            )
+            == EVENT_STREAM_MIMETYPE
+        )
+        if orm is None or orm.project_id not in user.project_ids:
+            report = {"status": ClusterStatusCode.NOT_FOUND}
+            if stream:
+                return self.event_stream([format_event("snapshot", report)])
+            return report
+        if stream:
+            watcher, queue = ProgressWatcher.subscribe(
+                current_app._get_current_object(), hostname
+            )
+            return self.event_stream(watcher.stream(queue))
+        magic_castle = MagicCastle(orm)
+        return conditional_response(
+            make_etag(magic_castle.progress_version),
+            lambda: get_progress_report(magic_castle),
+        )
+
+    @staticmethod
+    def event_stream(events):
+        return Response(
+            events,
+            mimetype=EVENT_STREAM_MIMETYPE,
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
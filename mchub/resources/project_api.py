@@ -2,8 +2,11 @@ from flask import request
 
 from .api_view import ApiView
 from ..database import db
-from ..models.user import User, UserORM
+from ..models.user import User, UserORM, increment_membership_revision
+from ..models.user_cache import get_user_cache
 from ..models.cloud.project import Project, Provider, ENV_VALIDATORS
+from ..models.cloud.connection_pool import get_connection_pool
+from ..models.cloud.resource_cache import get_cloud_resource_cache
 from ..exceptions.invalid_usage_exception import (
     InvalidUsageException,
 )
@@ -13,16 +16,16 @@ class ProjectAPI(ApiView):
     def get(self, user: User, id: int = None):
         if id is not None:
             project = db.session.get(Project, id)
-            if project is None or project not in user.orm.projects:
+            if project is None or project.id not in user.project_ids:
                 raise InvalidUsageException("Invalid project id")
             return {
                 "id": project.id,
                 "name": project.name,
                 "provider": project.provider,
                 "nb_clusters": len(project.magic_castles),
-                "admin": project.admin_id == user.orm.id,
+                "admin": project.admin_id == user.id,
                 "members": [member.scoped_id for member in project.members]
-                if project.admin_id == user.orm.id
+                if project.admin_id == user.id
                 else [],
             }
         else:
@@ -32,7 +35,7 @@ class ProjectAPI(ApiView):
                     "name": project.name,
                     "provider": project.provider,
                     "nb_clusters": len(project.magic_castles),
-                    "admin": project.admin_id == user.orm.id,
+                    "admin": project.admin_id == user.id,
                 }
                 for project in user.projects
             ]
@@ -60,20 +63,22 @@ class ProjectAPI(ApiView):
         project = Project(name=name, admin_id=user.orm.id, provider=provider, env=env)
         user.orm.projects.append(project)
         db.session.add(project)
+        increment_membership_revision(user.scoped_id)
         db.session.commit()
+        get_user_cache().invalidate(user.scoped_id)
         return {
             "id": project.id,
             "name": project.name,
             "provider": project.provider,
             "nb_clusters": len(project.magic_castles),
-            "admin": project.admin_id == user.orm.id,
+            "admin": project.admin_id == user.id,
         }, 200
 
     def patch(self, user: User, id: int):
         project = db.session.get(Project, id)
-        if project is None or project not in user.orm.projects:
+        if project is None or project.id not in user.project_ids:
             raise InvalidUsageException("Invalid project id")
-        if project.admin_id != user.orm.id:
+        if project.admin_id != user.id:
             raise InvalidUsageException(
                 "Cannot edit project membership that you are not the admin of"
             )
@@ -85,6 +90,7 @@ class ProjectAPI(ApiView):
         del_members = data.get("del", [])
 
         default_domain = user.domain
+        changed_members = []
 
         for username in add_members:
             if "@" not in username:
@@ -96,6 +102,7 @@ class ProjectAPI(ApiView):
                 member = UserORM(scoped_id=username)
                 db.session.add(member)
             member.projects.append(project)
+            changed_members.append(username)
 
         for username in del_members:
             if "@" not in username:
@@ -103,23 +110,31 @@ class ProjectAPI(ApiView):
             member = db.session.execute(
                 db.select(UserORM).filter_by(scoped_id=username)
             ).scalar_one_or_none()
-            if member and member.id != user.orm.id:
+            if member and member.id != user.id:
                 member.projects.remove(project)
+                changed_members.append(username)
 
+        increment_membership_revision(*changed_members)
         db.session.commit()
+        get_user_cache().invalidate(*changed_members)
         return {}, 200
 
     def delete(self, user: User, id: int):
         project = db.session.get(Project, id)
-        if project is None or project not in user.orm.projects:
+        if project is None or project.id not in user.project_ids:
             raise InvalidUsageException("Invalid project id")
-        if project.admin_id != user.orm.id:
+        if project.admin_id != user.id:
             raise InvalidUsageException(
                 "Cannot remove project that you are not the admin of"
             )
         if len(project.magic_castles) > 0:
             raise InvalidUsageException("Cannot remove project with running clusters")
+        members = [member.scoped_id for member in project.members]
         user.orm.projects.remove(project)
         db.session.delete(project)
+        increment_membership_revision(*members)
         db.session.commit()
+        get_user_cache().invalidate(*members)
+        get_cloud_resource_cache().invalidate(id)
+        get_connection_pool().evict(id)
         return {}, 200
@@ -1,10 +1,9 @@
 import argparse
 
-from os import path
-
 from . import create_app
 from .database import db
 from .database.cleanup_manager import CleanupManager
+from .database.schema_manager import SchemaManager
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -15,8 +14,14 @@ if __name__ == "__main__":
 
     app = create_app()
     with app.app_context():
-        if not path.exists(db.engine.url.database):
+        if not db.inspect(db.engine).get_table_names():
             print("Database does not exist. Creating...")
             db.create_all()
-        elif arguments.clean:
-            CleanupManager.clean_status()
+            SchemaManager.stamp()
+        else:
+            # Creates the tables added since the database was created
+            db.create_all()
+            SchemaManager.update()
+            SchemaManager.analyze()
+            if arguments.clean:
+                CleanupManager.clean_status()
@@ -0,0 +1,25 @@
+import logging
+import time
+
+from .. import create_app
+from ..configuration.env import PROBER_INTERVAL
+from ..models.puppet.provisioning_prober import ProvisioningProber
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main(interval=PROBER_INTERVAL):
+    app = create_app()
+    prober = ProvisioningProber()
+    logging.info("Probing the clusters being provisioned")
+    while True:
+        with app.app_context():
+            try:
+                prober.probe()
+            except Exception as e:
+                logging.error(f"Could not probe the clusters - {e}")
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    main()
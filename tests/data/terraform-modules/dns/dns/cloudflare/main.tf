@@ -0,0 +1,13 @@
+module "record_generator" {
+  source         = "../record_generator"
+  name           = lower(var.name)
+  public_instances = var.public_instances
+}
+
+resource "cloudflare_record" "records" {
+  count   = length(module.record_generator.records)
+  zone_id = data.cloudflare_zone.domain.id
+  name    = module.record_generator.records[count.index].name
+  value   = module.record_generator.records[count.index].value
+  type    = module.record_generator.records[count.index].type
+}
@@ -0,0 +1,9 @@
+locals {
+  records = [
+    for key, values in var.public_instances : {
+      type  = "A"
+      name  = join(".", [key, var.name])
+      value = values["public_ip"]
+    }
+  ]
+}
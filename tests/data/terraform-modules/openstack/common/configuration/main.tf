@@ -0,0 +1,14 @@
+resource "tls_private_key" "ssh" {
+  algorithm = "ED25519"
+}
+
+resource "random_string" "puppetserver_password" {
+  length  = 32
+  special = false
+}
+
+locals {
+  terraform_data = yamlencode({
+    instances = var.inventory
+  })
+}
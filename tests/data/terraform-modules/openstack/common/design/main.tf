@@ -0,0 +1,11 @@
+locals {
+  instances = merge(
+    flatten([
+      for prefix, attrs in var.instances : [
+        for i in range(lookup(attrs, "count", 1)) : {
+          (format("%s%d", prefix, i + 1)) = merge({ prefix = prefix }, attrs)
+        }
+      ]
+    ])...
+  )
+}
@@ -0,0 +1,9 @@
+resource "terraform_data" "deploy_hieradata" {
+  for_each = length(var.bastions) > 0 ? var.puppetservers : {}
+
+  triggers_replace = {
+    hieradata      = md5(var.terraform_data)
+    facts          = md5(var.terraform_facts)
+    user_hieradata = md5(var.hieradata)
+  }
+}
@@ -0,0 +1,49 @@
+module "design" {
+  source       = "../common/design"
+  cluster_name = var.cluster_name
+  domain       = var.domain
+  instances    = var.instances
+  volumes      = var.volumes
+}
+
+module "configuration" {
+  source          = "../common/configuration"
+  inventory       = local.inventory
+  config_git_url  = var.config_git_url
+  config_version  = var.config_version
+  cloud_provider  = local.cloud_provider
+  cloud_region    = local.cloud_region
+  domain_name     = module.design.domain_name
+  cluster_name    = var.cluster_name
+}
+
+module "provision" {
+  source          = "../common/provision"
+  bastions        = local.public_instances
+  puppetservers   = module.configuration.puppetservers
+  tf_ssh_key      = module.configuration.ssh_key
+  terraform_data  = module.configuration.terraform_data
+  terraform_facts = module.configuration.terraform_facts
+  hieradata       = var.hieradata
+}
+
+resource "openstack_compute_secgroup_v2" "secgroup" {
+  name        = "${var.cluster_name}-secgroup"
+  description = "${var.cluster_name} security group"
+}
+
+resource "openstack_compute_instance_v2" "instances" {
+  for_each = module.design.instances_to_build
+  name     = format("%s-%s", var.cluster_name, each.key)
+}
+
+resource "openstack_blockstorage_volume_v3" "volumes" {
+  for_each = module.design.volumes
+  name     = "${var.cluster_name}-${each.key}"
+}
+
+resource "openstack_compute_volume_attach_v2" "attachments" {
+  for_each    = module.design.volumes
+  instance_id = openstack_compute_instance_v2.instances[each.value.instance].id
+  volume_id   = openstack_blockstorage_volume_v3.volumes[each.key].id
+}
@@ -0,0 +1,16 @@
+resource "openstack_networking_port_v2" "nic" {
+  for_each   = module.design.instances
+  name       = format("%s-%s-port", var.cluster_name, each.key)
+  network_id = local.network.id
+}
+
+resource "openstack_networking_floatingip_v2" "fip" {
+  for_each = toset([for x, values in module.design.instances : x if contains(values.tags, "public")])
+  pool     = var.os_ext_network
+}
+
+resource "openstack_networking_floatingip_associate_v2" "fip" {
+  for_each    = openstack_networking_floatingip_v2.fip
+  floating_ip = each.value.address
+  port_id     = openstack_networking_port_v2.nic[each.key].id
+}
@@ -142,6 +142,13 @@ def test_delete_invalid_status(client):
     assert res.status_code != 200
 
 
+def test_delete_without_resources(client):
+    res = client.delete(f"/api/magic-castles/created.magic-castle.cloud")
+    assert res.get_json() == {"job_id": None, "plan": "deleted"}
+    res = client.get(f"/api/magic-castles/created.magic-castle.cloud")
+    assert res.status_code != 200
+
+
 # PUT /api/magic-castles/<hostname>
 def test_modify_invalid_status(client):
     from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
@@ -1,3 +1,4 @@
+import json
 import pytest
 
 from freezegun import freeze_time
@@ -8,6 +9,7 @@ from ..test_helpers import (
     app,
     generate_test_clusters,
     mock_clusters_path,
+    mock_openstack_manager,
 )  # noqa;
 from ..mocks.configuration.config_mock import (
     config_auth_saml_mock as config_mock,
@@ -66,6 +68,123 @@ def test_get_all_magic_castle_names(client):
     assert res.status_code == 200
 
 
+# GET /api/magic_castle?status=...&expires_before=...
+def test_get_magic_castles_filtered(app, client):
+    import datetime
+    from mchub.database import db
+    from mchub.models.magic_castle.magic_castle import MagicCastleORM
+
+    orm = db.session.scalar(
+        db.select(MagicCastleORM).filter_by(hostname="created.magic-castle.cloud")
+    )
+    orm.expiration_date = datetime.date(2028, 6, 1)
+    db.session.commit()
+
+    def get_hostnames(query):
+        res = client.get(f"/api/magic-castles?{query}", headers=ALICE_HEADERS)
+        assert res.status_code == 200
+        return sorted(result["hostname"] for result in res.get_json())
+
+    assert get_hostnames("status=created") == ["created.magic-castle.cloud"]
+    assert get_hostnames("status=created,plan_running") == [
+        "buildplanning.magic-castle.cloud",
+        "created.magic-castle.cloud",
+    ]
+    assert get_hostnames("status=created&status=provisioning_success") == [
+        "created.magic-castle.cloud",
+        "valid1.magic-castle.cloud",
+    ]
+    assert get_hostnames("expires_before=2029-01-01") == ["created.magic-castle.cloud"]
+    assert get_hostnames("expires_before=2029-01-01&status=plan_running") == []
+
+    res = client.get(f"/api/magic-castles?status=unknown", headers=ALICE_HEADERS)
+    assert res.status_code == 400
+    res = client.get(f"/api/magic-castles?expires_before=soon", headers=ALICE_HEADERS)
+    assert res.status_code == 400
+
+
+def test_current_user_cached(client, mocker):
+    from mchub.resources import api_view
+
+    load_user_identity = mocker.spy(api_view, "load_user_identity")
+    for _ in range(3):
+        res = client.get(f"/api/magic-castles", headers=ALICE_HEADERS)
+        assert res.status_code == 200
+    assert load_user_identity.call_count == 1
+
+
+# PATCH /api/projects/<id>
+def test_project_membership_invalidates_user_cache(client):
+    from mchub.database import db
+    from mchub.models.cloud.project import Project
+
+    project_id = db.session.scalar(
+        db.select(Project.id).filter_by(name="project-alice")
+    )
+
+    def get_hostnames(headers):
+        res = client.get(f"/api/magic-castles", headers=headers)
+        assert res.status_code == 200
+        return sorted(result["hostname"] for result in res.get_json())
+
+    alice_hostnames = get_hostnames(ALICE_HEADERS)
+    bob_hostnames = get_hostnames(BOB_HEADERS)
+    assert not set(alice_hostnames) & set(bob_hostnames)
+    res = client.get(f"/api/projects/{project_id}", headers=BOB_HEADERS)
+    assert res.status_code != 200
+
+    # The cached projects of Bob are replaced as soon as he is added
+    res = client.patch(
+        f"/api/projects/{project_id}",
+        json={"add": [BOB_HEADERS["eduPersonPrincipalName"]]},
+        headers=ALICE_HEADERS,
+    )
+    assert res.status_code == 200
+    assert get_hostnames(BOB_HEADERS) == sorted(alice_hostnames + bob_hostnames)
+    res = client.get(f"/api/projects/{project_id}", headers=BOB_HEADERS)
+    assert res.get_json()["admin"] is False
+
+    res = client.patch(
+        f"/api/projects/{project_id}",
+        json={"del": ["bob12.bobby"]},
+        headers=ALICE_HEADERS,
+    )
+    assert res.status_code == 200
+    assert get_hostnames(BOB_HEADERS) == bob_hostnames
+    res = client.get(f"/api/projects/{project_id}", headers=BOB_HEADERS)
+    assert res.status_code != 200
+
+
+def test_project_membership_changed_by_another_process(client):
+    from mchub.database import db
+    from mchub.models.cloud.project import Project
+    from mchub.models.user import UserORM, increment_membership_revision
+
+    project_id = db.session.scalar(
+        db.select(Project.id).filter_by(name="project-alice")
+    )
+    res = client.get(f"/api/projects/{project_id}", headers=BOB_HEADERS)
+    assert res.status_code != 200
+
+    # Another process adds Bob to the project, without access to this process' cache
+    bob_id = BOB_HEADERS["eduPersonPrincipalName"]
+    bob = db.session.scalar(db.select(UserORM).filter_by(scoped_id=bob_id))
+    bob.projects.append(db.session.get(Project, project_id))
+    increment_membership_revision(bob_id)
+    db.session.commit()
+
+    res = client.get(f"/api/projects/{project_id}", headers=BOB_HEADERS)
+    assert res.status_code == 200
+
+    # And removes him
+    bob.projects.remove(db.session.get(Project, project_id))
+    increment_membership_revision(bob_id)
+    db.session.commit()
+
+    res = client.get(f"/api/projects/{project_id}", headers=BOB_HEADERS)
+    assert res.status_code != 200
+
+
 def test_query_magic_castles_local(client):
     # No authentication header at all
     res = client.get(f"/api/magic-castles")
@@ -90,6 +209,45 @@ def test_get_state_existing(client):
     assert res.status_code == 200
 
 
+def test_get_state_not_modified(client):
+    from mchub.database import db
+    from mchub.models.magic_castle.magic_castle import MagicCastleORM
+
+    url = f"/api/magic-castles/{EXISTING_HOSTNAME}"
+    res = client.get(url, headers=ALICE_HEADERS)
+    etag = res.headers["ETag"]
+    res = client.get(url, headers={**ALICE_HEADERS, "If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.get_data() == b""
+    assert res.headers["ETag"] == etag
+
+    # Every write of the cluster changes its revision
+    orm = db.session.scalar(
+        db.select(MagicCastleORM).filter_by(hostname=EXISTING_HOSTNAME)
+    )
+    revision = orm.revision
+    orm.status = ClusterStatusCode.BUILD_ERROR
+    db.session.commit()
+    assert orm.revision == revision + 1
+    res = client.get(url, headers={**ALICE_HEADERS, "If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.get_json()["status"] == "build_error"
+    assert res.headers["ETag"] != etag
+    etag = res.headers["ETag"]
+
+    # The state includes the name of the project
+    orm.project.name = "renamed-project"
+    db.session.commit()
+    res = client.get(url, headers={**ALICE_HEADERS, "If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.get_json()["cloud"]["name"] == "renamed-project"
+    assert res.headers["ETag"] != etag
+
+    # Another user is not told whether the cluster changed
+    res = client.get(url, headers={**BOB_HEADERS, "If-None-Match": etag})
+    assert res.status_code != 304
+
+
 def test_get_state_non_existing(client):
     res = client.get(
         f"/api/magic-castles/{NON_EXISTING_HOSTNAME}", headers=ALICE_HEADERS
@@ -114,6 +272,100 @@ def test_get_status(mocker, client):
     assert res.get_json() == PROGRESS_DATA
 
 
+def test_get_status_plan_error(client):
+    from mchub.database import db
+    from mchub.models.magic_castle.magic_castle import MagicCastle, MagicCastleORM
+
+    orm = db.session.scalar(
+        db.select(MagicCastleORM).filter_by(hostname="missingfloatingips.mc.ca")
+    )
+    MagicCastle(orm).set_plan_error("An error occurred while planning changes.", "")
+    res = client.get(
+        f"/api/magic-castles/missingfloatingips.mc.ca/status", headers=BOB_HEADERS
+    )
+    assert res.get_json()["status"] == "plan_error"
+    assert res.get_json()["error"] == {
+        "message": "An error occurred while planning changes."
+    }
+
+
+def test_get_status_not_modified(client):
+    from os import path
+    from ..test_helpers import MOCK_CLUSTERS_PATH
+
+    url = f"/api/magic-castles/missingfloatingips.mc.ca/status"
+    res = client.get(url, headers=BOB_HEADERS)
+    etag = res.headers["ETag"]
+    res = client.get(url, headers={**BOB_HEADERS, "If-None-Match": etag})
+    assert res.status_code == 304
+
+    # The progress changes with the terraform apply log
+    log_path = path.join(
+        MOCK_CLUSTERS_PATH, "missingfloatingips.mc.ca", "terraform_apply.log"
+    )
+    with open(log_path, "a") as log:
+        log.write("\n")
+    res = client.get(url, headers={**BOB_HEADERS, "If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.get_json() == PROGRESS_DATA
+
+
+# GET /api/available-resources/cloud/<id>
+def test_get_available_resources_not_modified(client):
+    url = f"/api/available-resources/cloud/1"
+    # The first response fetches the resources, the next ones are cached
+    res = client.get(url, headers=ALICE_HEADERS)
+    assert "ETag" not in res.headers
+    resources = res.get_json()
+    res = client.get(url, headers=ALICE_HEADERS)
+    etag = res.headers["ETag"]
+    assert res.get_json() == resources
+    res = client.get(url, headers={**ALICE_HEADERS, "If-None-Match": etag})
+    assert res.status_code == 304
+
+    # The quotas are invalidated when a cluster changes
+    from mchub.models.cloud.resource_cache import get_cloud_resource_cache
+
+    get_cloud_resource_cache().invalidate_quotas(1)
+    res = client.get(url, headers={**ALICE_HEADERS, "If-None-Match": etag})
+    assert res.status_code == 200
+    res = client.get(url, headers={**ALICE_HEADERS, "If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag
+
+
+def test_get_status_stream(client):
+    from mchub.models.magic_castle.progress_watcher import ProgressWatcher
+
+    res = client.get(
+        f"/api/magic-castles/missingfloatingips.mc.ca/status",
+        headers={**BOB_HEADERS, "Accept": "text/event-stream"},
+        buffered=False,
+    )
+    assert res.mimetype == "text/event-stream"
+    event = next(iter(res.response)).decode()
+    res.close()
+    assert event.startswith("event: snapshot\ndata: ")
+    assert json.loads(event[len("event: snapshot\ndata: ") :]) == PROGRESS_DATA
+
+    # The watcher stops once its only subscriber has left
+    watcher = ProgressWatcher._watchers.get("missingfloatingips.mc.ca")
+    if watcher is not None:
+        watcher._thread.join(timeout=5)
+    assert "missingfloatingips.mc.ca" not in ProgressWatcher._watchers
+
+
+def test_get_status_stream_not_owned(client):
+    res = client.get(
+        f"/api/magic-castles/missingfloatingips.mc.ca/status",
+        headers={**ALICE_HEADERS, "Accept": "text/event-stream"},
+    )
+    assert res.mimetype == "text/event-stream"
+    assert res.get_data(as_text=True) == (
+        'event: snapshot\ndata: {"status": "not_found"}\n\n'
+    )
+
+
 def test_get_status_code(client):
     from mchub.models.magic_castle.magic_castle import MagicCastleORM
     from mchub.database import db
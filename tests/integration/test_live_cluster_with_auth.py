@@ -59,6 +59,19 @@ def setup_module(module):
         db.create_all()
 
 
+def wait_for_plan(client, max_timeout_seconds=300):
+    start_time = time()
+    status = client.get(
+        f"/api/magic-castles/{HOSTNAME}/status", headers=JOHN_DOE_HEADERS
+    ).get_json()["status"]
+    while status == "plan_running" and time() - start_time <= max_timeout_seconds:
+        sleep(1)
+        status = client.get(
+            f"/api/magic-castles/{HOSTNAME}/status", headers=JOHN_DOE_HEADERS
+        ).get_json()["status"]
+    return status
+
+
 def teardown_module(module):
     global db_filename
     remove(db_filename)
@@ -132,21 +145,22 @@ def test_plan_creation(client):
         },
         headers=JOHN_DOE_HEADERS,
     )
-    assert res.get_json() == {}
+    assert "job_id" in res.get_json()
     assert res.status_code == 200
 
 
 @pytest.mark.build_live_cluster
 def test_apply_creation_plan(client):
+    assert wait_for_plan(client) != "plan_error"
     res = client.post(f"/api/magic-castles/{HOSTNAME}/apply", headers=JOHN_DOE_HEADERS)
-    assert res.get_json() == {}
+    assert "job_id" in res.get_json()
     assert res.status_code == 200
 
 
 @pytest.mark.build_live_cluster
 def test_creation_running(client):
     res = client.get(f"/api/magic-castles/{HOSTNAME}/status", headers=JOHN_DOE_HEADERS)
-    assert res.get_json()["status"] == "build_running"
+    assert res.get_json()["status"] in ("build_queued", "build_running")
     assert res.status_code == 200
 
 
@@ -157,7 +171,10 @@ def test_create_success(client):
     status = client.get(
         f"/api/magic-castles/{HOSTNAME}/status", headers=JOHN_DOE_HEADERS
     ).get_json()["status"]
-    while status == "build_running" and time() - start_time <= max_timeout_seconds:
+    while (
+        status in ("build_queued", "build_running")
+        and time() - start_time <= max_timeout_seconds
+    ):
         status = client.get(
             f"/api/magic-castles/{HOSTNAME}/status", headers=JOHN_DOE_HEADERS
         ).get_json()["status"]
@@ -234,14 +251,15 @@ def test_plan_modify(client):
         },
         headers=JOHN_DOE_HEADERS,
     )
-    assert res.get_json() == {}
+    assert "job_id" in res.get_json()
     assert res.status_code == 200
 
 
 @pytest.mark.build_live_cluster
 def test_apply_modification_plan(client):
+    assert wait_for_plan(client) != "plan_error"
     res = client.post(f"/api/magic-castles/{HOSTNAME}/apply", headers=JOHN_DOE_HEADERS)
-    assert res.get_json() == {}
+    assert "job_id" in res.get_json()
     assert res.status_code == 200
 
 
@@ -252,7 +270,10 @@ def test_modify_success(client):
     status = client.get(
         f"/api/magic-castles/{HOSTNAME}/status", headers=JOHN_DOE_HEADERS
     ).get_json()["status"]
-    while status == "build_running" and time() - start_time <= max_timeout_seconds:
+    while (
+        status in ("build_queued", "build_running")
+        and time() - start_time <= max_timeout_seconds
+    ):
         status = client.get(
             f"/api/magic-castles/{HOSTNAME}/status", headers=JOHN_DOE_HEADERS
         ).get_json()["status"]
@@ -292,14 +313,15 @@ def test_modify_success(client):
 @pytest.mark.build_live_cluster
 def test_plan_destroy(client):
     res = client.delete(f"/api/magic-castles/{HOSTNAME}", headers=JOHN_DOE_HEADERS)
-    assert res.get_json() == {}
+    assert "job_id" in res.get_json()
     assert res.status_code == 200
 
 
 @pytest.mark.build_live_cluster
 def test_apply_destruction_plan(client):
+    assert wait_for_plan(client) != "plan_error"
     res = client.post(f"/api/magic-castles/{HOSTNAME}/apply", headers=JOHN_DOE_HEADERS)
-    assert res.get_json() == {}
+    assert "job_id" in res.get_json()
     assert res.status_code == 200
 
 
@@ -310,7 +332,10 @@ def test_destroy_success(client):
     status = client.get(
         f"/api/magic-castles/{HOSTNAME}/status", headers=JOHN_DOE_HEADERS
     ).get_json()["status"]
-    while status == "destroy_running" and time() - start_time <= max_timeout_seconds:
+    while (
+        status in ("destroy_queued", "destroy_running")
+        and time() - start_time <= max_timeout_seconds
+    ):
         status = client.get(
             f"/api/magic-castles/{HOSTNAME}/status", headers=JOHN_DOE_HEADERS
         ).get_json()["status"]
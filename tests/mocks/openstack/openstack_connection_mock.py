@@ -116,3 +116,6 @@ class OpenStackConnectionMock:
         self.image = self.ImageApi()
         self.block_storage = self.BlockStorageApi()
         self.current_project_id = "MOCK_PROJECT_ID_f6b8437ac74893"
+
+    def close(self):
+        pass
@@ -0,0 +1,71 @@
+from unittest.mock import Mock
+
+from mchub.models.cloud.connection_pool import OpenStackConnectionPool
+
+ENV = {
+    "OS_AUTH_URL": "https://example.com",
+    "OS_APPLICATION_CREDENTIAL_ID": "id",
+    "OS_APPLICATION_CREDENTIAL_SECRET": "secret",
+}
+
+
+def test_get_reuses_connection(mocker):
+    connect = mocker.patch("openstack.connect", side_effect=lambda **kargs: Mock())
+    pool = OpenStackConnectionPool()
+    project = Mock(id=1, env=ENV)
+    connection = pool.get(project)
+    assert pool.get(project) is connection
+    connect.assert_called_once_with(
+        auth_url="https://example.com",
+        application_credential_id="id",
+        application_credential_secret="secret",
+        auth_type="v3applicationcredential",
+    )
+
+
+def test_get_updated_credentials(mocker):
+    mocker.patch("openstack.connect", side_effect=lambda **kargs: Mock())
+    pool = OpenStackConnectionPool()
+    connection = pool.get(Mock(id=1, env=ENV))
+    updated = pool.get(
+        Mock(id=1, env={**ENV, "OS_APPLICATION_CREDENTIAL_SECRET": "new secret"})
+    )
+    assert updated is not connection
+    # The connection may still be used by a request of the project
+    connection.close.assert_not_called()
+
+
+def test_evict(mocker):
+    mocker.patch("openstack.connect", side_effect=lambda **kargs: Mock())
+    pool = OpenStackConnectionPool()
+    project = Mock(id=1, env=ENV)
+    connection = pool.get(project)
+    pool.evict(1)
+    connection.close.assert_not_called()
+    assert pool.get(project) is not connection
+
+
+def test_evict_shared_connection(mocker):
+    mocker.patch("openstack.connect", side_effect=lambda **kargs: Mock())
+    pool = OpenStackConnectionPool()
+    connection = pool.get(Mock(id=1, env=ENV))
+    assert pool.get(Mock(id=2, env=ENV)) is connection
+
+    # The other project with the same credentials keeps the connection
+    pool.evict(1)
+    assert pool.get(Mock(id=2, env=ENV)) is connection
+    pool.get(Mock(id=2, env={**ENV, "OS_APPLICATION_CREDENTIAL_SECRET": "new"}))
+    assert pool.get(Mock(id=1, env=ENV)) is not connection
+    connection.close.assert_not_called()
+
+
+def test_idle_connection_closed(mocker):
+    mocker.patch("openstack.connect", side_effect=lambda **kargs: Mock())
+    monotonic = mocker.patch(
+        "mchub.models.cloud.connection_pool.monotonic", return_value=0
+    )
+    pool = OpenStackConnectionPool(idle_ttl=60)
+    idle = pool.get(Mock(id=1, env=ENV))
+    monotonic.return_value = 61
+    pool.get(Mock(id=2, env={**ENV, "OS_APPLICATION_CREDENTIAL_ID": "other"}))
+    idle.close.assert_called_once()
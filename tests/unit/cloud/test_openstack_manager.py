@@ -0,0 +1,61 @@
+from threading import Event
+from unittest.mock import Mock
+
+import pytest
+
+from mchub.models.cloud.connection_pool import get_connection_pool
+from mchub.models.cloud.openstack_manager import OpenStackManager
+from mchub.models.cloud.resource_cache import get_cloud_resource_cache
+
+from ...mocks.openstack.openstack_connection_mock import OpenStackConnectionMock
+
+
+@pytest.fixture
+def project():
+    get_cloud_resource_cache().clear()
+    get_connection_pool().clear()
+    yield Mock(id=1, env={"OS_AUTH_URL": "https://example.com"})
+    get_cloud_resource_cache().clear()
+    get_connection_pool().clear()
+
+
+def test_available_resources(mocker, project):
+    mocker.patch("openstack.connect", return_value=OpenStackConnectionMock())
+    resources = OpenStackManager(project).available_resources
+    assert resources["degraded"] == []
+    assert set(resources["quotas"]) == {
+        "instance_count",
+        "ram",
+        "vcpus",
+        "volume_count",
+        "volume_size",
+        "ips",
+    }
+    assert resources["possible_resources"]["types"] != []
+    assert resources["resource_details"]["instance_types"] != []
+
+
+def test_available_resources_service_down(mocker, project):
+    connection = OpenStackConnectionMock()
+    connection.network = Mock(get=Mock(side_effect=ConnectionError("neutron is down")))
+    mocker.patch("openstack.connect", return_value=connection)
+    resources = OpenStackManager(project).available_resources
+    assert resources["degraded"] == ["quotas"]
+    assert "ips" not in resources["quotas"]
+    assert "ram" in resources["quotas"]
+
+
+def test_available_resources_service_timeout(mocker, project):
+    release = Event()
+    connection = OpenStackConnectionMock()
+    images = connection.image.images
+    connection.image = Mock(images=lambda: release.wait() and images())
+    mocker.patch("openstack.connect", return_value=connection)
+    mocker.patch("mchub.models.cloud.openstack_manager.OPENSTACK_API_TIMEOUT", 0.1)
+    try:
+        resources = OpenStackManager(project).available_resources
+    finally:
+        release.set()
+    assert resources["degraded"] == ["possible_resources"]
+    assert resources["possible_resources"]["image"] == []
+    assert resources["possible_resources"]["types"] != []
@@ -0,0 +1,109 @@
+from unittest.mock import Mock
+
+from mchub.models.cloud.resource_cache import CloudResource, CloudResourceCache, QUOTAS
+
+TTLS = {resource: 60 for resource in CloudResource}
+
+
+def test_get_cached_value():
+    cache = CloudResourceCache(TTLS)
+    loader = Mock(return_value=["p2-3gb"])
+    assert cache.get(1, CloudResource.FLAVORS, loader) == ["p2-3gb"]
+    assert cache.get(1, CloudResource.FLAVORS, loader) == ["p2-3gb"]
+    assert loader.call_count == 1
+
+    # Entries are kept per project
+    cache.get(2, CloudResource.FLAVORS, loader)
+    assert loader.call_count == 2
+
+
+def test_get_expired_value(mocker):
+    cache = CloudResourceCache(TTLS)
+    loader = Mock(return_value={})
+    monotonic = mocker.patch(
+        "mchub.models.cloud.resource_cache.monotonic", return_value=100
+    )
+    cache.get(1, CloudResource.COMPUTE_QUOTAS, loader)
+    monotonic.return_value = 159
+    cache.get(1, CloudResource.COMPUTE_QUOTAS, loader)
+    assert loader.call_count == 1
+    monotonic.return_value = 161
+    cache.get(1, CloudResource.COMPUTE_QUOTAS, loader)
+    assert loader.call_count == 2
+
+
+def test_invalidate_quotas():
+    cache = CloudResourceCache(TTLS)
+    loader = Mock(return_value={})
+    for resource in CloudResource:
+        cache.get(1, resource, loader)
+    cache.invalidate_quotas(1)
+    for resource in CloudResource:
+        cache.get(1, resource, loader)
+    assert loader.call_count == len(CloudResource) + 3
+    assert cache.generation(1) == 1
+
+
+def test_invalidate_while_loading():
+    cache = CloudResourceCache(TTLS)
+
+    def loader():
+        cache.invalidate_quotas(1)
+        return {}
+
+    cache.get(1, CloudResource.NETWORK_QUOTAS, loader)
+    reloader = Mock(return_value={})
+    cache.get(1, CloudResource.NETWORK_QUOTAS, reloader)
+    assert reloader.call_count == 1
+
+
+def test_openstack_manager_shares_cache(mocker):
+    from mchub.models.cloud.connection_pool import get_connection_pool
+    from mchub.models.cloud.openstack_manager import OpenStackManager
+    from mchub.models.cloud.resource_cache import get_cloud_resource_cache
+    from ...mocks.openstack.openstack_connection_mock import OpenStackConnectionMock
+
+    get_cloud_resource_cache().clear()
+    get_connection_pool().clear()
+    connect = mocker.patch("openstack.connect", return_value=OpenStackConnectionMock())
+    project = Mock(id=1, env={"OS_AUTH_URL": "https://example.com"})
+    first = OpenStackManager(project).available_resources
+    second = OpenStackManager(project).available_resources
+    assert first == second
+    assert connect.call_count == 1
+    get_cloud_resource_cache().clear()
+
+
+def test_version(mocker):
+    cache = CloudResourceCache(TTLS)
+    loader = Mock(return_value={})
+    monotonic = mocker.patch(
+        "mchub.models.cloud.resource_cache.monotonic", return_value=100
+    )
+    assert cache.version(1) is None
+    for resource in CloudResource:
+        cache.get(1, resource, loader)
+    version = cache.version(1)
+    assert version is not None
+    assert cache.version(1) == version
+
+    # The version changes when an entry is replaced
+    cache.invalidate_quotas(1)
+    assert cache.version(1) is None
+    for resource in QUOTAS:
+        cache.get(1, resource, loader)
+    assert cache.version(1) not in (None, version)
+    version = cache.version(1)
+
+    # and is unknown once an entry expires
+    monotonic.return_value = 161
+    assert cache.version(1) is None
+    assert cache.version(1, [CloudResource.FLAVORS]) is None
+    cache.get(1, CloudResource.COMPUTE_QUOTAS, loader)
+    assert cache.version(1, [CloudResource.COMPUTE_QUOTAS]) not in (None, version)
+
+    # Versions are not reused after the cache is cleared
+    cache.clear()
+    for resource in CloudResource:
+        cache.get(1, resource, loader)
+    assert cache.version(1) != version
@@ -0,0 +1,249 @@
+import pickle
+
+from sqlalchemy import text
+
+from ...test_helpers import (  # noqa
+    app,
+    generate_test_clusters,
+    mock_clusters_path,
+    sqlite_only,
+)
+from ...mocks.configuration.config_mock import (
+    config_auth_none_mock as config_mock,
+)  # noqa;
+
+
+@sqlite_only
+def test_convert_pickled_documents(app):
+    from mchub.database import db
+    from mchub.database.schema_manager import SchemaManager, LATEST_VERSION
+    from mchub.models.magic_castle.magic_castle import MagicCastleORM
+
+    orm = db.session.scalar(
+        db.select(MagicCastleORM).filter_by(hostname="valid1.magic-castle.cloud")
+    )
+    config = dict(orm.config)
+    tf_state = orm.tf_state.to_dict()
+    plan = {"resource_changes": []}
+
+    # Rows written before schema version 1 hold pickled objects
+    db.session.execute(
+        text(
+            "UPDATE magiccastle SET config = :config, tf_state = :tf_state, plan = :plan WHERE id = :id"
+        ),
+        {
+            "config": pickle.dumps(orm.config),
+            "tf_state": pickle.dumps(orm.tf_state),
+            "plan": pickle.dumps(plan),
+            "id": orm.id,
+        },
+    )
+    db.session.commit()
+    assert SchemaManager.get_version() == 0
+
+    SchemaManager.update()
+    assert SchemaManager.get_version() == LATEST_VERSION
+
+    db.session.expire_all()
+    orm = db.session.scalar(
+        db.select(MagicCastleORM).filter_by(hostname="valid1.magic-castle.cloud")
+    )
+    assert dict(orm.config) == config
+    assert orm.config.provider == "openstack"
+    assert orm.tf_state.to_dict() == tf_state
+    # The plan is also summarized by the following migration
+    assert orm.plan == {
+        "summary_version": 1,
+        "types": [],
+        "actions": [],
+        "resources": [],
+    }
+    raw_plan = db.session.execute(
+        text("SELECT plan FROM magiccastle WHERE id = :id"), {"id": orm.id}
+    ).scalar()
+    assert raw_plan == '{"summary_version":1,"types":[],"actions":[],"resources":[]}'
+
+
+def test_summarize_plans(app):
+    from mchub.database import db
+    from mchub.database.schema_manager import SchemaManager
+    from mchub.models.magic_castle.magic_castle import MagicCastleORM
+    from mchub.models.terraform.terraform_plan_parser import TerraformPlanParser
+
+    orm = db.session.scalar(
+        db.select(MagicCastleORM).filter_by(hostname="created.magic-castle.cloud")
+    )
+    resources_changes = TerraformPlanParser.get_resources_changes(orm.plan)
+    assert len(resources_changes) > 0
+    SchemaManager.set_version(1)
+    db.session.commit()
+
+    SchemaManager.update()
+
+    db.session.expire_all()
+    orm = db.session.scalar(
+        db.select(MagicCastleORM).filter_by(hostname="created.magic-castle.cloud")
+    )
+    assert orm.plan["summary_version"] == 1
+    assert TerraformPlanParser.get_resources_changes(orm.plan) == resources_changes
+
+
+@sqlite_only
+def test_convert_expiration_dates(app):
+    from datetime import date
+    from mchub.database import db
+    from mchub.database.schema_manager import SchemaManager
+    from mchub.models.magic_castle.magic_castle import MagicCastleORM
+
+    # Databases before schema version 3 hold strings, without index
+    db.session.execute(text("DROP INDEX ix_magiccastle_expiration_date"))
+    db.session.execute(
+        text("UPDATE magiccastle SET expiration_date = :value WHERE hostname = :hostname"),
+        {"value": "someday", "hostname": "valid1.magic-castle.cloud"},
+    )
+    SchemaManager.set_version(2)
+    db.session.commit()
+
+    SchemaManager.update()
+
+    db.session.expire_all()
+    expiration_dates = dict(
+        db.session.execute(
+            db.select(MagicCastleORM.hostname, MagicCastleORM.expiration_date)
+        ).all()
+    )
+    assert expiration_dates["valid1.magic-castle.cloud"] is None
+    assert expiration_dates["created.magic-castle.cloud"] == date(2029, 1, 1)
+    indexes = db.inspect(db.engine).get_indexes("magiccastle")
+    assert ["expiration_date"] in [index["column_names"] for index in indexes]
+
+
+def test_index_cluster_status(app):
+    from mchub.database import db
+    from mchub.database.schema_manager import SchemaManager
+
+    db.session.execute(text("DROP INDEX ix_magiccastle_status"))
+    db.session.execute(text("DROP INDEX ix_magiccastle_project_id_status"))
+    SchemaManager.set_version(3)
+    db.session.commit()
+
+    SchemaManager.update()
+
+    indexes = db.inspect(db.engine).get_indexes("magiccastle")
+    columns = [index["column_names"] for index in indexes]
+    assert ["status"] in columns
+    assert ["project_id", "status"] in columns
+
+
+def test_add_cluster_revision(app):
+    from mchub.database import db
+    from mchub.database.schema_manager import SchemaManager
+    from mchub.models.magic_castle.magic_castle import MagicCastleORM
+
+    db.session.execute(text("ALTER TABLE magiccastle DROP COLUMN revision"))
+    SchemaManager.set_version(4)
+    db.session.commit()
+
+    SchemaManager.update()
+
+    revisions = db.session.scalars(db.select(MagicCastleORM.revision)).all()
+    assert revisions and set(revisions) == {0}
+
+
+def test_add_apply_job_owner(app):
+    from mchub.database import db
+    from mchub.database.schema_manager import SchemaManager
+
+    db.session.execute(text("ALTER TABLE apply_job DROP COLUMN owner"))
+    db.session.execute(text("ALTER TABLE apply_job DROP COLUMN heartbeat"))
+    SchemaManager.set_version(5)
+    db.session.commit()
+
+    SchemaManager.update()
+
+    columns = db.inspect(db.engine).get_columns("apply_job")
+    assert {"owner", "heartbeat"} <= {column["name"] for column in columns}
+
+
+@sqlite_only
+def test_convert_project_members(app):
+    from mchub.database import db
+    from mchub.database.schema_manager import SchemaManager
+    from mchub.models.user import UserORM, load_user_identity
+
+    user = db.session.scalar(
+        db.select(UserORM).filter_by(scoped_id="alice@computecanada.ca")
+    )
+    project_ids = frozenset(project.id for project in user.projects)
+    assert project_ids
+
+    # The ids of the project members were strings before schema version 7
+    db.session.execute(text("DROP TABLE projects"))
+    db.session.execute(
+        text(
+            "CREATE TABLE projects ("
+            "user_id VARCHAR NOT NULL REFERENCES user (id), "
+            "project_id VARCHAR NOT NULL REFERENCES project (id), "
+            "PRIMARY KEY (user_id, project_id))"
+        )
+    )
+    db.session.execute(
+        text("INSERT INTO projects VALUES (:user_id, :project_id)"),
+        [
+            {"user_id": str(user.id), "project_id": str(project_id)}
+            for project_id in project_ids
+        ],
+    )
+    SchemaManager.set_version(6)
+    db.session.commit()
+
+    SchemaManager.update()
+
+    columns = db.inspect(db.engine).get_columns("projects")
+    assert all(isinstance(column["type"], db.Integer) for column in columns)
+    assert db.session.execute(
+        text("SELECT DISTINCT typeof(user_id) FROM projects")
+    ).scalars().all() == ["integer"]
+    assert load_user_identity("alice@computecanada.ca").project_ids == project_ids
+
+
+def test_add_user_membership_revision(app):
+    from mchub.database import db
+    from mchub.database.schema_manager import SchemaManager
+    from mchub.models.user import load_user_identity
+
+    db.session.execute(text('ALTER TABLE "user" DROP COLUMN membership_revision'))
+    SchemaManager.set_version(7)
+    db.session.commit()
+
+    SchemaManager.update()
+
+    assert load_user_identity("alice@computecanada.ca").membership_revision == 0
+
+
+def test_add_cluster_plan_error(app):
+    from mchub.database import db
+    from mchub.database.schema_manager import SchemaManager
+
+    db.session.execute(text("ALTER TABLE magiccastle DROP COLUMN plan_error"))
+    SchemaManager.set_version(8)
+    db.session.commit()
+
+    SchemaManager.update()
+
+    columns = db.inspect(db.engine).get_columns("magiccastle")
+    assert "plan_error" in {column["name"] for column in columns}
+
+
+def test_add_project_revision(app):
+    from mchub.database import db
+    from mchub.database.schema_manager import SchemaManager
+
+    db.session.execute(text("ALTER TABLE project DROP COLUMN revision"))
+    SchemaManager.set_version(9)
+    db.session.commit()
+
+    SchemaManager.update()
+
+    columns = db.inspect(db.engine).get_columns("project")
+    assert "revision" in {column["name"] for column in columns}
@@ -0,0 +1,230 @@
+import pytest
+
+from ...test_helpers import (
+    app,
+    generate_test_clusters,
+    mock_clusters_path,
+)  # noqa;
+from ...mocks.configuration.config_mock import (
+    config_auth_none_mock as config_mock,
+)  # noqa;
+
+
+def get_orm(hostname):
+    from mchub.models.magic_castle.magic_castle import MagicCastleORM
+    from mchub.database import db
+
+    return db.session.scalar(db.select(MagicCastleORM).filter_by(hostname=hostname))
+
+
+def queue_job(hostname, priority=0, status=None):
+    from mchub.jobs.apply_scheduler import ApplyJobORM, ApplyJobStatus
+    from mchub.database import db
+
+    orm = get_orm(hostname)
+    job = ApplyJobORM(
+        cluster_id=orm.id,
+        project_id=orm.project_id,
+        priority=priority,
+        status=status or ApplyJobStatus.QUEUED,
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def test_apply_queues_job(app, mocker):
+    from mchub.models.magic_castle.magic_castle import MagicCastle
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.jobs.apply_scheduler import (
+        ApplyJobORM,
+        ApplyJobStatus,
+        get_apply_scheduler,
+    )
+    from mchub.database import db
+
+    mocker.patch.object(get_apply_scheduler(), "dispatch")
+    magic_castle = MagicCastle(get_orm("created.magic-castle.cloud"))
+    job_id = magic_castle.apply()
+
+    assert magic_castle.status == ClusterStatusCode.BUILD_QUEUED
+    assert magic_castle.is_busy
+    job = db.session.get(ApplyJobORM, job_id)
+    assert job.cluster_id == magic_castle.orm.id
+    assert job.status == ApplyJobStatus.QUEUED
+    get_apply_scheduler().dispatch.assert_called_once()
+
+
+def test_claim_concurrency_limits(app):
+    from mchub.jobs.apply_scheduler import ApplyScheduler
+
+    scheduler = ApplyScheduler(max_jobs=2, max_jobs_per_project=1)
+    # buildplanning and created are in project 1, the others in project 2
+    first = queue_job("buildplanning.magic-castle.cloud")
+    second = queue_job("created.magic-castle.cloud")
+    third = queue_job("missingnodes.mc.ca")
+    fourth = queue_job("empty-state.magic-castle.cloud")
+
+    assert scheduler.claim() == [first, third]
+    assert scheduler.claim() == []
+
+
+def test_claim_priority(app):
+    from mchub.jobs.apply_scheduler import ApplyScheduler
+
+    scheduler = ApplyScheduler(max_jobs=1, max_jobs_per_project=1)
+    queue_job("buildplanning.magic-castle.cloud", priority=-1)
+    urgent = queue_job("created.magic-castle.cloud")
+
+    assert scheduler.claim() == [urgent]
+
+
+def test_run_starts_next_job(app, mocker):
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.jobs.apply_scheduler import ApplyScheduler, ApplyJobORM
+    from mchub.database import db
+
+    terraform_apply = mocker.patch(
+        "mchub.models.magic_castle.magic_castle.terraform_apply"
+    )
+    scheduler = ApplyScheduler(max_jobs=1, max_jobs_per_project=1)
+    mocker.patch.object(scheduler, "_executor")
+    first = queue_job("created.magic-castle.cloud")
+    second = queue_job("buildplanning.magic-castle.cloud")
+    assert scheduler.claim() == [first]
+
+    scheduler.run(first)
+
+    assert terraform_apply.call_count == 1
+    cluster_id, env, main_path, destroy, resume = terraform_apply.call_args.args
+    assert cluster_id == get_orm("created.magic-castle.cloud").id
+    assert main_path.endswith("created.magic-castle.cloud")
+    assert destroy is False and resume is False
+    assert env["OS_AUTH_URL"] == "http://localhost:5000/v3"
+    assert get_orm("created.magic-castle.cloud").status == (
+        ClusterStatusCode.BUILD_RUNNING
+    )
+    assert db.session.get(ApplyJobORM, first) is None
+    scheduler._executor.submit.assert_called_once_with(scheduler._run, app, second)
+
+
+def test_run_failure_sets_error_status(app, mocker):
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.jobs.apply_scheduler import ApplyScheduler, ApplyJobORM
+    from mchub.database import db
+
+    mocker.patch(
+        "mchub.models.magic_castle.magic_castle.terraform_apply",
+        side_effect=OSError("terraform not found"),
+    )
+    scheduler = ApplyScheduler(max_jobs=1, max_jobs_per_project=1)
+    mocker.patch.object(scheduler, "_executor")
+    job_id = queue_job("created.magic-castle.cloud")
+    assert scheduler.claim() == [job_id]
+
+    scheduler.run(job_id)
+
+    assert get_orm("created.magic-castle.cloud").status == (
+        ClusterStatusCode.BUILD_ERROR
+    )
+    assert db.session.get(ApplyJobORM, job_id) is None
+
+
+def test_clean_status_resumes_jobs(app):
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.jobs.apply_scheduler import ApplyJobORM, ApplyJobStatus
+    from mchub.database.cleanup_manager import CleanupManager
+    from mchub.database import db
+
+    orm = get_orm("created.magic-castle.cloud")
+    orm.status = ClusterStatusCode.BUILD_RUNNING
+    db.session.commit()
+    job_id = queue_job("created.magic-castle.cloud", status=ApplyJobStatus.RUNNING)
+
+    CleanupManager.clean_status()
+
+    job = db.session.get(ApplyJobORM, job_id)
+    assert job.status == ApplyJobStatus.QUEUED
+    assert job.resume
+    assert get_orm("created.magic-castle.cloud").status == (
+        ClusterStatusCode.BUILD_QUEUED
+    )
+    # Interrupted applies without a job can not be resumed
+    assert get_orm("missingfloatingips.mc.ca").status == (
+        ClusterStatusCode.BUILD_ERROR
+    )
+    assert get_orm("buildplanning.magic-castle.cloud").status == (
+        ClusterStatusCode.CREATED
+    )
+
+
+def test_clean_status_keeps_jobs_of_live_processes(app):
+    import datetime
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.jobs.apply_scheduler import (
+        ApplyJobORM,
+        ApplyJobStatus,
+        ApplyScheduler,
+        utcnow,
+    )
+    from mchub.database.cleanup_manager import CleanupManager
+    from mchub.database import db
+
+    # A destruction run by the cleanup service
+    orm = get_orm("valid1.magic-castle.cloud")
+    orm.status = ClusterStatusCode.DESTROY_RUNNING
+    db.session.commit()
+    job_id = queue_job("valid1.magic-castle.cloud", status=ApplyJobStatus.RUNNING)
+    job = db.session.get(ApplyJobORM, job_id)
+    job.owner = "cleanup:1"
+    job.heartbeat = utcnow()
+    db.session.commit()
+
+    CleanupManager.clean_status()
+
+    job = db.session.get(ApplyJobORM, job_id)
+    assert job.status == ApplyJobStatus.RUNNING
+    assert not job.resume
+    assert get_orm("valid1.magic-castle.cloud").status == (
+        ClusterStatusCode.DESTROY_RUNNING
+    )
+
+    # Once the cleanup service stops, the destruction is resumed
+    scheduler = ApplyScheduler(max_jobs=1, max_jobs_per_project=1)
+    job.heartbeat = utcnow() - datetime.timedelta(
+        seconds=scheduler.heartbeat_timeout + 1
+    )
+    db.session.commit()
+    assert scheduler.requeue_stale_jobs() == 1
+    db.session.commit()
+    job = db.session.get(ApplyJobORM, job_id)
+    assert job.status == ApplyJobStatus.QUEUED
+    assert job.resume
+    assert job.owner is None
+    assert get_orm("valid1.magic-castle.cloud").status == (
+        ClusterStatusCode.DESTROY_QUEUED
+    )
+
+
+def test_beat(app, mocker):
+    from mchub.jobs.apply_scheduler import ApplyScheduler, ApplyJobORM
+    from mchub.database import db
+
+    scheduler = ApplyScheduler(max_jobs=1, max_jobs_per_project=1)
+    mocker.patch.object(scheduler, "_executor")
+    mocker.patch.object(scheduler, "_start_heartbeat")
+    job_id = queue_job("created.magic-castle.cloud")
+    scheduler.dispatch()
+    job = db.session.get(ApplyJobORM, job_id)
+    assert job.owner == scheduler.owner
+    heartbeat = job.heartbeat
+    assert heartbeat is not None
+
+    mocker.patch(
+        "mchub.jobs.apply_scheduler.utcnow",
+        return_value=heartbeat + __import__("datetime").timedelta(seconds=30),
+    )
+    scheduler.beat()
+    db.session.expire_all()
+    assert db.session.get(ApplyJobORM, job_id).heartbeat > heartbeat
+    assert scheduler.requeue_stale_jobs() == 0
@@ -0,0 +1,154 @@
+from datetime import date, datetime
+from unittest.mock import Mock
+
+from ...test_helpers import app, generate_test_clusters, mock_clusters_path  # noqa;
+from ...mocks.configuration.config_mock import (
+    config_auth_none_mock as config_mock,
+)  # noqa;
+
+EXPIRED = ["valid1.magic-castle.cloud", "created.magic-castle.cloud"]
+
+
+def set_expiration_dates():
+    from mchub.models.magic_castle.magic_castle import MagicCastleORM
+    from mchub.database import db
+
+    for orm in db.session.scalars(db.select(MagicCastleORM)):
+        orm.expiration_date = (
+            date(2029, 1, 1) if orm.hostname in EXPIRED else date(2030, 1, 1)
+        )
+    # A busy cluster is destroyed once it is not
+    buildplanning = db.session.scalar(
+        db.select(MagicCastleORM).filter_by(hostname="buildplanning.magic-castle.cloud")
+    )
+    buildplanning.expiration_date = date(2028, 1, 1)
+    db.session.commit()
+
+
+def fake_run(process_args, *args, **kwargs):
+    for arg in process_args:
+        if arg.startswith("-out="):
+            with open(arg[len("-out=") :], "w") as plan_file:
+                plan_file.write("plan")
+    mock = Mock()
+    mock.stdout = "{}"
+    return mock
+
+
+def test_cull(app, mocker):
+    from mchub.models.magic_castle.magic_castle import MagicCastleORM
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.models.magic_castle.plan_type import PlanType
+    from mchub.models.magic_castle.expired_cluster_culler import (
+        ExpiredClusterCuller,
+        CULLER_APPLY_PRIORITY,
+    )
+    from mchub.database import db
+
+    mocker.patch("mchub.models.magic_castle.magic_castle.run", side_effect=fake_run)
+    scheduler = mocker.patch(
+        "mchub.models.magic_castle.magic_castle.get_apply_scheduler"
+    ).return_value
+    set_expiration_dates()
+
+    culler = ExpiredClusterCuller(max_clusters=4)
+    assert culler.cull(today=date(2028, 12, 31)) == []
+    assert sorted(culler.cull(today=date(2029, 1, 1))) == sorted(EXPIRED)
+
+    # The cluster without terraform state is deleted right away
+    hostnames = db.session.scalars(db.select(MagicCastleORM.hostname)).all()
+    assert "created.magic-castle.cloud" not in hostnames
+    # The destruction of the other one is queued with a low priority
+    orm = db.session.scalar(
+        db.select(MagicCastleORM).filter_by(hostname="valid1.magic-castle.cloud")
+    )
+    assert orm.plan_type == PlanType.DESTROY
+    assert orm.status == ClusterStatusCode.DESTROY_QUEUED
+    assert scheduler.enqueue.call_args.args == (orm.id, orm.project_id)
+    assert scheduler.enqueue.call_args.kwargs == {"priority": CULLER_APPLY_PRIORITY}
+
+    # A cluster being destroyed is not culled twice
+    assert culler.cull(today=date(2029, 1, 1)) == []
+
+
+def test_cull_backoff(app, mocker):
+    from mchub.models.magic_castle.expired_cluster_culler import ExpiredClusterCuller
+
+    plan_destruction = mocker.patch(
+        "mchub.models.magic_castle.magic_castle.MagicCastle.plan_destruction",
+        side_effect=OSError("terraform"),
+    )
+    set_expiration_dates()
+
+    culler = ExpiredClusterCuller(max_clusters=1, min_backoff=60)
+    assert culler.cull(today=date(2029, 1, 1)) == []
+    assert plan_destruction.call_count == 1
+    assert culler.remaining
+    # The failed clusters are tried again after their delay
+    assert culler.cull(today=date(2029, 1, 1)) == []
+    assert culler.cull(today=date(2029, 1, 1)) == []
+    assert plan_destruction.call_count == 2
+    assert [attempts for attempts, _ in culler.backoffs.values()] == [1, 1]
+    culler.backoffs = {hostname: (1, 0) for hostname in culler.backoffs}
+    assert culler.cull(today=date(2029, 1, 1)) == []
+    assert plan_destruction.call_count == 3
+    assert sorted(attempts for attempts, _ in culler.backoffs.values()) == [1, 2]
+
+
+def test_get_delay(app):
+    from mchub.models.magic_castle.expired_cluster_culler import ExpiredClusterCuller
+
+    set_expiration_dates()
+    culler = ExpiredClusterCuller()
+    # Until the next expiration date, at most the maximum interval
+    assert culler.get_delay(3600, now=datetime(2029, 6, 1)) == 3600
+    assert culler.get_delay(3600, now=datetime(2029, 12, 31, 23, 30)) == 1800
+    assert culler.get_delay(3600, now=datetime(2031, 1, 1)) == 3600
+    culler.remaining = True
+    assert culler.get_delay(3600, now=datetime(2029, 6, 1)) == culler.min_backoff
+
+
+def test_cull_planned_destruction(app, mocker):
+    from os import path
+    from mchub.models.magic_castle.magic_castle import (
+        MagicCastle,
+        MagicCastleORM,
+        TERRAFORM_PLAN_BINARY_FILENAME,
+        TERRAFORM_PLAN_HASH_FILENAME,
+    )
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.models.magic_castle.plan_type import PlanType
+    from mchub.models.magic_castle.expired_cluster_culler import (
+        ExpiredClusterCuller,
+        CULLER_APPLY_PRIORITY,
+    )
+    from mchub.database import db
+
+    run = mocker.patch(
+        "mchub.models.magic_castle.magic_castle.run", side_effect=fake_run
+    )
+    scheduler = mocker.patch(
+        "mchub.models.magic_castle.magic_castle.get_apply_scheduler"
+    ).return_value
+    set_expiration_dates()
+
+    # The destruction was planned by the user, but never applied
+    orm = db.session.scalar(
+        db.select(MagicCastleORM).filter_by(hostname="valid1.magic-castle.cloud")
+    )
+    orm.plan_type = PlanType.DESTROY
+    orm.plan = {"resource_changes": []}
+    db.session.commit()
+    cluster = MagicCastle(orm)
+    with open(path.join(cluster.path, TERRAFORM_PLAN_BINARY_FILENAME), "w") as plan:
+        plan.write("plan")
+    with open(path.join(cluster.path, TERRAFORM_PLAN_HASH_FILENAME), "w") as hash_:
+        hash_.write(cluster.get_plan_hash(destroy=True))
+
+    culler = ExpiredClusterCuller(max_clusters=4)
+    assert "valid1.magic-castle.cloud" in culler.cull(today=date(2029, 1, 1))
+    assert not any(args.args[0][:2] == ["terraform", "plan"] for args in run.mock_calls)
+    assert orm.status == ClusterStatusCode.DESTROY_QUEUED
+    scheduler.enqueue.assert_called_once_with(
+        orm.id, orm.project_id, priority=CULLER_APPLY_PRIORITY
+    )
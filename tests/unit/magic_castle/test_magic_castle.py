@@ -1,7 +1,10 @@
 import pytest
 
 from copy import deepcopy
+from os import path
+from shutil import copytree
 from subprocess import CalledProcessError
+from unittest.mock import Mock
 
 from ...test_helpers import (
     client,
@@ -15,13 +18,60 @@ from ...mocks.configuration.config_mock import (
 )  # noqa;
 from ...data import CLUSTERS_CONFIG, VALID_CLUSTER_CONFIGURATION
 
+# Modules of Magic Castle 14 as installed by terraform init
+TERRAFORM_MODULES_PATH = path.join(
+    path.dirname(__file__), "..", "..", "data", "terraform-modules"
+)
+
+
+def install_terraform_modules(cluster_path):
+    copytree(TERRAFORM_MODULES_PATH, path.join(cluster_path, ".terraform", "modules"))
+
 
 @pytest.mark.usefixtures("fake_successful_subprocess_run")
 def test_create_magic_castle_plan_valid(app):
     from mchub.models.magic_castle.magic_castle import MagicCastle
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.jobs.job_queue import get_plan_queue
+    from mchub.database import db
 
     cluster = MagicCastle()
-    cluster.plan_creation(deepcopy(VALID_CLUSTER_CONFIGURATION))
+    job_id = cluster.plan_creation(deepcopy(VALID_CLUSTER_CONFIGURATION))
+    get_plan_queue().wait(job_id)
+    db.session.refresh(cluster.orm)
+    assert cluster.status == ClusterStatusCode.CREATED
+    assert cluster.plan == {
+        "summary_version": 1,
+        "types": [],
+        "actions": [],
+        "resources": [],
+    }
+
+
+def test_create_magic_castle_plan_queued(app, monkeypatch):
+    from threading import Event
+    from mchub.models.magic_castle.magic_castle import MagicCastle
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.jobs.job_queue import get_plan_queue
+
+    plan_released = Event()
+
+    def fake_run(process_args, *args, **kwargs):
+        if process_args[:2] == ["terraform", "plan"]:
+            plan_released.wait(timeout=5)
+        mock = Mock()
+        mock.stdout = "{}"
+        return mock
+
+    monkeypatch.setattr("mchub.models.magic_castle.magic_castle.run", fake_run)
+    monkeypatch.setattr("mchub.models.terraform.terraform_init.run", fake_run)
+    cluster = MagicCastle()
+    job_id = cluster.plan_creation(deepcopy(VALID_CLUSTER_CONFIGURATION))
+    assert get_plan_queue().is_running(job_id)
+    assert cluster.status == ClusterStatusCode.PLAN_RUNNING
+    assert cluster.is_busy
+    plan_released.set()
+    get_plan_queue().wait(job_id)
 
 
 @pytest.mark.usefixtures("fake_successful_subprocess_run")
@@ -30,9 +80,11 @@ def test_create_magic_castle_twice(app):
     from mchub.exceptions.invalid_usage_exception import (
         ClusterExistsException,
     )
+    from mchub.jobs.job_queue import get_plan_queue
 
     cluster1 = MagicCastle()
-    cluster1.plan_creation(deepcopy(VALID_CLUSTER_CONFIGURATION))
+    job_id = cluster1.plan_creation(deepcopy(VALID_CLUSTER_CONFIGURATION))
+    get_plan_queue().wait(job_id)
 
     cluster2 = MagicCastle()
     with pytest.raises(ClusterExistsException):
@@ -59,6 +111,7 @@ def test_create_magic_castle_init_fail(app, monkeypatch):
             raise CalledProcessError(1, "terraform init")
 
     monkeypatch.setattr("mchub.models.magic_castle.magic_castle.run", fake_run)
+    monkeypatch.setattr("mchub.models.terraform.terraform_init.run", fake_run)
     cluster = MagicCastle()
     with pytest.raises(PlanException, match="Could not initialize Terraform modules."):
         cluster.plan_creation(deepcopy(VALID_CLUSTER_CONFIGURATION))
@@ -66,26 +119,46 @@ def test_create_magic_castle_init_fail(app, monkeypatch):
 
 def test_create_magic_castle_plan_fail(app, monkeypatch):
     from mchub.models.magic_castle.magic_castle import MagicCastle
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
     from mchub.exceptions.server_exception import PlanException
+    from mchub.jobs.job_queue import get_plan_queue
+    from mchub.database import db
+
+    from mchub.models.magic_castle.progress_watcher import get_progress_report
 
     def fake_run(process_args, *args, **kwargs):
         if process_args[:2] == [
             "terraform",
             "plan",
         ]:
+            kwargs["stdout"].write("Error: Invalid image name\n")
             raise CalledProcessError(1, "terraform plan")
 
     monkeypatch.setattr("mchub.models.magic_castle.magic_castle.run", fake_run)
+    monkeypatch.setattr("mchub.models.terraform.terraform_init.run", fake_run)
     cluster = MagicCastle()
+    job_id = cluster.plan_creation(deepcopy(VALID_CLUSTER_CONFIGURATION))
     with pytest.raises(
         PlanException, match="An error occurred while planning changes."
     ):
-        cluster.plan_creation(deepcopy(VALID_CLUSTER_CONFIGURATION))
+        get_plan_queue().wait(job_id)
+    db.session.refresh(cluster.orm)
+    assert cluster.status == ClusterStatusCode.PLAN_ERROR
+
+    # The error is saved with the cluster, for the status requests of any process
+    error = {
+        "message": "An error occurred while planning changes.",
+        "log": "Error: Invalid image name",
+    }
+    assert get_progress_report(cluster)["error"] == error
 
 
 def test_create_magic_castle_plan_export_fail(app, monkeypatch):
     from mchub.models.magic_castle.magic_castle import MagicCastle
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
     from mchub.exceptions.server_exception import PlanException
+    from mchub.jobs.job_queue import get_plan_queue
+    from mchub.database import db
 
     def fake_run(process_args, *args, **kwargs):
         if process_args[:4] == [
@@ -97,11 +170,191 @@ def test_create_magic_castle_plan_export_fail(app, monkeypatch):
             raise CalledProcessError(1, "terraform show")
 
     monkeypatch.setattr("mchub.models.magic_castle.magic_castle.run", fake_run)
+    monkeypatch.setattr("mchub.models.terraform.terraform_init.run", fake_run)
     cluster = MagicCastle()
+    job_id = cluster.plan_creation(deepcopy(VALID_CLUSTER_CONFIGURATION))
     with pytest.raises(
         PlanException, match="An error occurred while exporting planned changes."
     ):
-        cluster.plan_creation(deepcopy(VALID_CLUSTER_CONFIGURATION))
+        get_plan_queue().wait(job_id)
+    db.session.refresh(cluster.orm)
+    assert cluster.status == ClusterStatusCode.PLAN_ERROR
+
+
+def test_plan_modification_reuses_plan(app, mocker):
+    from os import path, remove
+    from mchub.models.magic_castle.magic_castle import (
+        MagicCastle,
+        MagicCastleORM,
+        TERRAFORM_PLAN_HASH_FILENAME,
+    )
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.models.magic_castle.plan_type import PlanType
+    from mchub.models.magic_castle.plan_result import PlanResult
+    from mchub.jobs.job_queue import get_plan_queue
+    from mchub.database import db
+
+    mock = Mock()
+    mock.stdout = "{}"
+    run = mocker.patch("mchub.models.magic_castle.magic_castle.run", return_value=mock)
+    hostname = "created.magic-castle.cloud"
+    orm = db.session.scalar(db.select(MagicCastleORM).filter_by(hostname=hostname))
+    orm.plan_type = PlanType.NONE
+    cluster = MagicCastle(orm)
+    hash_path = path.join(cluster.path, TERRAFORM_PLAN_HASH_FILENAME)
+    with open(hash_path, "w") as hash_file:
+        hash_file.write(cluster.get_plan_hash(destroy=False))
+
+    configuration = {
+        **deepcopy(CLUSTERS_CONFIG[hostname]),
+        "cloud": {"id": 1, "name": "project-alice"},
+    }
+    assert cluster.plan_modification(deepcopy(configuration)) == (
+        PlanResult.REUSED,
+        None,
+    )
+    run.assert_not_called()
+    assert cluster.plan_type == PlanType.BUILD
+    assert cluster.status == ClusterStatusCode.CREATED
+    assert cluster.plan is not None
+
+    # A plan of another configuration or state cannot be reused
+    assert not cluster.is_plan_reusable(destroy=True)
+    with open(path.join(cluster.path, "terraform.tfstate"), "w") as state_file:
+        state_file.write("{}")
+    assert not cluster.is_plan_reusable(destroy=False)
+
+    remove(path.join(cluster.path, "terraform.tfstate"))
+    cluster.orm.plan_type = PlanType.NONE
+    remove(hash_path)
+    result, job_id = cluster.plan_modification(deepcopy(configuration))
+    assert result == PlanResult.QUEUED
+    get_plan_queue().wait(job_id)
+    assert run.call_args_list[0].args[0][:2] == ["terraform", "plan"]
+    with open(hash_path) as hash_file:
+        assert hash_file.read() == cluster.get_plan_hash(destroy=False)
+
+
+@pytest.mark.parametrize("targeted_plan_fails", [False, True])
+def test_plan_modification_instance_count(app, mocker, targeted_plan_fails):
+    from mchub.models.magic_castle.magic_castle import MagicCastle, MagicCastleORM
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.jobs.job_queue import get_plan_queue
+    from mchub.database import db
+
+    plans = []
+
+    def fake_run(process_args, *args, **kwargs):
+        if process_args[:2] == ["terraform", "plan"]:
+            plans.append(process_args)
+            if targeted_plan_fails and "-target" in process_args[-1]:
+                raise CalledProcessError(1, process_args)
+        mock = Mock()
+        mock.stdout = "{}"
+        return mock
+
+    mocker.patch("mchub.models.magic_castle.magic_castle.run", side_effect=fake_run)
+    hostname = "valid1.magic-castle.cloud"
+    orm = db.session.scalar(db.select(MagicCastleORM).filter_by(hostname=hostname))
+    orm.applied_config = orm.config
+    cluster = MagicCastle(orm)
+    install_terraform_modules(cluster.path)
+    configuration = {
+        **deepcopy(CLUSTERS_CONFIG[hostname]),
+        "cloud": {"id": 1, "name": "project-alice"},
+    }
+    configuration["instances"]["node"]["count"] = 3
+
+    _, job_id = cluster.plan_modification(deepcopy(configuration))
+    get_plan_queue().wait(job_id)
+    db.session.refresh(orm)
+    assert orm.status == ClusterStatusCode.PROVISIONING_RUNNING
+    assert (
+        "-target=module.openstack.openstack_compute_instance_v2.instances" in plans[0]
+    )
+    if targeted_plan_fails:
+        # The whole configuration is planned instead
+        assert len(plans) == 2
+        assert not any(arg.startswith("-target") for arg in plans[1])
+    else:
+        assert len(plans) == 1
+
+    # Any other change requires a plan of the whole configuration
+    configuration["nb_users"] = 20
+    cluster.set_configuration(configuration)
+    assert cluster.get_plan_targets() == []
+
+
+def test_get_plan_targets_module_layout(app, mocker):
+    from mchub.models.magic_castle.magic_castle import MagicCastle, MagicCastleORM
+    from mchub.database import db
+
+    hostname = "valid1.magic-castle.cloud"
+    orm = db.session.scalar(db.select(MagicCastleORM).filter_by(hostname=hostname))
+    orm.applied_config = orm.config
+    cluster = MagicCastle(orm)
+    configuration = {
+        **deepcopy(CLUSTERS_CONFIG[hostname]),
+        "cloud": {"id": 1, "name": "project-alice"},
+    }
+    configuration["instances"]["node"]["count"] = 3
+    cluster.set_configuration(configuration)
+    db.session.commit()
+
+    # Without the installed modules, the targets cannot be verified
+    assert cluster.get_plan_targets() == []
+
+    install_terraform_modules(cluster.path)
+    targets = cluster.get_plan_targets()
+    assert "module.openstack.module.configuration" in targets
+    assert "module.openstack.module.provision" in targets
+    assert (
+        "module.openstack.openstack_networking_floatingip_associate_v2.fip" in targets
+    )
+
+    # A target missing from the module layout, e.g. the module of the hieradata of
+    # the former versions, would be silently ignored by terraform plan
+    mocker.patch.dict(
+        "mchub.models.magic_castle.magic_castle.MAGIC_CASTLE_SCALING_RESOURCES",
+        {
+            "openstack": [
+                "openstack_compute_instance_v2.instances",
+                "module.cluster_config",
+            ]
+        },
+    )
+    assert cluster.get_plan_targets() == []
+
+
+def test_terraform_apply_saves_results(app, mocker):
+    from mchub.models.magic_castle.magic_castle import (
+        MagicCastle,
+        MagicCastleORM,
+        terraform_apply,
+    )
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.models.magic_castle.plan_type import PlanType
+    from mchub.database import db
+
+    popen = mocker.patch(
+        "mchub.models.terraform.terraform_apply_log_parser.Popen",
+    )
+    popen.return_value.__enter__.return_value.stdout = [b"Apply complete!\n"]
+    popen.return_value.__enter__.return_value.wait.return_value = 0
+    create_app = mocker.patch("mchub.create_app")
+    orm = db.session.scalar(
+        db.select(MagicCastleORM).filter_by(hostname="valid1.magic-castle.cloud")
+    )
+    cluster = MagicCastle(orm)
+
+    terraform_apply(orm.id, {}, cluster.path, destroy=False)
+
+    # The results are saved with the session of the current application context
+    create_app.assert_not_called()
+    db.session.refresh(orm)
+    assert orm.status == ClusterStatusCode.PROVISIONING_RUNNING
+    assert orm.plan_type == PlanType.NONE
+    assert orm.tf_state.freeipa_passwd is not None
 
 
 def test_get_status_valid(app):
@@ -307,3 +560,36 @@ def test_allocated_resources_not_found(app):
         "pre_allocated_volume_count": 0,
         "pre_allocated_volume_size": 0,
     }
+
+
+def test_list_states(app):
+    from mchub.models.cloud.project import Project
+    from mchub.models.magic_castle.magic_castle import MagicCastle
+    from mchub.models.user import TokenSuperUser
+    from mchub.database import db
+
+    project_ids = [project.id for project in db.session.scalars(db.select(Project))]
+    assert MagicCastle.list_states(project_ids) == [
+        magic_castle.state for magic_castle in TokenSuperUser().magic_castles
+    ]
+
+
+def test_list_states_provisioning(app, mocker):
+    from mchub.models.magic_castle.magic_castle import MagicCastle, MagicCastleORM
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.database import db
+
+    check_online = mocker.patch(
+        "mchub.models.puppet.provisioning_manager.ProvisioningManager.check_online"
+    )
+    orm = db.session.scalar(
+        db.select(MagicCastleORM).filter_by(hostname="valid1.magic-castle.cloud")
+    )
+    orm.status = ClusterStatusCode.PROVISIONING_RUNNING
+    db.session.commit()
+
+    states = MagicCastle.list_states([orm.project_id])
+    assert {state["hostname"]: state["status"] for state in states}[
+        "valid1.magic-castle.cloud"
+    ] == ClusterStatusCode.PROVISIONING_RUNNING
+    check_online.assert_not_called()
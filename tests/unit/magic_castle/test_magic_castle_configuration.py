@@ -125,3 +125,28 @@ def test_properties():
     config = MagicCastleConfiguration("openstack", CONFIG_DICT)
     assert config.cluster_name == "foo-123"
     assert config.domain == "magic-castle.cloud"
+
+
+def test_get_instance_count_changes():
+    from mchub.models.magic_castle.magic_castle_configuration import (
+        MagicCastleConfiguration,
+    )
+
+    applied = MagicCastleConfiguration("openstack", deepcopy(CONFIG_DICT))
+    assert applied.get_instance_count_changes(None) is None
+    assert applied.get_instance_count_changes(applied) is None
+
+    config = deepcopy(CONFIG_DICT)
+    config["instances"]["node"]["count"] = 5
+    scaled = MagicCastleConfiguration("openstack", config)
+    assert scaled.get_instance_count_changes(applied) == {"node": (3, 5)}
+
+    config["instances"]["node"]["type"] = "p4-6gb"
+    resized = MagicCastleConfiguration("openstack", config)
+    assert resized.get_instance_count_changes(applied) is None
+
+    config = deepcopy(CONFIG_DICT)
+    config["instances"]["node"]["count"] = 5
+    config["nb_users"] = 50
+    modified = MagicCastleConfiguration("openstack", config)
+    assert modified.get_instance_count_changes(applied) is None
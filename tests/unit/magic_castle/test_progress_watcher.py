@@ -0,0 +1,32 @@
+from mchub.models.magic_castle.progress_watcher import get_progress_delta
+
+PROGRESS = [
+    {"address": "a", "type": "t", "change": {"actions": ["create"]}, "progress": "queued"},
+    {"address": "b", "type": "t", "change": {"actions": ["create"]}, "progress": "queued"},
+]
+
+
+def test_progress_delta_first_report():
+    report = {"status": "build_running", "stateful": False, "progress": PROGRESS}
+    assert get_progress_delta(None, report) == ("snapshot", report)
+
+
+def test_progress_delta_unchanged():
+    report = {"status": "build_running", "stateful": False, "progress": PROGRESS}
+    assert get_progress_delta(report, dict(report)) == (None, None)
+
+
+def test_progress_delta_changed_resource():
+    previous = {"status": "build_running", "stateful": False, "progress": PROGRESS}
+    progress = [PROGRESS[0], {**PROGRESS[1], "progress": "done"}]
+    current = {"status": "build_running", "stateful": True, "progress": progress}
+    assert get_progress_delta(previous, current) == (
+        "delta",
+        {"stateful": True, "progress": [progress[1]]},
+    )
+
+
+def test_progress_delta_new_plan():
+    previous = {"status": "created", "stateful": False}
+    current = {"status": "build_queued", "stateful": False, "progress": PROGRESS}
+    assert get_progress_delta(previous, current) == ("snapshot", current)
@@ -0,0 +1,97 @@
+from datetime import datetime
+from unittest.mock import Mock
+
+from ...test_helpers import app, generate_test_clusters  # noqa;
+from ...mocks.configuration.config_mock import (
+    config_auth_none_mock as config_mock,
+)  # noqa;
+
+HOSTNAME = "valid1.magic-castle.cloud"
+
+
+def set_provisioning_running(created):
+    from mchub.models.magic_castle.magic_castle import MagicCastleORM
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.database import db
+
+    orm = db.session.scalar(db.select(MagicCastleORM).filter_by(hostname=HOSTNAME))
+    orm.status = ClusterStatusCode.PROVISIONING_RUNNING
+    orm.created = created
+    db.session.commit()
+
+
+def get_status():
+    from mchub.models.magic_castle.magic_castle import MagicCastleORM
+    from mchub.database import db
+
+    return db.session.scalar(
+        db.select(MagicCastleORM.status).filter_by(hostname=HOSTNAME)
+    )
+
+
+def test_probe_online(app, mocker):
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.models.puppet.provisioning_prober import ProvisioningProber
+
+    check_online = mocker.patch(
+        "mchub.models.puppet.provisioning_manager.ProvisioningManager.check_online",
+        return_value=True,
+    )
+    set_provisioning_running(datetime.utcnow())
+    prober = ProvisioningProber(max_workers=2)
+    assert prober.probe() == [HOSTNAME]
+    assert check_online.call_args.args == (HOSTNAME,)
+    assert check_online.call_args.kwargs["session"] is prober.session
+    assert get_status() == ClusterStatusCode.PROVISIONING_SUCCESS
+    assert prober.probe() == []
+
+
+def test_probe_backoff(app, mocker):
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.models.puppet.provisioning_prober import ProvisioningProber
+
+    check_online = mocker.patch(
+        "mchub.models.puppet.provisioning_manager.ProvisioningManager.check_online",
+        return_value=False,
+    )
+    set_provisioning_running(datetime.utcnow())
+    prober = ProvisioningProber(max_workers=2, min_backoff=60)
+    assert prober.probe() == [HOSTNAME]
+    # The cluster is not checked again before the end of its backoff delay
+    assert prober.probe() == []
+    assert check_online.call_count == 1
+    assert get_status() == ClusterStatusCode.PROVISIONING_RUNNING
+
+    prober.backoffs[HOSTNAME] = (1, 0)
+    assert prober.probe() == [HOSTNAME]
+    assert prober.backoffs[HOSTNAME][0] == 2
+
+
+def test_probe_timeout(app, mocker):
+    from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.models.puppet.provisioning_prober import ProvisioningProber
+
+    mocker.patch(
+        "mchub.models.puppet.provisioning_manager.ProvisioningManager.check_online",
+        return_value=False,
+    )
+    set_provisioning_running(datetime(2022, 1, 1))
+    prober = ProvisioningProber(max_workers=2)
+    assert prober.probe() == [HOSTNAME]
+    assert get_status() == ClusterStatusCode.PROVISIONING_ERROR
+    assert HOSTNAME not in prober.backoffs
+
+
+def test_check_online_session():
+    from mchub.models.puppet.provisioning_manager import ProvisioningManager
+
+    session = Mock()
+    status_codes = {"jupyter": 405, "ipa": 301, "mokey": 405}
+    session.head.side_effect = lambda url, **kwargs: Mock(
+        status_code=status_codes[url.split("//")[1].split(".")[0]]
+    )
+    assert ProvisioningManager.check_online("test.example.com", session=session)
+    assert session.head.call_count == 3
+
+    session.head.side_effect = lambda url, **kwargs: Mock(status_code=502)
+    assert not ProvisioningManager.check_online("test.example.com", session=session)
@@ -0,0 +1,169 @@
+import json
+import sys
+
+from os import rename
+from subprocess import CalledProcessError
+
+import pytest
+
+from mchub.models.terraform.terraform_apply_log_parser import TerraformApplyLogParser
+from mchub.models.terraform.terraform_plan_parser import TerraformPlanParser
+
+FIP = "module.openstack.openstack_networking_floatingip_v2.fip[0]"
+KEYPAIR = "module.openstack.openstack_compute_keypair_v2.keypair"
+
+
+def test_parse():
+    events = TerraformApplyLogParser.parse(
+        f"{FIP}: Creating...\n"
+        f"{KEYPAIR}: Creating...\n"
+        f"{FIP}: Still creating... [10s elapsed]\n"
+        f"{FIP}: Creation complete after 12s [id=1234]\n"
+        f"{FIP}: Creating...\n"
+    )
+    assert events == {
+        (FIP, "creation_running"): 0,
+        (KEYPAIR, "creation_running"): 1,
+        (FIP, "creation_complete"): 2,
+    }
+
+
+def test_parse_file_incremental(tmp_path):
+    log_path = str(tmp_path / "terraform_apply.log")
+    assert TerraformApplyLogParser.parse_file(log_path) == {}
+
+    with open(log_path, "w") as log_file:
+        log_file.write(f"{FIP}: Creating...\n{FIP}: Creation compl")
+    assert TerraformApplyLogParser.parse_file(log_path) == {
+        (FIP, "creation_running"): 0
+    }
+
+    # The incomplete line is parsed once terraform has finished writing it
+    with open(log_path, "a") as log_file:
+        log_file.write(f"ete after 1s [id=1234]\n")
+    assert TerraformApplyLogParser.parse_file(log_path) == {
+        (FIP, "creation_running"): 0,
+        (FIP, "creation_complete"): 1,
+    }
+
+    # The parser starts over when the log is rotated
+    rename(log_path, log_path + ".1")
+    with open(log_path, "w") as log_file:
+        log_file.write(f"{FIP}: Destroying...\n")
+    assert TerraformApplyLogParser.parse_file(log_path) == {
+        (FIP, "destruction_running"): 0
+    }
+
+
+def fake_terraform_apply(*lines, returncode=0):
+    script = "".join(f"print({line!r}, flush=True)\n" for line in lines)
+    return [sys.executable, "-c", script + f"raise SystemExit({returncode})"]
+
+
+def test_run_indexes_streamed_output(tmp_path):
+    log_path = str(tmp_path / "terraform_apply.log")
+    seen = []
+
+    def on_events():
+        # The running apply is answered from memory
+        seen.append(TerraformApplyLogParser.parse_file(log_path))
+
+    TerraformApplyLogParser.subscribe(log_path, on_events)
+    try:
+        TerraformApplyLogParser.run(
+            fake_terraform_apply(
+                f"{FIP}: Creating...",
+                f"{FIP}: Still creating... [10s elapsed]",
+                f"{FIP}: Creation complete after 12s [id=1234]",
+            ),
+            log_path,
+        )
+    finally:
+        TerraformApplyLogParser.unsubscribe(log_path, on_events)
+
+    assert seen[0] == {(FIP, "creation_running"): 0}
+    assert seen[1] == {(FIP, "creation_running"): 0, (FIP, "creation_complete"): 1}
+    with open(log_path) as log_file:
+        assert "Still creating" in log_file.read()
+    # The log is not parsed again once the apply is over
+    assert TerraformApplyLogParser.parse_file(log_path) == seen[1]
+
+
+def test_run_failure(tmp_path):
+    log_path = str(tmp_path / "terraform_apply.log")
+    with pytest.raises(CalledProcessError):
+        TerraformApplyLogParser.run(
+            fake_terraform_apply(f"{FIP}: Destroying...", returncode=1), log_path
+        )
+    assert TerraformApplyLogParser.parse_file(log_path) == {
+        (FIP, "destruction_running"): 0
+    }
+
+
+def json_message(message_type, action, **hook):
+    return json.dumps(
+        {
+            "@level": "info",
+            "@message": f"{FIP}: {message_type}",
+            "type": message_type,
+            "hook": {"resource": {"addr": FIP}, "action": action, **hook},
+        }
+    )
+
+
+def test_parse_json_output(tmp_path):
+    log_path = str(tmp_path / "terraform_apply.log")
+    with open(log_path, "w") as log_file:
+        for line in [
+            json.dumps({"@level": "info", "type": "version", "terraform": "1.5.7"}),
+            json_message("apply_start", "delete"),
+            json_message("apply_complete", "delete", elapsed_seconds=2),
+            json_message("apply_start", "create"),
+            json_message("apply_progress", "create", elapsed_seconds=10),
+            "{not json",
+        ]:
+            log_file.write(line + "\n")
+
+    events = TerraformApplyLogParser.parse_file(log_path)
+    assert events == {
+        (FIP, "destruction_running"): 0,
+        (FIP, "destruction_complete"): 1,
+        (FIP, "creation_running"): 2,
+    }
+    assert TerraformApplyLogParser.get_elapsed(log_path) == {FIP: 10}
+
+    plan = {
+        "resource_changes": [
+            {"address": FIP, "type": "fip", "change": {"actions": ["delete", "create"]}}
+        ]
+    }
+    change = TerraformPlanParser.get_progress(
+        plan, events, TerraformApplyLogParser.get_elapsed(log_path)
+    )[0]["change"]
+    assert change == {
+        "actions": ["delete", "create"],
+        "progress": "running",
+        "elapsed_seconds": 10,
+    }
+
+
+def test_get_progress_replaced_resource():
+    plan = {
+        "resource_changes": [
+            {"address": FIP, "type": "fip", "change": {"actions": ["delete", "create"]}}
+        ]
+    }
+    events = TerraformApplyLogParser.parse(
+        f"{FIP}: Destroying...\n"
+        f"{FIP}: Destruction complete after 1s\n"
+        f"{FIP}: Creating...\n"
+    )
+    assert TerraformPlanParser.get_progress(plan, events)[0]["change"]["progress"] == "running"
+
+    events = TerraformApplyLogParser.parse(
+        f"{FIP}: Destroying...\n"
+        f"{FIP}: Destruction complete after 1s\n"
+        f"{FIP}: Creating...\n"
+        f"{FIP}: Creation complete after 1s\n"
+    )
+    assert TerraformPlanParser.get_progress(plan, events)[0]["change"]["progress"] == "done"
@@ -0,0 +1,172 @@
+import json
+
+from os import makedirs, path, stat
+from subprocess import TimeoutExpired
+from threading import Barrier
+
+import pytest
+
+from mchub.init_clusters import init_clusters
+from mchub.models.terraform.terraform_init import InitResult, TerraformInitManager
+
+PROVIDER = ".terraform/providers/registry.terraform.io/terraform-provider-openstack/openstack/1.51.1/linux_amd64/terraform-provider-openstack"
+
+
+def write_cluster(clusters_path, hostname, source="./openstack"):
+    cluster_path = path.join(clusters_path, hostname)
+    makedirs(cluster_path)
+    with open(path.join(cluster_path, "main.tf.json"), "w") as main_file:
+        json.dump({"module": {"openstack": {"source": source}}}, main_file)
+    return cluster_path
+
+
+@pytest.fixture
+def terraform_init_runs(mocker):
+    """
+    Fakes terraform init by writing a provider and a lock file in the cluster folder.
+    """
+    runs = []
+
+    def fake_run(args, cwd, **kwargs):
+        runs.append(cwd)
+        makedirs(path.join(cwd, path.dirname(PROVIDER)), exist_ok=True)
+        with open(path.join(cwd, PROVIDER), "w") as provider:
+            provider.write("binary")
+        makedirs(path.join(cwd, ".terraform", "modules"), exist_ok=True)
+        with open(path.join(cwd, ".terraform", "modules", "modules.json"), "w") as file_:
+            file_.write("{}")
+        with open(path.join(cwd, ".terraform.lock.hcl"), "w") as lock_file:
+            lock_file.write('provider "openstack" {}')
+
+    mocker.patch("mchub.models.terraform.terraform_init.run", side_effect=fake_run)
+    return runs
+
+
+@pytest.fixture
+def manager(tmp_path, mocker):
+    manager = TerraformInitManager(
+        skeletons_path=str(tmp_path / ".terraform-skeletons"),
+        plugin_cache_path=str(tmp_path / "plugin-cache"),
+    )
+    mocker.patch(
+        "mchub.models.terraform.terraform_init.get_terraform_init_manager",
+        return_value=manager,
+    )
+    mocker.patch("mchub.init_clusters.get_terraform_init_manager", return_value=manager)
+    return manager
+
+
+def test_init_clones_skeleton(tmp_path, manager, terraform_init_runs):
+    first = write_cluster(tmp_path, "first.mc.ca")
+    second = write_cluster(tmp_path, "second.mc.ca")
+
+    assert manager.init(first) == InitResult.INITIALIZED
+    assert manager.init(second) == InitResult.CLONED
+    assert terraform_init_runs == [first]
+
+    # Provider binaries are hard linked, the other files are copied
+    assert stat(path.join(first, PROVIDER)).st_ino == stat(
+        path.join(second, PROVIDER)
+    ).st_ino
+    modules_file = path.join(".terraform", "modules", "modules.json")
+    assert stat(path.join(first, modules_file)).st_ino != stat(
+        path.join(second, modules_file)
+    ).st_ino
+    assert path.isfile(path.join(second, ".terraform.lock.hcl"))
+
+
+def test_init_other_modules(tmp_path, manager, terraform_init_runs):
+    first = write_cluster(tmp_path, "first.mc.ca")
+    second = write_cluster(tmp_path, "second.mc.ca", source="./aws")
+
+    assert manager.init(first) == InitResult.INITIALIZED
+    assert manager.init(second) == InitResult.INITIALIZED
+    assert terraform_init_runs == [first, second]
+
+
+def test_init_different_lock_file(tmp_path, manager, terraform_init_runs):
+    first = write_cluster(tmp_path, "first.mc.ca")
+    second = write_cluster(tmp_path, "second.mc.ca")
+    with open(path.join(second, ".terraform.lock.hcl"), "w") as lock_file:
+        lock_file.write('provider "openstack" { version = "1.49.0" }')
+
+    manager.init(first)
+    assert manager.init(second) == InitResult.INITIALIZED
+    assert terraform_init_runs == [first, second]
+
+
+def test_init_unchanged(tmp_path, manager, terraform_init_runs):
+    cluster = write_cluster(tmp_path, "cluster.mc.ca")
+
+    assert manager.init(cluster) == InitResult.INITIALIZED
+    assert manager.init(cluster) == InitResult.SKIPPED
+    assert manager.init(cluster, upgrade=True) == InitResult.INITIALIZED
+
+    # A new module source or a new lock file requires a new initialization
+    with open(path.join(cluster, ".terraform.lock.hcl"), "a") as lock_file:
+        lock_file.write("\n")
+    assert manager.init(cluster) == InitResult.INITIALIZED
+    with open(path.join(cluster, "main.tf.json"), "w") as main_file:
+        json.dump({"module": {"openstack": {"source": "./aws"}}}, main_file)
+    assert manager.init(cluster) == InitResult.INITIALIZED
+    assert manager.init(cluster) == InitResult.SKIPPED
+
+
+def test_init_clusters(tmp_path, manager, terraform_init_runs):
+    for index in range(6):
+        write_cluster(tmp_path, f"cluster{index}.mc.ca")
+    makedirs(tmp_path / "empty")
+
+    report = init_clusters(str(tmp_path), max_workers=3)
+    assert report["summary"] == {"initialized": 1, "cloned": 5}
+    assert len(report["clusters"]) == 6
+    assert len(terraform_init_runs) == 1
+    for index in range(6):
+        assert path.isfile(tmp_path / f"cluster{index}.mc.ca" / PROVIDER)
+
+    report = init_clusters(str(tmp_path), max_workers=3)
+    assert report["summary"] == {"skipped": 6}
+    json.dumps(report)
+
+
+def test_init_clusters_concurrently(tmp_path, manager, terraform_init_runs):
+    from mchub.models.terraform import terraform_init
+
+    manager.init(write_cluster(tmp_path, "first.mc.ca"))
+    clusters_path = tmp_path / "clusters"
+    for index in range(2):
+        cluster_path = write_cluster(clusters_path, f"cluster{index}.mc.ca")
+        with open(path.join(cluster_path, ".terraform.lock.hcl"), "w") as lock_file:
+            lock_file.write('provider "openstack" { version = "1.49.0" }')
+
+    # The lock files differ from the skeleton's, each terraform init waits for the
+    # other one, which only returns if they run concurrently
+    barrier = Barrier(2, timeout=5)
+    fake_run = terraform_init.run.side_effect
+
+    def concurrent_run(args, cwd, **kwargs):
+        barrier.wait()
+        fake_run(args, cwd, **kwargs)
+
+    terraform_init.run.side_effect = concurrent_run
+    report = init_clusters(str(clusters_path), max_workers=2)
+    assert report["summary"] == {"initialized": 2}
+
+
+def test_init_clusters_failures(tmp_path, manager, mocker):
+    def fake_run(args, cwd, **kwargs):
+        if cwd.endswith("slow.mc.ca"):
+            raise TimeoutExpired(args, kwargs["timeout"])
+        raise OSError("terraform")
+
+    mocker.patch("mchub.models.terraform.terraform_init.run", side_effect=fake_run)
+    write_cluster(tmp_path, "broken.mc.ca", source="./broken")
+    write_cluster(tmp_path, "slow.mc.ca", source="./slow")
+
+    report = init_clusters(str(tmp_path), max_workers=2, timeout=1)
+    assert report["summary"] == {"failed": 1, "timeout": 1}
+    assert [cluster["cluster"] for cluster in report["clusters"]] == [
+        "broken.mc.ca",
+        "slow.mc.ca",
+    ]
+    assert report["clusters"][0]["error"] == "terraform"
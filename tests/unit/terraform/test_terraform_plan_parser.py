@@ -76,6 +76,19 @@ def test_get_resources_changes():
     assert TerraformPlanParser.get_resources_changes(plan) == result
 
 
+def test_summarize(missing_floating_ips_initial_plan):
+    summary = TerraformPlanParser.summarize(missing_floating_ips_initial_plan)
+    assert TerraformPlanParser.get_resources_changes(
+        summary
+    ) == TerraformPlanParser.get_resources_changes(missing_floating_ips_initial_plan)
+    # Types and actions shared by several resources are stored once
+    assert len(summary["types"]) == len(set(summary["types"]))
+    assert len(summary["actions"]) < len(summary["resources"])
+    assert len(json.dumps(summary)) * 10 < len(
+        json.dumps(missing_floating_ips_initial_plan)
+    )
+
+
 def test_get_done_changes(missing_floating_ips_initial_plan):
     progress = TerraformPlanParser.get_done_changes(
         missing_floating_ips_initial_plan,
@@ -110,3 +110,20 @@ def test_volume_size_empty(empty_state):
 def test_volume_size_missing_nodes(missing_nodes_state):
     state = TerraformState(missing_nodes_state)
     assert state.volume_size == 200
+
+
+def test_image_first_resource_with_instances():
+    state = TerraformState(
+        {
+            "resources": [
+                {"type": "openstack_images_image_v2", "name": "image", "instances": []},
+                {
+                    "type": "openstack_images_image_v2",
+                    "name": "image",
+                    "instances": [{"attributes": {"name": "Rocky-9"}}],
+                },
+            ]
+        }
+    )
+    assert state.image == "Rocky-9"
+    assert state.freeipa_passwd is None
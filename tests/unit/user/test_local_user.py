@@ -41,12 +41,13 @@ def test_query_magic_castles(app):
 def test_create_empty_magic_castle(app):
     from mchub.models.magic_castle.magic_castle import MagicCastle
     from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.jobs.job_queue import get_plan_queue
 
     from mchub.models.magic_castle.magic_castle import MagicCastleORM
     from mchub.database import db
 
     magic_castle = MagicCastle()
-    magic_castle.plan_creation(
+    job_id = magic_castle.plan_creation(
         {
             "cloud": {"id": 1, "name": "test-project"},
             "cluster_name": "anon123",
@@ -77,6 +78,8 @@ def test_create_empty_magic_castle(app):
             "guest_passwd": "",
         }
     )
+    get_plan_queue().wait(job_id)
+    db.session.expire_all()
 
     data = db.session.get(MagicCastleORM, magic_castle.orm.id)
     assert data.status == ClusterStatusCode.CREATED
@@ -81,10 +81,12 @@ def test_query_magic_castles_admin(admin):
 def test_create_empty_magic_castle(alice):
     from mchub.models.magic_castle.magic_castle import MagicCastle
     from mchub.models.magic_castle.cluster_status_code import ClusterStatusCode
+    from mchub.jobs.job_queue import get_plan_queue
+    from mchub.database import db
     from mchub.models.magic_castle.plan_type import PlanType
 
     magic_castle = MagicCastle()
-    magic_castle.plan_creation(
+    job_id = magic_castle.plan_creation(
         {
             "cloud": {"id": 1, "name": "test-project"},
             "cluster_name": "alice123",
@@ -115,6 +117,8 @@ def test_create_empty_magic_castle(alice):
             "guest_passwd": "",
         }
     )
+    get_plan_queue().wait(job_id)
+    db.session.expire_all()
     magic_castle2 = alice.magic_castles[-1]
     assert magic_castle2.hostname == "alice123.mc.ca"
     assert magic_castle2.status == ClusterStatusCode.CREATED
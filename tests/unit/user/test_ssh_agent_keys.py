@@ -0,0 +1,49 @@
+from unittest.mock import Mock
+
+from mchub.models.ssh_agent_keys import SSHAgentKeys
+
+KEYS = ["ssh-ed25519 AAAA alice@laptop"]
+NEW_KEYS = ["ssh-ed25519 BBBB alice@laptop"]
+
+
+def test_keys_cached(monkeypatch):
+    monkeypatch.setenv("SSH_AUTH_SOCK", "/tmp/agent.1")
+    loader = Mock(return_value=KEYS)
+    keys = SSHAgentKeys(ttl=60, loader=loader)
+    assert keys.get() == KEYS
+    assert keys.get() == KEYS
+    assert loader.call_count == 1
+
+
+def test_keys_refreshed_in_background(monkeypatch, mocker):
+    monkeypatch.setenv("SSH_AUTH_SOCK", "/tmp/agent.1")
+    monotonic = mocker.patch(
+        "mchub.models.ssh_agent_keys.monotonic", return_value=100
+    )
+    thread = mocker.patch("mchub.models.ssh_agent_keys.Thread")
+    loader = Mock(return_value=KEYS)
+    keys = SSHAgentKeys(ttl=60, loader=loader)
+    keys.get()
+
+    # The expired keys are returned while they are listed again
+    monotonic.return_value = 161
+    loader.return_value = NEW_KEYS
+    assert keys.get() == KEYS
+    assert keys.get() == KEYS
+    assert thread.call_count == 1
+    assert loader.call_count == 1
+    thread.call_args.kwargs["target"](*thread.call_args.kwargs["args"])
+    assert loader.call_count == 2
+    assert keys.get() == NEW_KEYS
+    assert thread.call_count == 1
+
+
+def test_keys_reloaded_on_agent_change(monkeypatch):
+    monkeypatch.setenv("SSH_AUTH_SOCK", "/tmp/agent.1")
+    loader = Mock(return_value=KEYS)
+    keys = SSHAgentKeys(ttl=60, loader=loader)
+    keys.get()
+    monkeypatch.setenv("SSH_AUTH_SOCK", "/tmp/agent.2")
+    loader.return_value = NEW_KEYS
+    assert keys.get() == NEW_KEYS
+    assert loader.call_count == 2
@@ -0,0 +1,89 @@
+from unittest.mock import Mock
+
+from mchub.models.user_cache import UserCache, UserIdentity
+
+ALICE = "alice@computecanada.ca"
+BOB = "bob12.bobby@computecanada.ca"
+
+
+def test_get_cached_identity():
+    cache = UserCache(ttl=30)
+    loader = Mock(return_value=UserIdentity(id=2, project_ids=frozenset([1])))
+    assert cache.get(ALICE, loader).project_ids == {1}
+    assert cache.get(ALICE, loader).id == 2
+    assert loader.call_count == 1
+
+    # Entries are kept per user
+    cache.get(BOB, loader)
+    assert loader.call_count == 2
+
+
+def test_get_expired_identity(mocker):
+    cache = UserCache(ttl=30)
+    loader = Mock(return_value=UserIdentity(id=2, project_ids=frozenset()))
+    monotonic = mocker.patch("mchub.models.user_cache.monotonic", return_value=100)
+    cache.get(ALICE, loader)
+    monotonic.return_value = 129
+    cache.get(ALICE, loader)
+    assert loader.call_count == 1
+    monotonic.return_value = 131
+    cache.get(ALICE, loader)
+    assert loader.call_count == 2
+
+
+def test_unknown_user_not_cached():
+    cache = UserCache(ttl=30)
+    loader = Mock(return_value=None)
+    assert cache.get(ALICE, loader) is None
+    assert cache.get(ALICE, loader) is None
+    assert loader.call_count == 2
+
+
+def test_invalidate():
+    cache = UserCache(ttl=30)
+    loader = Mock(return_value=UserIdentity(id=2, project_ids=frozenset()))
+    cache.get(ALICE, loader)
+    cache.get(BOB, loader)
+    cache.invalidate(ALICE)
+    cache.get(ALICE, loader)
+    cache.get(BOB, loader)
+    assert loader.call_count == 3
+
+
+def test_invalidate_while_loading():
+    cache = UserCache(ttl=30)
+
+    def loader():
+        cache.invalidate(ALICE)
+        return UserIdentity(id=2, project_ids=frozenset())
+
+    cache.get(ALICE, loader)
+    reloader = Mock(return_value=UserIdentity(id=2, project_ids=frozenset()))
+    cache.get(ALICE, reloader)
+    assert reloader.call_count == 1
+
+
+def test_validator():
+    cache = UserCache(ttl=30)
+    loader = Mock(
+        return_value=UserIdentity(id=2, project_ids=frozenset(), membership_revision=1)
+    )
+    validator = Mock(return_value=True)
+    cache.get(ALICE, loader, validator)
+    cache.get(ALICE, loader, validator)
+    assert loader.call_count == 1
+    validator.assert_called_once_with(loader.return_value)
+
+    # The projects were changed by another process
+    validator.return_value = False
+    cache.get(ALICE, loader, validator)
+    assert loader.call_count == 2
+
+
+def test_keys_are_signed():
+    cache = UserCache(ttl=30, secret=b"secret")
+    loader = Mock(return_value=UserIdentity(id=2, project_ids=frozenset()))
+    cache.get(ALICE, loader)
+    assert ALICE.encode() not in b"".join(cache._entries)
+    assert cache._key(ALICE) == UserCache(ttl=30, secret=b"secret")._key(ALICE)
+    assert cache._key(ALICE) != UserCache(ttl=30)._key(ALICE)